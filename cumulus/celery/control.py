@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+from __future__ import absolute_import
+import time
+
+from celery.worker.control import Panel
+
+from cumulus.common.termination import mark_terminating
+
+# The remote control command telling workers a job is being terminated
+TERMINATING_COMMAND = 'cumulus_terminating'
+
+
+@Panel.register
+def cumulus_terminating(state, job_id=None, stamp=None, **kwargs):
+    """
+    Run in each worker on the broadcast, the flag is left on the host for
+    the tasks of the job to find.
+    """
+    mark_terminating(job_id, stamp)
+
+    return {'ok': 'job %s terminating' % job_id}
+
+
+def broadcast_terminating(app, job_id, stamp=None):
+    """
+    Tell all the workers on the broker that the job is being terminated. The
+    workers of both apps share the broker, so one broadcast reaches them all.
+    """
+    if stamp is None:
+        stamp = time.time()
+
+    app.control.broadcast(TERMINATING_COMMAND, arguments={
+        'job_id': str(job_id),
+        'stamp': stamp
+    })
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import time
+import zlib
+
+from celery import bootsteps
+
+import cumulus
+
+MONITOR_QUEUE = 'monitor'
+
+# The monitor tasks routed by the cluster they are monitoring, the cluster is
+# their first argument.
+CLUSTER_TASKS = (
+    'cumulus.starcluster.tasks.job.monitor_job',
+    'cumulus.starcluster.tasks.job.monitor_process'
+)
+
+DEFAULT_SHARDS = 1
+DEFAULT_CLAIM_INTERVAL = 10
+
+# Sent by each monitor worker to announce itself to the others
+ANNOUNCE_EVENT = 'worker-monitor'
+ANNOUNCE_ROUTING_KEY = 'worker.monitor'
+
+
+def _hash(value):
+    return zlib.crc32(str(value)) & 0xffffffff
+
+
+def shard_of(cluster_id, shards):
+    """
+    Returns the shard a cluster is monitored by, stable across processes and
+    hosts.
+    """
+    return _hash(cluster_id) % shards
+
+
+def shard_queue(shard):
+    return '%s.%d' % (MONITOR_QUEUE, shard)
+
+
+def shard_owner(shard, members):
+    """
+    Returns the member a shard is assigned to. Each member scores every shard,
+    the highest score wins, so when members join or leave only the shards they
+    gain or lose move.
+    """
+    if not members:
+        return None
+
+    return max(sorted(members),
+               key=lambda member: _hash('%s:%s' % (shard, member)))
+
+
+def monitor_shards():
+    return cumulus.config.get('monitor', {}).get('shards', DEFAULT_SHARDS)
+
+
+class ClusterAffinityRouter(object):
+    """
+    Routes the monitor tasks for a cluster to the shard queue of the cluster,
+    so consecutive ticks land on the worker that has claimed the shard. Other
+    tasks, and all tasks if there is only one shard, are left to the other
+    routes.
+    """
+    def route_for_task(self, task, args=None, kwargs=None):
+        if task not in CLUSTER_TASKS:
+            return None
+
+        shards = monitor_shards()
+        if shards <= 1:
+            return None
+
+        cluster = args[0] if args else (kwargs or {}).get('cluster')
+        if not cluster or '_id' not in cluster:
+            return None
+
+        return {'queue': shard_queue(shard_of(cluster['_id'], shards))}
+
+
+class ShardClaimer(bootsteps.StartStopStep):
+    """
+    Consumer step consuming from the shard queues claimed by the worker. The
+    monitor workers announce themselves to each other over the worker events,
+    each claiming the shards shard_owner() assigns it out of the workers
+    heard from. The shards are rebalanced as workers join or leave.
+    """
+    label = 'Shard claimer'
+    requires = ('celery.worker.consumer:Gossip',
+                'celery.worker.consumer:Tasks')
+
+    def __init__(self, c, **kwargs):
+        config = cumulus.config.get('monitor', {})
+        self.shards = config.get('shards', DEFAULT_SHARDS)
+        self.pinned = config.get('shard')
+        self.interval = config.get('claimInterval', DEFAULT_CLAIM_INTERVAL)
+        self.hostname = c.hostname
+        self.consumer = None
+        # hostname => time last heard from
+        self.members = {}
+        self.claimed = set()
+        self._announcing = False
+        self._tref = None
+
+    def start(self, c):
+        self.consumer = c
+        # The task consumer has been recreated with just the default queues
+        self.claimed = set()
+        self.members = {}
+
+        if self.shards <= 1:
+            return
+
+        if self.pinned is not None:
+            self._claim(set([self.pinned]))
+        elif not c.gossip.enabled:
+            # We can't tell who else is out there
+            self._claim(set(range(self.shards)))
+        else:
+            c.gossip.event_handlers[ANNOUNCE_ROUTING_KEY] = self.on_announce
+            self._announcing = True
+            self.members[self.hostname] = time.time()
+            self._announce()
+            self.rebalance()
+            self._tref = c.timer.call_repeatedly(self.interval, self.periodic)
+
+    def stop(self, c):
+        if self._tref is not None:
+            self._tref.cancel()
+            self._tref = None
+        if self._announcing:
+            self._announcing = False
+            try:
+                self._announce(leaving=True)
+            except Exception:
+                # The others will expire us
+                pass
+
+    def _announce(self, leaving=False):
+        self.consumer.event_dispatcher.send(ANNOUNCE_EVENT, shards=self.shards,
+                                            leaving=leaving)
+
+    def on_announce(self, event):
+        hostname = event.get('hostname')
+        if not hostname or hostname == self.hostname:
+            return
+
+        if event.get('leaving'):
+            changed = self.members.pop(hostname, None) is not None
+        else:
+            changed = hostname not in self.members
+            self.members[hostname] = time.time()
+
+        if changed:
+            self.rebalance()
+
+    def periodic(self):
+        self._announce()
+
+        now = time.time()
+        self.members[self.hostname] = now
+        for (hostname, heard) in self.members.items():
+            if now - heard > 3 * self.interval:
+                del self.members[hostname]
+
+        self.rebalance()
+
+    def rebalance(self):
+        owned = set(shard for shard in range(self.shards)
+                    if shard_owner(shard, self.members) == self.hostname)
+        self._claim(owned)
+
+    def _claim(self, shards):
+        for shard in sorted(shards - self.claimed):
+            self.consumer.add_task_queue(shard_queue(shard))
+        for shard in sorted(self.claimed - shards):
+            self.consumer.cancel_task_queue(shard_queue(shard))
+        self.claimed = shards
@@ -27,17 +27,21 @@ from girder.constants import AccessType
 import cumulus
 from cumulus.constants import ClusterType
 
+# The scope of the token a job uses to call back with its state
+JOB_CALLBACK_SCOPE = 'cumulus.job.callback.%s'
 
-def get_task_token(cluster=None):
+
+def get_task_token(cluster=None, user=None):
     """
     Gets a Girder token to use to access Girder while running a task. By default
     we create a token using the cumulus girder user ( this user has certain
     privileges, such as access to passphrases that a regular user doesn't have).
     However, in the case of a NEWT cluster we need the token to be associated
-    with the logged in user as this is used to look up the NEWT session ID.
+    with the logged in user as this is used to look up the NEWT session ID,
+    or with user if given.
     """
     if cluster and cluster['type'] == ClusterType.NEWT:
-        user = getCurrentUser()
+        user = user or getCurrentUser()
     else:
         user = ModelImporter.model('user') \
             .find({'login': cumulus.config.girder.user})
@@ -51,6 +55,16 @@ def get_task_token(cluster=None):
     return ModelImporter.model('token').createToken(user=user, days=7)
 
 
+def get_job_callback_token(job):
+    """
+    Gets a token for the submission script of a job to report its state with.
+    The token isn't associated with a user and its scope only allows callbacks
+    for this job.
+    """
+    return ModelImporter.model('token').createToken(
+        days=7, scope=JOB_CALLBACK_SCOPE % job['_id'])
+
+
 def create_status_notification(resource_name, notification, user):
     expires = datetime.datetime.utcnow() + datetime.timedelta(seconds=30)
     type = '%s.status' % resource_name
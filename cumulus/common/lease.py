@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import requests
+
+import cumulus
+from cumulus.common import check_status
+
+DEFAULT_LEASE_TIMEOUT = 15 * 60
+
+# The lease held by the monitor polling a job
+JOB_LEASE = 'job'
+
+
+def lease_timeout():
+    return cumulus.config.get('monitor', {}).get('leaseTimeout',
+                                                 DEFAULT_LEASE_TIMEOUT)
+
+
+def process_lease(pid):
+    """
+    The lease held by the monitor of a process run for a job, such as an
+    upload.
+    """
+    return 'process-%s' % pid
+
+
+def _lease_url(job, kind):
+    return '%s/jobs/%s/leases/%s' % (cumulus.config.girder.baseUrl,
+                                     job['_id'], kind)
+
+
+def hold_lease(job, kind, holder, girder_token, steal=False):
+    """
+    Acquire, or renew, the lease of kind on the job for holder. Girder only
+    renews the lease if holder still holds it, so this is called on every
+    tick before the cluster is touched. Returns False if another monitor
+    holds the lease.
+
+    The holder is the id of the task, which is kept when a task is retried,
+    so a chain of retries holds the lease while a second monitor dispatched
+    for the same job is kept out.
+    """
+    headers = {'Girder-Token':  girder_token}
+    r = requests.put(_lease_url(job, kind), headers=headers,
+                     json={'holder': holder, 'ttl': lease_timeout(),
+                           'steal': steal})
+    if r.status_code == 409:
+        return False
+    check_status(r)
+
+    return True
+
+
+def release_lease(job, kind, holder, girder_token):
+    headers = {'Girder-Token':  girder_token}
+    r = requests.delete(_lease_url(job, kind), headers=headers,
+                        params={'holder': holder})
+    check_status(r)
@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import threading
+import time
+import traceback
+
+from celery.signals import worker_process_shutdown, worker_shutdown
+
+import cumulus
+from cumulus.celery.routing import shard_of, DEFAULT_SHARDS
+from cumulus.transport import get_connection
+
+# Used if a job state asks to be run again without giving a countdown
+DEFAULT_COUNTDOWN = 5
+
+# How long a worker waits on the cluster loops at shutdown before handing
+# their jobs back
+STOP_TIMEOUT = 30
+
+# Jobs on a cluster falling due within this many seconds of each other are
+# moved on together, over the same connection
+BATCH_WINDOW = 1
+
+
+class Countdown(object):
+    """
+    Stands in for the Celery task the job states schedule their next run
+    with, recording the countdown rather than re-queuing a message.
+    """
+    def __init__(self):
+        self.countdown = None
+
+    def retry(self, throw=True, countdown=None, **kwargs):
+        self.countdown = DEFAULT_COUNTDOWN if countdown is None else countdown
+
+
+class _ClusterLoop(threading.Thread):
+    """
+    Drives the jobs monitored on one cluster, the jobs due at the same time
+    with the same token are moved on over a single connection.
+    """
+    def __init__(self, engine, cluster_id):
+        super(_ClusterLoop, self).__init__(name='monitor-%s' % cluster_id)
+        self.daemon = True
+        self.cluster_id = cluster_id
+        self._engine = engine
+        self._wakeup = threading.Condition(engine._lock)
+        # key => (time the job is next due, monitored job)
+        self.jobs = {}
+
+    def add(self, monitored):
+        # Called with the engine lock held. Replaces the job if we already have
+        # it, so an exit code given by a callback is picked up straight away.
+        self.jobs[monitored.key] = (0, monitored)
+        self._wakeup.notify()
+
+    def wakeup(self):
+        self._wakeup.notify()
+
+    def _due(self, now):
+        # Once a job is due, the jobs soon to be due go with it
+        if not any(due <= now for (due, _) in self.jobs.itervalues()):
+            return []
+
+        return [monitored for (due, monitored) in self.jobs.itervalues()
+                if due <= now + BATCH_WINDOW]
+
+    def run(self):
+        while True:
+            with self._engine._lock:
+                now = time.time()
+                due = self._due(now)
+                while not due:
+                    if not self.jobs or self._engine.stopped:
+                        if not self.jobs:
+                            self._engine._loop_done(self)
+                        return
+                    next_due = min(d for (d, _) in self.jobs.itervalues())
+                    self._wakeup.wait(next_due - now)
+                    now = time.time()
+                    due = self._due(now)
+                if self._engine.stopped:
+                    return
+
+            self._tick(due)
+
+    def _tick(self, due):
+        # Jobs are only moved on over a connection made with their own token
+        groups = {}
+        for monitored in due:
+            groups.setdefault(monitored.girder_token, []).append(monitored)
+
+        for group in groups.itervalues():
+            self._tick_group(group)
+
+    def _tick_group(self, group):
+        first = group[0]
+        moved_on = False
+        try:
+            with self._engine.connect(first.girder_token,
+                                      first.cluster) as conn:
+                for monitored in group:
+                    self._tick_job(monitored, conn)
+                moved_on = True
+        except Exception as ex:
+            traceback.print_exc()
+            # Only the close failed if the jobs were moved on
+            if not moved_on:
+                for monitored in group:
+                    self._failed(monitored, ex)
+
+    def _tick_job(self, monitored, conn):
+        task = Countdown()
+        try:
+            monitored.tick(task, conn)
+        except Exception as ex:
+            traceback.print_exc()
+            self._failed(monitored, ex)
+            return
+
+        with self._engine._lock:
+            if self.jobs.get(monitored.key, (None, None))[1] is not monitored:
+                # Replaced while we were running it
+                return
+            if task.countdown is None:
+                del self.jobs[monitored.key]
+            else:
+                self.jobs[monitored.key] = (time.time() + task.countdown,
+                                            monitored)
+
+    def _failed(self, monitored, ex):
+        try:
+            monitored.failed(ex)
+        except Exception:
+            traceback.print_exc()
+
+        with self._engine._lock:
+            if self.jobs.get(monitored.key, (None, None))[1] is monitored:
+                del self.jobs[monitored.key]
+
+
+class MonitorEngine(object):
+    """
+    Keeps the jobs being monitored by a worker in memory, grouped by cluster,
+    with a thread per cluster moving its jobs on. A monitored job provides:
+
+    key - identifies the job
+    cluster - the cluster the job is running on
+    girder_token - used to connect to the cluster
+    tick(task, conn) - moves the job on, calling task.retry(countdown=...) if
+                       the job should be run again
+    failed(ex) - called if tick() or connecting to the cluster raises
+    handoff(countdown) - passes the job on to another worker, called for the
+                         jobs still active when the engine is stopped
+
+    If shard is given the engine only owns the clusters of that shard, see
+    shard_of(). Otherwise the engine owns the clusters routed to it, the
+    worker consuming from the shard queues it has claimed.
+    """
+    def __init__(self, shard=None, shards=DEFAULT_SHARDS,
+                 connect=get_connection):
+        self.shard = shard
+        self.shards = shards
+        self.connect = connect
+        self.stopped = False
+        self._lock = threading.Lock()
+        # cluster id => _ClusterLoop
+        self._loops = {}
+
+    def owns(self, cluster):
+        if self.shard is None:
+            return True
+
+        return shard_of(cluster['_id'], self.shards) == self.shard
+
+    def add(self, monitored):
+        """
+        Start monitoring a job, returns False if the engine has been stopped.
+        """
+        cluster_id = str(monitored.cluster['_id'])
+        with self._lock:
+            if self.stopped:
+                return False
+            loop = self._loops.get(cluster_id)
+            start = loop is None
+            if start:
+                loop = _ClusterLoop(self, cluster_id)
+                self._loops[cluster_id] = loop
+            loop.add(monitored)
+
+        if start:
+            loop.start()
+
+        return True
+
+    def _loop_done(self, loop):
+        # Called with the lock held
+        if self._loops.get(loop.cluster_id) is loop:
+            del self._loops[loop.cluster_id]
+
+    def jobs(self):
+        """
+        Returns the keys of the jobs being monitored, by cluster id.
+        """
+        with self._lock:
+            return {cluster_id: sorted(loop.jobs.keys())
+                    for (cluster_id, loop) in self._loops.iteritems()}
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the cluster loops and hand the jobs still being monitored on.
+        """
+        with self._lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            loops = self._loops.values()
+            for loop in loops:
+                loop.wakeup()
+
+        for loop in loops:
+            loop.join(timeout)
+
+        with self._lock:
+            now = time.time()
+            jobs = [job for loop in loops for job in loop.jobs.itervalues()]
+            for loop in loops:
+                loop.jobs.clear()
+            self._loops.clear()
+
+        for (due, monitored) in jobs:
+            try:
+                monitored.handoff(max(0, due - now))
+            except Exception:
+                traceback.print_exc()
+
+
+_engine = None
+
+
+def get_monitor_engine():
+    """
+    Returns the worker wide monitor engine, configured using the monitor
+    section of the cumulus configuration, or None if the engine isn't enabled.
+    """
+    global _engine
+
+    config = cumulus.config.get('monitor', {})
+    if not config.get('engine', False):
+        return None
+
+    if _engine is None:
+        _engine = MonitorEngine(shard=config.get('shard'),
+                                shards=config.get('shards', DEFAULT_SHARDS))
+
+    return _engine
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def _handoff(**kwargs):
+    if _engine is not None:
+        _engine.stop()
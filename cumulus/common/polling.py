@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from __future__ import absolute_import
+import time
+
+import cumulus
+
+DEFAULT_MIN_INTERVAL = 5
+DEFAULT_MAX_INTERVAL = 300
+DEFAULT_BACKOFF = 2
+# How long to keep polling at the minimum interval after a state change
+DEFAULT_FAST_PERIOD = 60
+
+
+def polling_limits(cluster=None):
+    """
+    Returns the polling limits from the polling section of the cumulus
+    configuration, overridden by the polling section of the cluster's config.
+    """
+    limits = {
+        'minInterval': DEFAULT_MIN_INTERVAL,
+        'maxInterval': DEFAULT_MAX_INTERVAL,
+        'backoff': DEFAULT_BACKOFF,
+        'fastPeriod': DEFAULT_FAST_PERIOD
+    }
+    limits.update(cumulus.config.get('polling', {}))
+    if cluster:
+        limits.update(cluster.get('config', {}).get('polling', {}))
+
+    return limits
+
+
+def next_interval(state, status, cluster=None, runtime_hint=None, now=None):
+    """
+    Returns the delay before polling something in the given status again.
+    Polling is fast for a while after the status changes, then backs off
+    exponentially up to the maximum interval, so something queued for days
+    is rarely polled.
+
+    state is a dict carried between polls and is updated in place. If the
+    expected runtime is given in runtime_hint, the poll is not delayed past
+    the point it is expected to finish.
+    """
+    limits = polling_limits(cluster)
+    min_interval = limits['minInterval']
+    if now is None:
+        now = time.time()
+
+    state.setdefault('started', now)
+    if state.get('status') != status:
+        state['status'] = status
+        state['since'] = now
+        state['interval'] = min_interval
+    elif now - state['since'] < limits['fastPeriod']:
+        state['interval'] = min_interval
+    else:
+        state['interval'] = min(state['interval'] * limits['backoff'],
+                                limits['maxInterval'])
+
+    if runtime_hint:
+        remaining = state['since'] + runtime_hint - now
+        if remaining > 0:
+            state['interval'] = min(state['interval'],
+                                    max(remaining, min_interval))
+
+    state['interval'] = max(state['interval'], min_interval)
+
+    return int(round(state['interval']))
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import errno
+import os
+import tempfile
+import time
+
+import cumulus
+
+# How long a termination is remembered for, by then the tasks of the job
+# will have seen it.
+DEFAULT_FLAG_TIMEOUT = 60 * 60
+
+
+def _flag_dir():
+    flag_dir = cumulus.config.get('job', {}).get('terminationFlagDir')
+
+    return flag_dir or os.path.join(tempfile.gettempdir(),
+                                    'cumulus-terminations')
+
+
+def _flag_timeout():
+    return cumulus.config.get('job', {}).get('terminationFlagTimeout',
+                                             DEFAULT_FLAG_TIMEOUT)
+
+
+def _flag_path(job_id):
+    return os.path.join(_flag_dir(), str(job_id))
+
+
+def _prune(flag_dir, now):
+    timeout = _flag_timeout()
+    for name in os.listdir(flag_dir):
+        path = os.path.join(flag_dir, name)
+        try:
+            if now - os.path.getmtime(path) > timeout:
+                os.remove(path)
+        except OSError:
+            # Already pruned by someone else
+            pass
+
+
+def mark_terminating(job_id, stamp=None):
+    """
+    Record that the job is being terminated, stamp is when the termination
+    was asked for. The flag is shared by all the workers on the host.
+    """
+    if stamp is None:
+        stamp = time.time()
+
+    flag_dir = _flag_dir()
+    try:
+        os.makedirs(flag_dir)
+    except OSError as ex:
+        if ex.errno != errno.EEXIST:
+            raise
+
+    # Written to the side and moved into place so readers never see a
+    # partial stamp
+    (fd, tmp_path) = tempfile.mkstemp(dir=flag_dir, prefix='.')
+    with os.fdopen(fd, 'w') as fp:
+        fp.write(repr(float(stamp)))
+    os.rename(tmp_path, _flag_path(job_id))
+
+    _prune(flag_dir, time.time())
+
+
+def terminating_stamp(job_id):
+    """
+    Returns when termination of the job was asked for, or None if it hasn't
+    been.
+    """
+    try:
+        with open(_flag_path(job_id)) as fp:
+            return float(fp.read())
+    except (IOError, ValueError):
+        return None
+
+
+def terminated_since_submit(job, stamp):
+    """
+    Returns True if termination of the job, asked for at stamp, came after
+    the job was submitted, so an earlier termination doesn't stop a
+    resubmitted job.
+    """
+    if stamp is None:
+        return False
+
+    return stamp >= job.get('submitStamp', 0)
+
+
+def is_terminating(job):
+    """
+    Returns True if this host has been told the job is being terminated since
+    it was submitted.
+    """
+    return terminated_since_submit(job, terminating_stamp(job['_id']))
@@ -17,9 +17,37 @@
 #  limitations under the License.
 ###############################################################################
 
+import re
+
+from cumulus.constants import JobQueueState
+
 
 class AbstractQueueAdapter(object):
     QUEUE_JOB_ID = 'queueJobId'
+    # The index of the task in an array job, starting at 1
+    QUEUE_ARRAY_INDEX = 'queueArrayIndex'
+
+    # The environment variables holding the task index and the array job id
+    # in the tasks of an array job, overridden by subclasses
+    ARRAY_TASK_ID = None
+    ARRAY_JOB_ID = None
+
+    # Scheduler states mapped to each JobQueueState, overridden by subclasses
+    RUNNING_STATE = []
+    ERROR_STATE = []
+    COMPLETE_STATE = []
+    QUEUED_STATE = []
+
+    # The commands used by discover() to introspect the scheduler, keyed by
+    # the capability they report. Overridden by subclasses.
+    DISCOVERY_COMMANDS = {}
+
+    # The commands used by occupancy() to find how busy the queue is, 'jobs'
+    # lists the jobs of all users and 'resources' the free slots or nodes.
+    # Extended by subclasses.
+    OCCUPANCY_COMMANDS = {
+        'user': 'whoami'
+    }
 
     def __init__(self, cluster, cluster_connection):
         self._cluster = cluster
@@ -31,5 +59,205 @@ class AbstractQueueAdapter(object):
     def terminate_job(self, job):
         raise NotImplementedError('Subclasses should implement this')
 
+    @staticmethod
+    def job_key(job):
+        """
+        Returns the key identifying the job in the dicts returned by
+        job_info(). This is the queue job id, or for a task of an array job the
+        array job id followed by the task index, for example 1234[2].
+        """
+        key = str(job[AbstractQueueAdapter.QUEUE_JOB_ID])
+        index = job.get(AbstractQueueAdapter.QUEUE_ARRAY_INDEX)
+        if index is not None:
+            key = '%s[%s]' % (key, index)
+
+        return key
+
+    @staticmethod
+    def split_job_key(key):
+        """
+        Returns a tuple of the queue job id and array task index, which is
+        None if the key isn't for a task of an array job.
+        """
+        m = re.match('^(.*)\\[(\\d+)\\]$', key)
+        if m:
+            return (m.group(1), m.group(2))
+
+        return (key, None)
+
     def job_status(self, job):
+        return self.job_statuses([job])[self.job_key(job)]
+
+    def job_statuses(self, jobs):
+        """
+        Returns a dict mapping the key of each job, see job_key(), to its
+        JobQueueState, or None if the job is no longer known to the scheduler.
+        The states of all the jobs are fetched with a single scheduler query.
+        """
+        return {key: info['state']
+                for (key, info) in self.job_info(jobs).iteritems()}
+
+    def job_info(self, jobs):
+        """
+        Returns a dict mapping the key of each job, see job_key(), to a dict
+        holding its JobQueueState as 'state'. Where the scheduler reports them
+        the 'exitCode' and 'elapsed' time in seconds are also included.
+        """
+        keys = [self.job_key(job) for job in jobs]
+        if not keys:
+            return {}
+
+        scheduler_info = self._scheduler_info(keys)
+        info = {}
+        for key in keys:
+            job_info = dict(scheduler_info.get(key, {}))
+            job_info['state'] = self._to_job_queue_state(job_info.get('state'))
+            info[key] = job_info
+
+        return info
+
+    def _scheduler_info(self, keys):
+        """
+        Returns a dict mapping the job keys to a dict holding the lower case
+        state reported by the scheduler as 'state', along with any exit code
+        or elapsed time. By default only the state is reported.
+        """
+        return {key: {'state': state} for (key, state)
+                in self._scheduler_states(keys).iteritems()}
+
+    def _scheduler_states(self, keys):
+        """
+        Returns a dict mapping the job keys to the lower case state reported by
+        the scheduler, jobs the scheduler doesn't report can be omitted.
+        """
         raise NotImplementedError('Subclasses should implement this')
+
+    def _queue_job_ids(self, keys):
+        """
+        Returns the distinct queue job ids of the job keys, in order.
+        """
+        job_ids = []
+        for key in keys:
+            (job_id, _) = self.split_job_key(key)
+            if job_id not in job_ids:
+                job_ids.append(job_id)
+
+        return job_ids
+
+    def discover(self):
+        """
+        Introspect the scheduler, returning a dict of the capabilities of the
+        cluster, such as the 'schedulerVersion', the 'queues' ( partitions for
+        SLURM ), the number of 'nodes' and the 'parallelEnvironments' with
+        their slots. The commands are run in a single remote invocation, a
+        command failing just leaves its capability out.
+        """
+        outputs = self._execute_commands(self.DISCOVERY_COMMANDS)
+
+        return self._extract_capabilities(outputs)
+
+    def _execute_commands(self, commands):
+        """
+        Run a dict of commands in a single remote invocation, returning a dict
+        of the non blank output lines of each command that succeeded.
+        """
+        names = sorted(commands.keys())
+        results = self._cluster_connection.execute_many(
+            [commands[name] for name in names])
+
+        outputs = {}
+        for (name, (output, exit_status)) in zip(names, results):
+            if exit_status == 0:
+                outputs[name] = [line for line in output if line.strip()]
+
+        return outputs
+
+    def _extract_capabilities(self, outputs):
+        """
+        Returns the capabilities given a dict of the output lines of each of
+        the discovery commands that succeeded.
+        """
+        capabilities = {}
+        version = outputs.get('schedulerVersion')
+        if version:
+            capabilities['schedulerVersion'] = version[0].strip()
+
+        return capabilities
+
+    def occupancy(self):
+        """
+        Returns a dict describing how busy the queue is, the number of
+        'pending' and 'running' jobs of all users, the same counts for the
+        user we run as in 'user', and where the scheduler reports them the
+        'freeSlots' and 'totalSlots' or 'freeNodes' and 'totalNodes'. The tasks
+        of array jobs are counted individually. The commands are run in a
+        single remote invocation.
+        """
+        outputs = self._execute_commands(self.OCCUPANCY_COMMANDS)
+
+        occupancy = {}
+        if 'jobs' in outputs:
+            user = outputs.get('user', [''])[0].strip()
+            counts = {
+                JobQueueState.QUEUED: 'pending',
+                JobQueueState.RUNNING: 'running'
+            }
+            occupancy.update(pending=0, running=0,
+                             user={'pending': 0, 'running': 0})
+            for (owner, state) in self._extract_queue_jobs(outputs['jobs']):
+                count = counts.get(self._to_job_queue_state(state))
+                if count is None:
+                    continue
+                occupancy[count] += 1
+                if owner == user:
+                    occupancy['user'][count] += 1
+
+        if 'resources' in outputs:
+            occupancy.update(self._extract_resources(outputs['resources']))
+
+        return occupancy
+
+    def _extract_queue_jobs(self, output):
+        """
+        Returns a list of the owner and lower case scheduler state of each job
+        in the output of the 'jobs' occupancy command.
+        """
+        raise NotImplementedError('Subclasses should implement this')
+
+    def _extract_resources(self, output):
+        """
+        Returns the free and total slots or nodes given the output of the
+        'resources' occupancy command.
+        """
+        return {}
+
+    def _to_job_queue_state(self, scheduler_state):
+        state = None
+
+        if scheduler_state:
+            if scheduler_state in self.RUNNING_STATE:
+                state = JobQueueState.RUNNING
+            elif scheduler_state in self.ERROR_STATE:
+                state = JobQueueState.ERROR
+            elif scheduler_state in self.QUEUED_STATE:
+                state = JobQueueState.QUEUED
+            elif scheduler_state in self.COMPLETE_STATE:
+                state = JobQueueState.COMPLETE
+
+        return state
+
+
+def parse_elapsed(elapsed):
+    """
+    Convert an elapsed time as reported by a scheduler,
+    [days-][hours:]minutes:seconds, to seconds.
+    """
+    days = 0
+    if '-' in elapsed:
+        (days, elapsed) = elapsed.split('-', 1)
+
+    seconds = 0
+    for part in elapsed.split(':'):
+        seconds = seconds * 60 + int(part)
+
+    return int(days) * 24 * 60 * 60 + seconds
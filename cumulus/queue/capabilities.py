@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import requests
+import time
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.queue import get_queue_adapter
+
+CAPABILITIES = 'capabilities'
+
+DEFAULT_REFRESH_INTERVAL = 24 * 60 * 60
+
+
+def refresh_interval():
+    return cumulus.config.get('queue', {}).get('capabilitiesRefreshInterval',
+                                               DEFAULT_REFRESH_INTERVAL)
+
+
+def is_stale(cluster):
+    """
+    Returns True if the capabilities stored on the cluster are missing or
+    older than the refresh interval.
+    """
+    capabilities = cluster.get(CAPABILITIES)
+    if not capabilities:
+        return True
+
+    return time.time() - capabilities.get('updated', 0) > refresh_interval()
+
+
+def discover(cluster, conn, girder_token):
+    """
+    Introspect the scheduler of the cluster and store the capabilities found
+    on the cluster document, so later submissions don't need to.
+    """
+    capabilities = get_queue_adapter(cluster, conn).discover()
+    capabilities['updated'] = time.time()
+
+    headers = {'Girder-Token':  girder_token}
+    cluster_url = '%s/clusters/%s' % (cumulus.config.girder.baseUrl,
+                                      cluster['_id'])
+    r = requests.patch(cluster_url, headers=headers,
+                       json={CAPABILITIES: capabilities})
+    check_status(r)
+    cluster[CAPABILITIES] = capabilities
+
+    return capabilities
+
+
+def get_capabilities(cluster, conn, girder_token):
+    """
+    Returns the capabilities of the cluster, only running discovery if those
+    stored on the cluster are stale.
+    """
+    if is_stale(cluster):
+        return discover(cluster, conn, girder_token)
+
+    return cluster[CAPABILITIES]
+
+
+def parallel_environment_slots(capabilities, parallel_env):
+    """
+    Returns the number of slots in a parallel environment, or None if the
+    parallel environment wasn't discovered.
+    """
+    for pe in capabilities.get('parallelEnvironments', []):
+        if pe['name'] == parallel_env:
+            return pe.get('slots')
+
+    return None
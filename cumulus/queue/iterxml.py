@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+
+class _LinesReader(object):
+    """
+    A file like object reading a sequence of lines, as returned by a command,
+    without joining them all into a single string.
+    """
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self._buffer = ''
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self._buffer + '\n'.join(self._lines)
+            self._buffer = ''
+            return data
+
+        while len(self._buffer) < size:
+            line = next(self._lines, None)
+            if line is None:
+                break
+            self._buffer += line + '\n'
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+
+        return data
+
+
+def iterelements(lines, tag):
+    """
+    Incrementally parse the XML document in lines, yielding each element with
+    the given tag once it is complete. Elements are discarded once they have
+    been yielded, so memory use doesn't grow with the size of the document.
+    """
+    # Some schedulers output nothing rather than an empty document
+    if not any(line.strip() for line in lines):
+        return
+
+    # The elements open at this point in the document
+    stack = []
+    events = ElementTree.iterparse(_LinesReader(lines),
+                                   events=('start', 'end'))
+    for (event, element) in events:
+        if event == 'start':
+            stack.append(element)
+            continue
+
+        stack.pop()
+        if element.tag == tag:
+            yield element
+            element.clear()
+            # Drop the references held by the parent, wherever the element
+            # is nested. Its earlier children are all complete by now.
+            if stack:
+                del stack[-1][:]
+
+
+def findtext(element, path, default=None):
+    """
+    Returns the stripped text of the sub element at path.
+    """
+    text = element.findtext(path)
+    if text is None:
+        return default
+
+    return text.strip()
+
+
+def children(element, path):
+    """
+    Returns a dict of the tag and stripped text of each child of the sub
+    element at path.
+    """
+    parent = element.find(path)
+    if parent is None:
+        return {}
+
+    return {child.tag: (child.text or '').strip() for child in parent}
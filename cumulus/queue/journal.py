@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+from cumulus.constants import JobQueueState
+
+# The journal submission scripts append their events to, relative to the home
+# directory where the job directories are created.
+JOURNAL_PATH = '.cumulus_journal'
+
+# Only this much of the journal is read if we are further behind, for example
+# when a worker starts.
+DEFAULT_MAX_READ_SIZE = 1024 * 1024
+
+# How long the exit of a job is remembered for, in case the job is being
+# monitored by another worker and so is never forgotten here.
+DEFAULT_RETENTION = 60 * 60
+
+
+def journal_key(job):
+    """
+    Returns the key the events of this submission of the job are recorded
+    under, the job id followed by when it was submitted. A job resubmitted
+    under the same id gets a new key, so the events of the earlier run aren't
+    taken for the new one.
+    """
+    key = str(job.get('_id'))
+    if 'submitStamp' in job:
+        key = '%s:%.6f' % (key, job['submitStamp'])
+
+    return key
+
+
+class JournalReader(object):
+    """
+    Follows the journal of a cluster. Each line of the journal is written by a
+    submission script as:
+
+    <timestamp> <journal key> started|exited [<exit code>]
+
+    where the journal key is given by journal_key(). Each call to read() only
+    reads the bytes appended since the last one, and the latest state of each
+    job is kept.
+    """
+    def __init__(self, max_read_size=DEFAULT_MAX_READ_SIZE,
+                 retention=DEFAULT_RETENTION):
+        self.max_read_size = max_read_size
+        self.retention = retention
+        self.offset = 0
+        self._partial = ''
+        # journal key => job info, see AbstractQueueAdapter.job_info()
+        self._jobs = {}
+        # journal key => time the job started
+        self._started = {}
+        # journal key => time the job exited
+        self._exited = {}
+
+    def read(self, conn):
+        result = conn.read_from(JOURNAL_PATH, self.offset,
+                                max_size=self.max_read_size)
+        if result is None:
+            return
+
+        (start, data) = result
+        if start == self.offset:
+            data = self._partial + data
+        elif start > 0:
+            # We have skipped ahead, so drop the partial first line
+            data = data[data.find('\n') + 1:] if '\n' in data else ''
+
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        self.offset = start + len(result[1])
+
+        for line in lines:
+            self._apply(line.split())
+
+        if self._exited:
+            latest = max(self._exited.itervalues())
+            for (key, exited) in self._exited.items():
+                if latest - exited > self.retention:
+                    self.forget(key)
+
+    def _apply(self, fields):
+        if len(fields) < 3:
+            return
+
+        try:
+            timestamp = int(fields[0])
+        except ValueError:
+            return
+
+        (key, event) = fields[1:3]
+        if event == 'started':
+            self._started[key] = timestamp
+            self._jobs[key] = {'state': JobQueueState.RUNNING}
+        elif event == 'exited':
+            try:
+                exit_code = int(fields[3])
+            except (IndexError, ValueError):
+                return
+
+            state = JobQueueState.COMPLETE if exit_code == 0 \
+                else JobQueueState.ERROR
+            info = {'state': state, 'exitCode': exit_code}
+            if key in self._started:
+                info['elapsed'] = timestamp - self._started.pop(key)
+            self._jobs[key] = info
+            self._exited[key] = timestamp
+
+    def job_info(self, key):
+        """
+        Returns the latest info recorded in the journal under a journal key,
+        or None if the key hasn't been seen.
+        """
+        return self._jobs.get(key)
+
+    def forget(self, key):
+        for jobs in [self._jobs, self._started, self._exited]:
+            jobs.pop(key, None)
@@ -20,25 +20,25 @@
 import os
 
 from jsonpath_rw import parse
-import requests
 
 from cumulus.queue.slurm import SlurmQueueAdapter
 from cumulus.common import check_status
-from cumulus.transport.newt import NEWT_BASE_URL
+from cumulus.transport.newt_client import get_newt_client
 
 
 class NewtQueueAdapter(SlurmQueueAdapter):
     def __init__(self, cluster, cluster_connection):
         super(NewtQueueAdapter, self).__init__(cluster, cluster_connection)
-        self._session = requests.Session()
-        self._session.cookies.set('newt_sessionid',
-                                  cluster_connection.session_id)
         self._machine = parse('config.host').find(cluster)[0].value
 
+    def _request(self, method, path, **kwargs):
+        # Share the NEWT session and keep-alive connections with the transport
+        return get_newt_client().request(self._cluster_connection.girder_token,
+                                         self._machine, method, path, **kwargs)
+
     def terminate_job(self, job):
-        url = '%s/queue/%s/%s' % (NEWT_BASE_URL,
-                                  self._machine, job['queueJobId'])
-        r = self._session.delete(url)
+        r = self._request('DELETE', 'queue/%s/%s' % (self._machine,
+                                                     self._slurm_job_id(job)))
         check_status(r)
         json_response = r.json()
 
@@ -46,13 +46,12 @@ class NewtQueueAdapter(SlurmQueueAdapter):
             raise Exception(json_response['error'])
 
     def submit_job(self, job, job_script):
-        url = '%s/queue/%s' % (NEWT_BASE_URL, self._machine)
         job_file_path = os.path.join(job['dir'], job_script)
         data = {
             'jobfile': job_file_path
         }
 
-        r = self._session.post(url, data=data)
+        r = self._request('POST', 'queue/%s' % self._machine, data=data)
         check_status(r)
         json_response = r.json()
 
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import requests
+import time
+
+import cumulus
+from cumulus.common import check_status
+from cumulus.queue import get_queue_adapter
+
+OCCUPANCY = 'queue'
+
+DEFAULT_REFRESH_INTERVAL = 30
+
+
+def refresh_interval():
+    return cumulus.config.get('queue', {}).get('occupancyRefreshInterval',
+                                               DEFAULT_REFRESH_INTERVAL)
+
+
+def is_stale(cluster):
+    """
+    Returns True if the queue occupancy stored on the cluster is missing or
+    older than the refresh interval, and a refresh hasn't been requested
+    within the interval.
+    """
+    occupancy = cluster.get(OCCUPANCY) or {}
+    last = max(occupancy.get('updated', 0),
+               occupancy.get('refreshRequested', 0))
+
+    return time.time() - last > refresh_interval()
+
+
+def refresh(cluster, conn, girder_token):
+    """
+    Query how busy the cluster's queue is and store it on the cluster
+    document, where it is served from.
+    """
+    occupancy = get_queue_adapter(cluster, conn).occupancy()
+    occupancy['updated'] = time.time()
+
+    headers = {'Girder-Token':  girder_token}
+    cluster_url = '%s/clusters/%s' % (cumulus.config.girder.baseUrl,
+                                      cluster['_id'])
+    r = requests.patch(cluster_url, headers=headers,
+                       json={OCCUPANCY: occupancy})
+    check_status(r)
+    cluster[OCCUPANCY] = occupancy
+
+    return occupancy
@@ -1,27 +1,47 @@
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
-from cumulus.constants import JobQueueState
+from cumulus.queue.abstract import AbstractQueueAdapter, parse_elapsed
+from cumulus.queue.iterxml import iterelements, findtext, children
 
 
 class PbsQueueAdapter(AbstractQueueAdapter):
     # Running states
     RUNNING_STATE = ['r']
 
-    ERROR_STATE = ['e']
+    # failed is given to completed jobs with a non zero exit status
+    ERROR_STATE = ['e', 'failed']
 
     COMPLETE_STATE = ['c']
 
     # Queued states
     QUEUED_STATE = ['q', 'h', 't', 'w', 's']
 
+    # Torque array jobs, submitted with -t
+    ARRAY_TASK_ID = '$PBS_ARRAYID'
+    ARRAY_JOB_ID = '${PBS_JOBID%%[*}'
+
+    DISCOVERY_COMMANDS = {
+        'schedulerVersion': 'qstat --version',
+        'queues': 'qstat -Q',
+        'nodes': 'pbsnodes -l all'
+    }
+
+    OCCUPANCY_COMMANDS = dict(AbstractQueueAdapter.OCCUPANCY_COMMANDS, **{
+        'jobs': 'qstat -x -t',
+        'resources': 'pbsnodes -a'
+    })
+
+    # Nodes in these states have no slots to offer
+    UNAVAILABLE_NODE_STATES = ['down', 'offline', 'unknown']
+
     def terminate_job(self, job):
-        command = 'qdel %s' % job['queueJobId']
+        command = 'qdel %s' % self.job_key(job)
         output = self._cluster_connection.execute(command)
 
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match('^(\\d+)\..*', submit_output[0])
+        # Array jobs are reported as 1234[].server
+        m = re.match('^(\\d+)(?:\\[\\])?\..*', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -38,33 +58,124 @@ class PbsQueueAdapter(AbstractQueueAdapter):
 
         return self._parse_job_id(output)
 
-    def job_status(self, job):
-        output = self._cluster_connection.execute('qstat')
-
-        state = None
-        pbs_state = self._extract_job_status(output, job)
-
-        if pbs_state:
-            if pbs_state in PbsQueueAdapter.RUNNING_STATE:
-                state = JobQueueState.RUNNING
-            elif pbs_state in PbsQueueAdapter.ERROR_STATE:
-                state = JobQueueState.ERROR
-            elif pbs_state in PbsQueueAdapter.QUEUED_STATE:
-                state = JobQueueState.QUEUED
-            elif pbs_state in PbsQueueAdapter.COMPLETE_STATE:
-                state = JobQueueState.COMPLETE
-
-        return state
-
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
-        for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\S*\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
-
-        return state
+    def _extract_capabilities(self, outputs):
+        capabilities = super(PbsQueueAdapter, self) \
+            ._extract_capabilities(outputs)
+
+        # Torque reports "Version: 4.2.10"
+        if 'schedulerVersion' in capabilities:
+            capabilities['schedulerVersion'] = \
+                capabilities['schedulerVersion'].split(':')[-1].strip()
+
+        if 'queues' in outputs:
+            # The queues are listed after a header and a line of dashes
+            lines = outputs['queues']
+            for (i, line) in enumerate(lines):
+                if line.startswith('---'):
+                    lines = lines[i + 1:]
+                    break
+            capabilities['queues'] = [line.split()[0] for line in lines]
+
+        if 'nodes' in outputs:
+            capabilities['nodes'] = len(outputs['nodes'])
+
+        return capabilities
+
+    def _scheduler_info(self, keys):
+        # qstat lists all our jobs, including those that have recently
+        # completed, so one call covers them all. -t lists each task of an
+        # array job.
+        output = self._cluster_connection.execute('qstat -x -t')
+
+        return self._extract_job_statuses(output)
+
+    def _extract_job_statuses(self, job_status_output):
+        info = {}
+        for job in iterelements(job_status_output, 'Job'):
+            # The id is qualified with the server name, for example 1.ulex, or
+            # 1[2].ulex for a task of an array job
+            job_id = findtext(job, 'Job_Id', '').split('.')[0]
+            state = findtext(job, 'job_state')
+            if not job_id or not state:
+                continue
+
+            job_info = {
+                'state': state.lower()
+            }
+            try:
+                job_info['exitCode'] = int(findtext(job, 'exit_status'))
+                if job_info['state'] == 'c' and job_info['exitCode'] != 0:
+                    job_info['state'] = 'failed'
+            except (TypeError, ValueError):
+                pass
+
+            resources = children(job, 'resources_used')
+            if 'walltime' in resources:
+                job_info['elapsed'] = parse_elapsed(resources['walltime'])
+            if resources:
+                job_info['resourcesUsed'] = resources
+
+            info[job_id] = job_info
+
+        return info
+
+    def _extract_queue_jobs(self, output):
+        jobs = []
+        for job in iterelements(output, 'Job'):
+            # The owner is qualified with the submission host, user@host
+            owner = findtext(job, 'Job_Owner', '').split('@')[0]
+            state = findtext(job, 'job_state', '').lower()
+            jobs.append((owner, state))
+
+        return jobs
+
+    def _extract_resources(self, output):
+        # Each node is listed by name followed by its attributes, one
+        # "name = value" on each line
+        nodes = []
+        for line in output:
+            if '=' not in line:
+                nodes.append({})
+            elif nodes:
+                (name, value) = line.split('=', 1)
+                nodes[-1][name.strip()] = value.strip()
+
+        resources = {
+            'totalNodes': len(nodes),
+            'freeNodes': 0,
+            'freeSlots': 0,
+            'totalSlots': 0
+        }
+        for node in nodes:
+            states = node.get('state', '').split(',')
+            # Torque reports np, PBS Pro the available and assigned ncpus
+            slots = int(node.get('np', node.get('resources_available.ncpus',
+                                                0)))
+            used = _used_slots(node)
+            resources['totalSlots'] += slots
+            if any(state in self.UNAVAILABLE_NODE_STATES for state in states):
+                continue
+            if used == 0 and 'free' in states:
+                resources['freeNodes'] += 1
+            resources['freeSlots'] += max(slots - used, 0)
+
+        return resources
+
+
+def _used_slots(node):
+    """
+    Returns the number of slots in use on a node listed by pbsnodes.
+    """
+    if 'resources_assigned.ncpus' in node:
+        return int(node['resources_assigned.ncpus'])
+
+    # Torque lists the slots each job is using, 0/12.server or 0-3/12.server
+    used = 0
+    for job in node.get('jobs', '').split(','):
+        slots = job.strip().split('/')[0]
+        if not slots:
+            continue
+        (first, _, last) = slots.partition('-')
+        used += int(last or first) - int(first) + 1
+
+    return used
@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import threading
+import time
+
+import cumulus
+from cumulus.constants import JobQueueState
+from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.journal import JournalReader, journal_key
+
+# Just under the monitor retry countdown, so each cycle makes one query
+DEFAULT_STATUS_TIMEOUT = 4
+DEFAULT_ACTIVE_TIMEOUT = 60
+DEFAULT_VERIFY_INTERVAL = 60
+
+
+class _ClusterStatus(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        # job key => (job, last polled)
+        self.active = {}
+        # job key => job info, see AbstractQueueAdapter.job_info()
+        self.info = {}
+        self.expires = 0
+        self.journal = JournalReader()
+        # When the jobs the journal has as running were last checked with the
+        # scheduler
+        self.verified = 0
+
+
+class QueueStatusPoller(object):
+    """
+    Shares scheduler queries between the jobs being monitored on a cluster.
+    Each job asking for its status is registered as active on its cluster,
+    when the cached states for the cluster are stale the states of all the
+    active jobs are fetched with a single job_info() call and fanned out
+    to each job. Jobs that have left the queue, or that haven't been polled
+    for active_timeout seconds, are dropped from the active set.
+
+    Given a connection the new entries in the cluster's journal are read
+    first. Jobs the journal has as exited aren't queried, and those it has as
+    running are only checked with the scheduler every verify_interval seconds,
+    in case they were killed before they could record their exit.
+    """
+    def __init__(self, timeout=DEFAULT_STATUS_TIMEOUT,
+                 active_timeout=DEFAULT_ACTIVE_TIMEOUT,
+                 verify_interval=DEFAULT_VERIFY_INTERVAL):
+        self.timeout = timeout
+        self.active_timeout = active_timeout
+        self.verify_interval = verify_interval
+        self._lock = threading.Lock()
+        # cluster id => _ClusterStatus
+        self._clusters = {}
+
+    def _cluster_status(self, cluster):
+        with self._lock:
+            return self._clusters.setdefault(str(cluster['_id']),
+                                             _ClusterStatus())
+
+    def job_status(self, cluster, adapter, job, conn=None):
+        """
+        Returns the JobQueueState of the job, using adapter to query the
+        scheduler if the cached states for the cluster don't cover it. If conn
+        is given the cluster's journal is read using it.
+        """
+        return self.job_info(cluster, adapter, job, conn)['state']
+
+    def job_info(self, cluster, adapter, job, conn=None):
+        """
+        As job_status() but returns the job info reported by the adapter.
+        """
+        key = AbstractQueueAdapter.job_key(job)
+        status = self._cluster_status(cluster)
+
+        # Held while querying, so concurrent polls share the result
+        with status.lock:
+            now = time.time()
+            status.active[key] = (job, now)
+            if key in status.info and now < status.expires:
+                return status.info[key]
+
+            status.active = {id: value for (id, value)
+                             in status.active.iteritems()
+                             if now - value[1] < self.active_timeout}
+            jobs = [value[0] for value in status.active.itervalues()]
+            status.info = self._journal_info(status, jobs, conn, now)
+            query = [j for j in jobs
+                     if AbstractQueueAdapter.job_key(j) not in status.info]
+            if query:
+                status.info.update(adapter.job_info(query))
+            status.expires = now + self.timeout
+
+            for (id, info) in status.info.iteritems():
+                if info['state'] not in [JobQueueState.QUEUED,
+                                         JobQueueState.RUNNING]:
+                    (done, _) = status.active.pop(id, (None, None))
+                    if done is not None:
+                        status.journal.forget(journal_key(done))
+
+            return status.info.get(key, {'state': None})
+
+    def _journal_info(self, status, jobs, conn, now):
+        """
+        Returns the info of the jobs the journal can answer for, keyed by job
+        key.
+        """
+        if conn is None:
+            return {}
+
+        status.journal.read(conn)
+        verify = now - status.verified >= self.verify_interval
+        if verify:
+            status.verified = now
+
+        info = {}
+        for job in jobs:
+            job_info = status.journal.job_info(journal_key(job))
+            if job_info is None:
+                continue
+            if verify and job_info['state'] == JobQueueState.RUNNING:
+                continue
+            info[AbstractQueueAdapter.job_key(job)] = job_info
+
+        return info
+
+    def clear(self):
+        with self._lock:
+            self._clusters.clear()
+
+
+_poller = None
+
+
+def get_queue_status_poller():
+    """
+    Returns the worker wide poller, configured using the queue section of the
+    cumulus configuration.
+    """
+    global _poller
+
+    if _poller is None:
+        queue_config = cumulus.config.get('queue', {})
+        _poller = QueueStatusPoller(
+            timeout=queue_config.get('statusCacheTimeout',
+                                     DEFAULT_STATUS_TIMEOUT),
+            active_timeout=queue_config.get('activeJobTimeout',
+                                            DEFAULT_ACTIVE_TIMEOUT),
+            verify_interval=queue_config.get('journalVerifyInterval',
+                                             DEFAULT_VERIFY_INTERVAL))
+
+    return _poller
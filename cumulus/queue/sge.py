@@ -18,27 +18,60 @@
 ###############################################################################
 
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
 from cumulus.constants import JobQueueState
+from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue.iterxml import iterelements, findtext
 
 
 class SgeQueueAdapter(AbstractQueueAdapter):
-    # Running states
-    RUNNING_STATE = ['r', 'd']
+    # failed is given to jobs found by qacct that exited with an error
+    ERROR_STATE = ['failed']
+
+    # done is given to jobs found by qacct that exited successfully
+    COMPLETE_STATE = ['done']
+
+    # qstat combines state letters, for example Eqw for a job that failed to
+    # start or hqw for one on hold. The first letter found, in this order,
+    # decides the state. A job being deleted is running until it leaves the
+    # queue, a suspended one is held as queued.
+    STATE_LETTERS = [
+        ('e', JobQueueState.ERROR),
+        ('d', JobQueueState.RUNNING),
+        ('s', JobQueueState.QUEUED),
+        ('r', JobQueueState.RUNNING),
+        ('t', JobQueueState.RUNNING),
+        ('h', JobQueueState.QUEUED),
+        ('q', JobQueueState.QUEUED),
+        ('w', JobQueueState.QUEUED)
+    ]
 
-    ERROR_STATE = ['e']
+    ARRAY_TASK_ID = '$SGE_TASK_ID'
+    ARRAY_JOB_ID = '$JOB_ID'
 
-    # Queued states
-    QUEUED_STATE = ['qw', 'q', 'w', 's', 'h', 't']
+    DISCOVERY_COMMANDS = {
+        'schedulerVersion': 'qstat -help | head -1',
+        'parallelEnvironments':
+            'for pe in $(qconf -spl 2>/dev/null); do qconf -sp $pe; done',
+        'queues': 'qconf -sql',
+        'nodes': 'qconf -sel'
+    }
+
+    OCCUPANCY_COMMANDS = dict(AbstractQueueAdapter.OCCUPANCY_COMMANDS, **{
+        'jobs': 'qstat -u \'*\' -xml',
+        'resources': 'qstat -g c'
+    })
 
     def terminate_job(self, job):
         command = 'qdel %s' % job['queueJobId']
+        if job.get(AbstractQueueAdapter.QUEUE_ARRAY_INDEX) is not None:
+            command += ' -t %s' % job[AbstractQueueAdapter.QUEUE_ARRAY_INDEX]
         output = self._cluster_connection.execute(command)
 
         return output
 
     def _parse_job_id(self, submit_output):
-        m = re.match('^[Yy]our job (\\d+)', submit_output[0])
+        # Array jobs are reported as "Your job-array 1234.1-10:1 ..."
+        m = re.match('^[Yy]our job(?:-array)? (\\d+)', submit_output[0])
         if not m:
             raise Exception('Unable to extraction job id from: %s'
                             % submit_output[0])
@@ -55,31 +88,143 @@ class SgeQueueAdapter(AbstractQueueAdapter):
 
         return self._parse_job_id(output)
 
-    def job_status(self, job):
-        output = self._cluster_connection.execute('qstat')
+    def _scheduler_info(self, keys):
+        # qstat lists all our jobs, so one call covers them all
+        output = self._cluster_connection.execute('qstat -xml')
+        info = self._extract_job_statuses(output)
 
-        state = None
-        sge_state = self._extract_job_status(output, job)
+        # Jobs no longer in the queue are looked up in the accounting file so
+        # we know how they finished.
+        finished_ids = self._queue_job_ids(
+            [key for key in keys if key not in info])
+        if finished_ids:
+            command = 'for id in %s; do qacct -j $id; done' \
+                % ' '.join(finished_ids)
+            output = self._cluster_connection.execute(command,
+                                                      ignore_exit_status=True)
+            info.update(self._extract_job_accounting(output))
 
-        if sge_state:
-            if sge_state in SgeQueueAdapter.RUNNING_STATE:
-                state = JobQueueState.RUNNING
-            elif sge_state in SgeQueueAdapter.ERROR_STATE:
-                state = JobQueueState.ERROR
-            elif sge_state in SgeQueueAdapter.QUEUED_STATE:
-                state = JobQueueState.QUEUED
+        return info
 
-        return state
+    def _extract_job_statuses(self, job_status_output):
+        info = {}
+        # Both running and pending jobs are reported in job_list elements
+        for job in iterelements(job_status_output, 'job_list'):
+            job_id = findtext(job, 'JB_job_number')
+            state = findtext(job, 'state')
+            if not job_id or not state:
+                continue
 
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
-        for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
+            # The tasks of an array job are listed as a range while pending
+            # and individually once running.
+            tasks = findtext(job, 'tasks')
+            if tasks:
+                for index in _expand_tasks(tasks):
+                    info['%s[%d]' % (job_id, index)] = {'state': state.lower()}
+            else:
+                info[job_id] = {'state': state.lower()}
+
+        return info
+
+    def _extract_job_accounting(self, job_accounting_output):
+        info = {}
+        record = {}
+        # Records are separated by a line of '=' and hold a key and value on
+        # each line.
+        for line in job_accounting_output + ['=']:
+            if line.startswith('='):
+                if 'jobnumber' in record:
+                    key = record['jobnumber']
+                    if record.get('taskid', 'undefined') != 'undefined':
+                        key = '%s[%s]' % (key, record['taskid'])
+                    info[key] = self._accounting_info(record)
+                record = {}
+                continue
+
+            fields = line.split(None, 1)
+            if len(fields) == 2:
+                record[fields[0]] = fields[1].strip()
+
+        return info
+
+    def _accounting_info(self, record):
+        job_info = {
+            'state': 'done'
+        }
+        try:
+            exit_code = int(record.get('exit_status', '0'))
+            # failed is non zero if SGE was unable to run the job
+            failed = int(record.get('failed', '0').split()[0])
+            job_info['exitCode'] = exit_code
+            if exit_code != 0 or failed != 0:
+                job_info['state'] = 'failed'
+            job_info['elapsed'] = int(float(record['ru_wallclock']))
+        except (KeyError, ValueError):
+            pass
+
+        resources = {key: record[key] for key in ['cpu', 'mem', 'maxvmem']
+                     if key in record}
+        if resources:
+            job_info['resourcesUsed'] = resources
+
+        return job_info
+
+    def _extract_capabilities(self, outputs):
+        capabilities = super(SgeQueueAdapter, self) \
+            ._extract_capabilities(outputs)
+
+        if 'parallelEnvironments' in outputs:
+            parallel_envs = []
+            for line in outputs['parallelEnvironments']:
+                fields = line.split()
+                if len(fields) < 2:
+                    continue
+                if fields[0] == 'pe_name':
+                    parallel_envs.append({'name': fields[1]})
+                elif fields[0] == 'slots' and parallel_envs:
+                    parallel_envs[-1]['slots'] = int(fields[1])
+            capabilities['parallelEnvironments'] = parallel_envs
+
+        if 'queues' in outputs:
+            capabilities['queues'] = [q.strip() for q in outputs['queues']]
+
+        if 'nodes' in outputs:
+            capabilities['nodes'] = len(outputs['nodes'])
+
+        return capabilities
+
+    def _extract_queue_jobs(self, output):
+        jobs = []
+        for job in iterelements(output, 'job_list'):
+            state = findtext(job, 'state', '').lower()
+            owner = findtext(job, 'JB_owner')
+            # Pending array jobs list their tasks as a range
+            tasks = findtext(job, 'tasks')
+            count = len(_expand_tasks(tasks)) if tasks else 1
+            jobs += [(owner, state)] * count
+
+        return jobs
+
+    def _extract_resources(self, output):
+        # The cluster queue summary lists USED, RES, AVAIL and TOTAL slots for
+        # each queue after a header and a line of dashes
+        free = total = 0
+        for line in output:
+            fields = line.split()
+            if len(fields) < 6 or not fields[4].isdigit():
+                continue
+            free += int(fields[4])
+            total += int(fields[5])
+
+        return {'freeSlots': free, 'totalSlots': total}
+
+    def _to_job_queue_state(self, scheduler_state):
+        state = super(SgeQueueAdapter, self)._to_job_queue_state(
+            scheduler_state)
+        if state is None and scheduler_state:
+            for (letter, queue_state) in self.STATE_LETTERS:
+                if letter in scheduler_state:
+                    return queue_state
 
         return state
 
@@ -97,3 +242,20 @@ class SgeQueueAdapter(AbstractQueueAdapter):
             raise Exception('Unable to retrieve number of slots')
 
         return slots
+
+
+def _expand_tasks(tasks):
+    """
+    Expand an SGE task range, for example 1-10:2,15, to the task indexes.
+    """
+    indexes = []
+    for task_range in tasks.split(','):
+        m = re.match('^(\\d+)(?:-(\\d+)(?::(\\d+))?)?$', task_range.strip())
+        if not m:
+            continue
+        start = int(m.group(1))
+        end = int(m.group(2) or start)
+        step = int(m.group(3) or 1)
+        indexes += range(start, end + 1, step)
+
+    return indexes
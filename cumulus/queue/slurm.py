@@ -1,6 +1,5 @@
 import re
-from cumulus.queue.abstract import AbstractQueueAdapter
-from cumulus.constants import JobQueueState
+from cumulus.queue.abstract import AbstractQueueAdapter, parse_elapsed
 
 
 class SlurmQueueAdapter(AbstractQueueAdapter):
@@ -23,19 +22,45 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
     # S   SUSPENDED       Job  has an allocation, but execution has been sus-
     #                     pended.
     # TO  TIMEOUT         Job terminated upon reaching its time limit.
+    #
+    # squeue reports the short codes above, jobs that have left the queue are
+    # looked up using sacct which reports the full names. A job only shows as
+    # CA or TO in squeue while it is being cleaned up, however once it has
+    # left the queue a timeout is an error.
 
     # Running states
-    RUNNING_STATE = ['ca', 'cg', 'r', 's', 'to']
+    RUNNING_STATE = ['ca', 'cg', 'r', 's', 'to', 'running', 'suspended',
+                     'completing']
 
-    ERROR_STATE = ['f', 'nf']
+    ERROR_STATE = ['f', 'nf', 'failed', 'node_fail', 'timeout',
+                   'out_of_memory', 'boot_fail', 'deadline']
 
-    COMPLETE_STATE = ['cd', 'pr']
+    COMPLETE_STATE = ['cd', 'pr', 'completed', 'preempted', 'cancelled']
 
     # Queued states
-    QUEUED_STATE = ['cf', 'pd']
+    QUEUED_STATE = ['cf', 'pd', 'pending', 'configuring', 'requeued']
+
+    ARRAY_TASK_ID = '$SLURM_ARRAY_TASK_ID'
+    ARRAY_JOB_ID = '$SLURM_ARRAY_JOB_ID'
+
+    DISCOVERY_COMMANDS = {
+        'schedulerVersion': 'sinfo --version',
+        'queues': 'sinfo -h -o %R',
+        # A node is listed once for each partition it is in
+        'nodes': 'sinfo -h -N -o %N'
+    }
+
+    OCCUPANCY_COMMANDS = dict(AbstractQueueAdapter.OCCUPANCY_COMMANDS, **{
+        'jobs': 'squeue -h -r -o \'%u|%t\'',
+        # The CPUs of each node as allocated/idle/other/total
+        'resources': 'sinfo -h -N -o \'%N|%t|%C\''
+    })
+
+    def _slurm_job_id(self, job):
+        return _to_slurm_job_id(self.job_key(job))
 
     def terminate_job(self, job):
-        command = 'scancel %s' % job['queueJobId']
+        command = 'scancel %s' % self._slurm_job_id(job)
         output = self._cluster_connection.execute(command)
 
         return output
@@ -58,34 +83,123 @@ class SlurmQueueAdapter(AbstractQueueAdapter):
 
         return self._parse_job_id(output)
 
-    def job_status(self, job):
-        output = self._cluster_connection.execute('squeue -j %s'
-                                                  % job['queueJobId'])
-
-        state = None
-        slurm_state = self._extract_job_status(output, job)
-
-        if slurm_state:
-            if slurm_state in SlurmQueueAdapter.RUNNING_STATE:
-                state = JobQueueState.RUNNING
-            elif slurm_state in SlurmQueueAdapter.ERROR_STATE:
-                state = JobQueueState.ERROR
-            elif slurm_state in SlurmQueueAdapter.QUEUED_STATE:
-                state = JobQueueState.QUEUED
-            elif slurm_state in SlurmQueueAdapter.COMPLETE_STATE:
-                state = JobQueueState.COMPLETE
-
-        return state
-
-    def _extract_job_status(self, job_status_output, job):
-        state = None
-        job_id = job[AbstractQueueAdapter.QUEUE_JOB_ID]
+    def _extract_capabilities(self, outputs):
+        capabilities = super(SlurmQueueAdapter, self) \
+            ._extract_capabilities(outputs)
+
+        if 'queues' in outputs:
+            capabilities['queues'] = [p.strip() for p in outputs['queues']]
+
+        if 'nodes' in outputs:
+            capabilities['nodes'] = len(set(n.strip()
+                                            for n in outputs['nodes']))
+
+        return capabilities
+
+    def _extract_queue_jobs(self, output):
+        jobs = []
+        for line in output:
+            fields = line.strip().split('|')
+            if len(fields) == 2:
+                jobs.append((fields[0], fields[1].lower()))
+
+        return jobs
+
+    def _extract_resources(self, output):
+        # A node is listed once for each partition it is in
+        nodes = {}
+        for line in output:
+            fields = line.strip().split('|')
+            if len(fields) == 3:
+                nodes[fields[0]] = fields[1:]
+
+        resources = {
+            'totalNodes': len(nodes),
+            'freeNodes': 0,
+            'freeSlots': 0,
+            'totalSlots': 0
+        }
+        for (state, cpus) in nodes.itervalues():
+            cpus = cpus.split('/')
+            if state == 'idle':
+                resources['freeNodes'] += 1
+            try:
+                resources['freeSlots'] += int(cpus[1])
+                resources['totalSlots'] += int(cpus[3])
+            except (IndexError, ValueError):
+                pass
+
+        return resources
+
+    def _scheduler_info(self, keys):
+        # squeue exits with an error if any of the jobs have left the queue,
+        # -r lists each task of an array job.
+        output = self._cluster_connection.execute(
+            'squeue -h -r -o \'%%i|%%t\' -j %s'
+            % ','.join(self._queue_job_ids(keys)), ignore_exit_status=True)
+        info = self._extract_job_statuses(output)
+
+        # Jobs no longer in the queue are looked up in the accounting database
+        # so we know how they finished.
+        finished_ids = [_to_slurm_job_id(key) for key in keys
+                        if key not in info]
+        if finished_ids:
+            output = self._cluster_connection.execute(
+                'sacct -P -n -X -o JobID,State,ExitCode,Elapsed -j %s'
+                % ','.join(finished_ids), ignore_exit_status=True)
+            info.update(self._extract_job_accounting(output))
+
+        return info
+
+    def _extract_job_statuses(self, job_status_output):
+        info = {}
         for line in job_status_output:
-            m = re.match('^\\s*(\\d+)\\s+\\S+\\s+\\S+\\s+\\S+\\s+(\\w+)',
-                         line)
-
-            if m and m.group(1) == job_id:
-                state = m.group(2).lower()
-                break
-
-        return state
+            fields = line.strip().split('|')
+            if len(fields) == 2 and fields[1]:
+                key = _from_slurm_job_id(fields[0])
+                info[key] = {'state': fields[1].lower()}
+
+        return info
+
+    def _extract_job_accounting(self, job_accounting_output):
+        info = {}
+        for line in job_accounting_output:
+            fields = line.strip().split('|')
+            if len(fields) != 4 or not fields[1]:
+                continue
+
+            (job_id, state, exit_code, elapsed) = fields
+            # For example "CANCELLED by 1000"
+            job_info = {'state': state.split()[0].lower()}
+            try:
+                job_info['exitCode'] = int(exit_code.split(':')[0])
+                job_info['elapsed'] = parse_elapsed(elapsed)
+            except ValueError:
+                pass
+            info[_from_slurm_job_id(job_id)] = job_info
+
+        return info
+
+
+def _to_slurm_job_id(key):
+    """
+    Convert a job key to the id SLURM uses, array tasks are given as
+    1234_2 rather than 1234[2].
+    """
+    (job_id, index) = AbstractQueueAdapter.split_job_key(key)
+    if index is not None:
+        job_id = '%s_%s' % (job_id, index)
+
+    return job_id
+
+
+def _from_slurm_job_id(slurm_job_id):
+    """
+    The inverse of _to_slurm_job_id(), ranges of pending tasks such as
+    1234_[3-10] are left as they are.
+    """
+    m = re.match('^(\\d+)_(\\d+)$', slurm_job_id)
+    if m:
+        return '%s[%s]' % (m.group(1), m.group(2))
+
+    return slurm_job_id
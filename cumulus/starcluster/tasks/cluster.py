@@ -24,6 +24,8 @@ from cumulus.celery import command
 from cumulus.common import create_config_request, check_status
 import cumulus
 from cumulus.transport import get_connection
+from cumulus.queue import capabilities as queue_capabilities
+from cumulus.queue import occupancy as queue_occupancy
 import starcluster.config
 import starcluster.logger
 import starcluster.exception
@@ -175,9 +177,16 @@ def test_connection(cluster, log_write_url=None, girder_token=None):
             status = 'running'
             # Test can we can connect to cluster
             output = conn.execute('ls')
-        if len(output) < 1:
-            log.error('Unable connect to cluster')
-            status = 'error'
+            if len(output) < 1:
+                log.error('Unable connect to cluster')
+                status = 'error'
+            else:
+                # Now we can connect find out what the scheduler provides,
+                # this isn't fatal as submission will try again.
+                try:
+                    queue_capabilities.discover(cluster, conn, girder_token)
+                except Exception as ex:
+                    log.exception(ex)
 
         r = requests.patch(
             cluster_url, headers=headers, json={'status': status})
@@ -187,3 +196,24 @@ def test_connection(cluster, log_write_url=None, girder_token=None):
                            json={'status': 'error'})
         # Log the error message
         log.exception(ex)
+
+
+@command.task
+@cumulus.starcluster.logging.capture
+def refresh_queue_occupancy(cluster, log_write_url=None, girder_token=None):
+    """
+    Refresh the queue occupancy stored on the cluster, this is run in the
+    background when a stale occupancy is read.
+    """
+    cluster_url = '%s/clusters/%s' % (cumulus.config.girder.baseUrl,
+                                      cluster['_id'])
+    headers = {'Girder-Token':  girder_token}
+
+    # Fetch the cluster with this 'admin' token so we get the passphrase
+    # filled out.
+    r = requests.get(cluster_url, headers=headers)
+    check_status(r)
+    cluster = r.json()
+
+    with get_connection(girder_token, cluster) as conn:
+        queue_occupancy.refresh(cluster, conn, girder_token)
@@ -22,6 +22,12 @@ import traceback
 from cumulus.starcluster.logging import logstdout
 import cumulus.starcluster.logging
 from cumulus.common import check_status
+from cumulus.common.lease import (hold_lease, release_lease, process_lease,
+                                  JOB_LEASE)
+from cumulus.common.monitor import get_monitor_engine, Countdown
+from cumulus.common.polling import next_interval
+from cumulus.common.termination import (is_terminating, mark_terminating,
+                                        terminated_since_submit)
 from cumulus.starcluster.common import _log_exception, get_post_logger
 from cumulus.celery import command, monitor
 import cumulus
@@ -29,10 +35,14 @@ import cumulus.girderclient
 from cumulus.constants import ClusterType, JobQueueState
 from cumulus.queue import get_queue_adapter
 from cumulus.queue.abstract import AbstractQueueAdapter
+from cumulus.queue import capabilities as queue_capabilities
+from cumulus.queue.journal import JOURNAL_PATH, journal_key
+from cumulus.queue.poller import get_queue_status_poller
 from cumulus.transport import get_connection
 from cumulus.transport.files.download import download_path
 from cumulus.transport.files.upload import upload_path
 from cumulus.transport.files import get_assetstore_url_base, get_assetstore_id
+from cumulus.transport import resume as resume_transfer
 import starcluster.config
 import starcluster.logger
 import starcluster.exception
@@ -40,6 +50,7 @@ import requests
 import os
 import re
 import inspect
+import copy
 import time
 import uuid
 from StringIO import StringIO
@@ -49,17 +60,160 @@ from jsonpath_rw import parse
 import tempfile
 from girder_client import HttpError
 
+DEFAULT_OUTPUT_TAIL_SIZE = 64 * 1024
+DEFAULT_CALLBACK_POLL_INTERVAL = 30
+
+# The fields of the job the monitor keeps up to date in Girder
+MONITORED_FIELDS = ['status', 'timings', 'exitCode', 'resourcesUsed']
+# The fields of a tailed output recording how far it has been read
+TAIL_FIELDS = ['tailOffset', 'tailPartial']
+
 
 def _put_script(conn, script_commands):
     script_name = uuid.uuid4().hex
     script = script_commands + 'echo $!\n'
     conn.put(StringIO(script), script_name)
     cmd = './%s' % script_name
-    conn.execute('chmod 700 %s' % cmd)
 
     return cmd
 
 
+def _run_script(conn, cmd, scripts=None):
+    """
+    Make the scripts executable, run cmd and then remove the scripts in a
+    single remote invocation. cmd is only run if the scripts could be made
+    executable. Returns the output of cmd.
+    """
+    scripts = [cmd] + (scripts or [])
+    run_cmd = 'chmod 700 %s && %s' % (' '.join(scripts), cmd)
+    commands = [
+        run_cmd,
+        'rm -f %s' % ' '.join(scripts)
+    ]
+    (output, exit_status) = conn.execute_many(commands)[0]
+
+    if exit_status != 0:
+        output = '\n'.join(output)
+        msg = 'remote command \'%s\' failed with status %d:\n%s' \
+            % (run_cmd, exit_status, output)
+        raise starcluster.exception.RemoteCommandFailed(
+            msg, run_cmd, exit_status, output)
+
+    return output
+
+
+def _get_output(conn, remote_path, local_path):
+    """
+    Copy a job output file to local_path, resuming from a partial copy left
+    by a previous attempt if it is large enough to be worth it.
+    """
+    local_dir = os.path.dirname(local_path)
+    if not os.path.exists(local_dir):
+        os.makedirs(local_dir)
+
+    resume = os.path.exists(local_path) and \
+        os.path.getsize(local_path) >= resume_transfer.threshold()
+    conn.get_file(remote_path, local_path, resume=resume)
+
+
+def _tail_size():
+    """
+    The maximum number of bytes of output to retain for a tailed file.
+    """
+    return cumulus.config.get('job', {}).get('outputTailSize',
+                                             DEFAULT_OUTPUT_TAIL_SIZE)
+
+
+def _poll_countdown(cluster, job, status):
+    """
+    The delay before polling the scheduler for the job again, backing off the
+    longer the job stays in the same state. The expected runtime of a running
+    job can be given in its params. Once a job has been seen reporting its
+    state through callbacks it is only polled as a fallback, unless we need
+    to keep tailing its output. Until then we can't tell that the compute
+    nodes can reach Girder, so the job is polled as usual.
+    """
+    runtime_hint = None
+    if status == JobState.RUNNING:
+        runtime_hint = job.get('params', {}).get('expectedRuntime')
+    countdown = next_interval(job.setdefault('pollState', {}), status,
+                              cluster=cluster, runtime_hint=runtime_hint)
+
+    tailing = any(o.get('tail') for o in job.get('output', []))
+    if job.get('callbackReceived') and not tailing:
+        return max(countdown, cumulus.config.get('job', {}).get(
+            'callbackPollInterval', DEFAULT_CALLBACK_POLL_INTERVAL))
+
+    return countdown
+
+
+def _tail_state(output):
+    return {key: output[key] for key in TAIL_FIELDS if key in output}
+
+
+def _sent_state(job):
+    """
+    Returns the state of the job as held by Girder, as far as the monitor is
+    concerned.
+    """
+    state = {key: copy.deepcopy(job[key])
+             for key in MONITORED_FIELDS if key in job}
+    state['output'] = {output['path']: _tail_state(output)
+                       for output in job.get('output', [])
+                       if output.get('tail')}
+
+    return state
+
+
+def _job_update(job, job_status):
+    """
+    Returns the changes to send to Girder since the last update, the state
+    last sent is kept in the job. Any new content for a tailed output is sent
+    as a delta for Girder to append.
+    """
+    sent = job.setdefault('sentState', _sent_state(job))
+    update = {key: job[key] for key in MONITORED_FIELDS
+              if key in job and job[key] != sent.get(key)}
+
+    output_delta = getattr(job_status, 'output_delta', {})
+    outputs = []
+    for output in job.get('output', []):
+        if not output.get('tail'):
+            continue
+        path = output['path']
+        tail = _tail_state(output)
+        if path in output_delta or tail != sent['output'].get(path, {}):
+            delta = dict(tail, path=path)
+            if path in output_delta:
+                delta['contentDelta'] = output_delta[path]
+            outputs.append(delta)
+    if outputs:
+        update['outputDelta'] = outputs
+
+    return update
+
+
+def _update_sent(job, update):
+    sent = job['sentState']
+    for key in MONITORED_FIELDS:
+        if key in update:
+            sent[key] = copy.deepcopy(update[key])
+    for output in update.get('outputDelta', []):
+        sent['output'][output['path']] = _tail_state(output)
+
+
+def _update_accounting(job, job_info):
+    """
+    Record the exit code, elapsed time and resource usage reported by the
+    scheduler.
+    """
+    for key in ['exitCode', 'resourcesUsed']:
+        if key in job_info:
+            job[key] = job_info[key]
+    if 'elapsed' in job_info:
+        job.setdefault('timings', {})['elapsed'] = job_info['elapsed'] * 1000
+
+
 def _job_dir(job):
     job_dir = './%s' % job['_id']
     output_root = parse('params.jobOutputDir').find(job)
@@ -98,10 +252,7 @@ def download_job_input_items(cluster, job, log_write_url=None,
                                                      download_output)
 
             download_cmd = _put_script(conn, download_cmd)
-            output = conn.execute(download_cmd)
-
-            # Remove download script
-            conn.remove(download_cmd)
+            output = _run_script(conn, download_cmd)
 
         if len(output) != 1:
             raise Exception('PID not returned by execute command')
@@ -176,15 +327,33 @@ def _get_parallel_env(cluster, job):
     return parallel_env
 
 
-def _is_terminating(job, girder_token):
+def _current_status(job, girder_token):
+    """
+    Returns the status of the job held by Girder. A termination recorded on
+    the job is flagged on this host, in case this worker missed the
+    broadcast, so the job's later tasks here pick it up.
+    """
     headers = {'Girder-Token':  girder_token}
     status_url = '%s/jobs/%s/status' % (cumulus.config.girder.baseUrl,
                                         job['_id'])
     r = requests.get(status_url, headers=headers)
     check_status(r)
-    current_status = r.json()['status']
+    status = r.json()
+
+    stamp = status.get('terminationStamp')
+    if terminated_since_submit(job, stamp) and not is_terminating(job):
+        mark_terminating(job['_id'], stamp)
 
-    return current_status in [JobState.TERMINATED, JobState.TERMINATING]
+    return status['status']
+
+
+def _is_terminating(job):
+    """
+    Checked locally, the workers are told of a termination by broadcast so
+    there is no need to ask Girder. Workers that missed the broadcast pick the
+    termination up from the status fetched by the monitor.
+    """
+    return is_terminating(job)
 
 
 def _generate_submission_script(job, cluster, job_params):
@@ -192,17 +361,85 @@ def _generate_submission_script(job, cluster, job_params):
     template = env.get_template('template.sh')
     script = template.render(cluster=cluster, job=job,
                              baseUrl=cumulus.config.girder.baseUrl,
-                             **job_params)
+                             journalPath=JOURNAL_PATH,
+                             journalKey=journal_key(job), **job_params)
 
     # We now render again to ensure any template variable in the jobs
     # commands are filled out.
     script = Template(script).render(cluster=cluster, job=job,
                                      baseUrl=cumulus.config.girder.baseUrl,
-                                     **job_params)
+                                     journalPath=JOURNAL_PATH, **job_params)
 
     return script
 
 
+def _get_job_params(cluster, job, conn, girder_token):
+    """
+    Returns the parameters used to template the submission script, along with
+    the number of slots available in the parallel environment or -1.
+    """
+    job_params = {}
+    if 'params' in job:
+        job_params = job['params']
+
+    slots = -1
+    parallel_env = _get_parallel_env(cluster, job)
+    if parallel_env:
+        job_params['parallelEnvironment'] = parallel_env
+
+        # If the number of slots has not been provided we will get
+        # the number of slots from the parallel environment, using the
+        # capabilities discovered for the cluster.
+        if ('numberOfSlots' not in cluster['config']):
+            capabilities = queue_capabilities.get_capabilities(
+                cluster, conn, girder_token)
+            slots = queue_capabilities.parallel_environment_slots(
+                capabilities, parallel_env)
+            # Fall back to asking the scheduler
+            if slots is None:
+                slots = get_queue_adapter(cluster, conn) \
+                    .number_of_slots(parallel_env)
+            if slots > 0:
+                job_params['numberOfSlots'] = int(slots)
+
+    return (job_params, slots)
+
+
+def _generate_array_submission_script(jobs, cluster, job_params, adapter):
+    """
+    Generate a script submitting jobs as the tasks of a single array job, each
+    task runs the commands of one job in its own directory. The scheduler
+    directives are taken from the first job.
+    """
+    array_jobs = []
+    for job in jobs:
+        job_dir = job['dir']
+        if not os.path.isabs(job_dir):
+            job_dir = os.path.normpath(os.path.join('$HOME', job_dir))
+        # Fill out any template variables in the commands using their own job
+        commands = [Template(command).render(
+            cluster=cluster, job=job, baseUrl=cumulus.config.girder.baseUrl,
+            **job_params) for command in job.get('commands', [])]
+        array_jobs.append({
+            '_id': job['_id'],
+            'name': job['name'],
+            'dir': job_dir,
+            'commands': commands,
+            'callbackToken': job.get('callbackToken'),
+            'journalKey': journal_key(job)
+        })
+
+    array_params = dict(job_params)
+    array_params.update({
+        'arraySize': len(jobs),
+        'arrayJobs': array_jobs,
+        'arrayTaskId': adapter.ARRAY_TASK_ID,
+        'arrayJobId': adapter.ARRAY_JOB_ID
+    })
+
+    return _generate_submission_script(jobs[0], cluster, array_params)
+
+
 def _get_on_complete(job):
     on_complete = parse('onComplete.cluster').find(job)
 
@@ -225,30 +462,15 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None):
     status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job_id)
     try:
         # if terminating break out
-        if _is_terminating(job, girder_token):
+        if _is_terminating(job):
             return
 
         script_name = job['name']
 
         with logstdout():
             with get_connection(girder_token, cluster) as conn:
-                job_params = {}
-                if 'params' in job:
-                    job_params = job['params']
-
-                slots = -1
-                parallel_env = _get_parallel_env(cluster, job)
-                if parallel_env:
-                    job_params['parallelEnvironment'] = parallel_env
-
-                    # If the number of slots has not been provided we will get
-                    # the number of slots from the parallel environment
-                    if ('numberOfSlots' not in cluster['config']):
-                        slots = get_queue_adapter(cluster, conn) \
-                            .number_of_slots(parallel_env)
-                        if slots > 0:
-                            job_params['numberOfSlots'] = int(slots)
-
+                (job_params, slots) = _get_job_params(cluster, job, conn,
+                                                      girder_token)
                 script = _generate_submission_script(job, cluster, job_params)
 
                 conn.mkdir(job_dir, ignore_failure=True)
@@ -268,11 +490,19 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None):
                 'status': JobState.QUEUED,
                 AbstractQueueAdapter.QUEUE_JOB_ID: queue_job_id
             }
+            # Kept on the job, so its tasks can tell a termination of this
+            # submission from an earlier one
+            if 'submitStamp' in job:
+                patch_data['submitStamp'] = job['submitStamp']
 
             r = requests.patch(status_url, headers=headers, json=patch_data)
             check_status(r)
+            # The callback token isn't stored on the job so carry it over
+            callback_token = job.get('callbackToken')
             job = r.json()
             job['queuedTime'] = time.time()
+            if callback_token:
+                job['callbackToken'] = callback_token
 
             # Now monitor the jobs progress
             monitor_job.s(cluster, job, log_write_url=log_write_url,
@@ -302,7 +532,99 @@ def submit_job(cluster, job, log_write_url=None, girder_token=None):
         raise
 
 
+@command.task
+@cumulus.starcluster.logging.capture
+def submit_array_job(cluster, jobs, log_write_url=None, girder_token=None):
+    """
+    Submit jobs as the tasks of a single scheduler array job, rather than
+    running a qsub for each one. Each job is still monitored on its own, the
+    status queries being batched across the array.
+    """
+    headers = {'Girder-Token':  girder_token}
+
+    def _status_url(job):
+        return '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job['_id'])
+
+    try:
+        jobs = [job for job in jobs if not _is_terminating(job)]
+        if not jobs:
+            return
+
+        for job in jobs:
+            job['dir'] = _job_dir(job)
+        script_name = jobs[0]['name']
+
+        with logstdout():
+            with get_connection(girder_token, cluster) as conn:
+                adapter = get_queue_adapter(cluster, conn)
+                (job_params, _) = _get_job_params(cluster, jobs[0], conn,
+                                                  girder_token)
+                script = _generate_array_submission_script(
+                    jobs, cluster, job_params, adapter)
+
+                for job in jobs:
+                    conn.mkdir(job['dir'], ignore_failure=True)
+                conn.put(StringIO(script),
+                         os.path.join(jobs[0]['dir'], script_name))
+                queue_job_id = adapter.submit_job(jobs[0], script_name)
+
+            for (index, job) in enumerate(jobs, start=1):
+                patch_data = {
+                    'status': JobState.QUEUED,
+                    AbstractQueueAdapter.QUEUE_JOB_ID: queue_job_id,
+                    AbstractQueueAdapter.QUEUE_ARRAY_INDEX: index
+                }
+                if 'submitStamp' in job:
+                    patch_data['submitStamp'] = job['submitStamp']
+                r = requests.patch(_status_url(job), headers=headers,
+                                   json=patch_data)
+                check_status(r)
+                callback_token = job.get('callbackToken')
+                job = r.json()
+                job['queuedTime'] = time.time()
+                if callback_token:
+                    job['callbackToken'] = callback_token
+
+                job_log_url = '%s/log' % _status_url(job)
+                monitor_job.s(cluster, job, log_write_url=job_log_url,
+                              girder_token=girder_token) \
+                    .apply_async(countdown=5)
+    except Exception as ex:
+        traceback.print_exc()
+        for job in jobs:
+            r = requests.patch(_status_url(job), headers=headers,
+                               json={'status': JobState.UNEXPECTEDERROR})
+            check_status(r)
+        _log_exception(ex)
+        if not isinstance(ex, (starcluster.exception.RemoteCommandFailed,
+                               starcluster.exception.ClusterDoesNotExist)):
+            raise
+
+
+def submit_array(girder_token, cluster, jobs, log_url):
+    """
+    Submit jobs as a single array job. Jobs with input to download first are
+    submitted individually.
+    """
+    array_jobs = []
+    for job in jobs:
+        if 'input' in job and len(job['input']) > 0:
+            submit(girder_token, cluster, job,
+                   '%s/jobs/%s/log' % (cumulus.config.girder.baseUrl,
+                                       job['_id']))
+        else:
+            job['submitStamp'] = time.time()
+            array_jobs.append(job)
+
+    if array_jobs:
+        submit_array_job.delay(cluster, array_jobs, log_write_url=log_url,
+                               girder_token=girder_token)
+
+
 def submit(girder_token, cluster, job, log_url):
+    # So terminations from before this submission are ignored
+    job['submitStamp'] = time.time()
+
     # Do we inputs to download ?
     if 'input' in job and len(job['input']) > 0:
 
@@ -372,7 +694,9 @@ class Created(JobState):
             raise Exception('Unrecognized state: %s' % job_queue_status)
 
     def run(self):
-        self.task.retry(throw=False, countdown=5)
+        self.task.retry(throw=False,
+                        countdown=_poll_countdown(self.cluster, self.job,
+                                                  str(self)))
 
         return self
 
@@ -391,40 +715,63 @@ class Queued(JobState):
             raise Exception('Unrecognized state: %s' % job_queue_status)
 
     def run(self):
-        self.task.retry(throw=False, countdown=5)
+        self.task.retry(throw=False,
+                        countdown=_poll_countdown(self.cluster, self.job,
+                                                  str(self)))
 
 
 class Running(JobState):
     def _tail_output(self):
+        """
+        Read any new output from the files being tailed, using the byte offset
+        reached on the last tick. The new lines are stored in output_delta to
+        be sent to Girder, only the offset and any incomplete last line are
+        kept in the job.
+        """
         log = starcluster.logger.get_starcluster_logger()
+        max_size = _tail_size()
+        self.output_delta = {}
 
-        # Do we need to tail any output files
         for output in self.job.get('output', []):
-            if 'tail' in output and output['tail']:
-                path = output['path']
-                offset = 0
-                if 'content' in output:
-                    offset = len(output['content'])
-                else:
-                    output['content'] = []
-                tail_path = os.path.join(_job_dir(self.job), path)
-                command = 'tail -n +%d %s' % (offset, tail_path)
-                try:
-                    # Only tail if file exists
-                    if self.conn.isfile(tail_path):
-                        stdout = self.conn.execute(command)
-                        output['content'] = output['content'] + stdout
-                    else:
-                        log.info('Skipping tail of %s as file doesn\'t '
-                                 'currently exist' %
-                                 tail_path)
-                except starcluster.exception.RemoteCommandFailed as ex:
-                    _log_exception(ex)
+            if 'tail' not in output or not output['tail']:
+                continue
+
+            # Content is held by Girder, don't carry it around in the job
+            output.pop('content', None)
+            offset = output.get('tailOffset', 0)
+            tail_path = os.path.join(_job_dir(self.job), output['path'])
+            result = self.conn.read_from(tail_path, offset, max_size=max_size)
+            if result is None:
+                log.info('Skipping tail of %s as file doesn\'t '
+                         'currently exist' % tail_path)
+                continue
+
+            (start, data) = result
+            if start == offset:
+                data = output.get('tailPartial', '') + data
+            elif start > 0:
+                # We have skipped ahead, so drop the partial first line
+                data = data[data.find('\n') + 1:] if '\n' in data else ''
+
+            lines = data.split('\n')
+            partial = lines.pop()
+            # Don't hold on to a huge line with no line break
+            if len(partial) > max_size:
+                lines.append(partial)
+                partial = ''
+
+            output['tailOffset'] = start + len(result[1])
+            output['tailPartial'] = partial
+            if lines:
+                self.output_delta[output['path']] = lines
 
     def next(self, job_queue_status):
         if not job_queue_status or job_queue_status == JobQueueState.COMPLETE:
             return Uploading(self)
-        elif job_queue_status == JobQueueState.RUNNING:
+        # The start callback can move the job to running before the
+        # scheduler reports it
+        elif job_queue_status in [JobQueueState.RUNNING,
+                                  JobQueueState.QUEUED]:
             return self
         elif job_queue_status == JobQueueState.ERROR:
             return Error(self)
@@ -434,7 +781,9 @@ class Running(JobState):
     def run(self):
         self._update_queue_time(self.job)
         self._tail_output()
-        self.task.retry(throw=False, countdown=5)
+        self.task.retry(throw=False,
+                        countdown=_poll_countdown(self.cluster, self.job,
+                                                  str(self)))
 
 
 class Complete(JobState):
@@ -443,7 +792,6 @@ class Complete(JobState):
         error = False
         for output in self.job.get('output', []):
             if 'errorRegEx' in output and output['errorRegEx']:
-                print "we have a regex"
                 stdout_file = '%s-%s.o%s' % (self.job['name'],
                                              self.job['_id'],
                                              self.job['queueJobId'])
@@ -456,21 +804,20 @@ class Complete(JobState):
                     'stderr': stderr_file
                 }
 
-                tmp_path = None
-                try:
-                    path = Template(output['path']).render(**variables)
-                    tmp_path = os.path.join(tempfile.tempdir, path)
-                    path = os.path.join(_job_dir(self.job), path)
-                    self.conn.get(path, localpath=tmp_path)
-                    error_regex = re.compile(output['errorRegEx'])
-                    with open(tmp_path, 'r') as fp:
-                        for line in fp:
-                            if error_regex.match(line):
-                                error = True
-                                break
-                finally:
-                    if tmp_path and os.path.exists(tmp_path):
-                        os.remove(tmp_path)
+                path = Template(output['path']).render(**variables)
+                # The local copy is only removed once it has been checked, so
+                # a retry after the transfer fails can resume it.
+                tmp_path = os.path.join(tempfile.gettempdir(), 'cumulus',
+                                        self.job['_id'], path)
+                path = os.path.join(_job_dir(self.job), path)
+                _get_output(self.conn, path, tmp_path)
+                error_regex = re.compile(output['errorRegEx'])
+                with open(tmp_path, 'r') as fp:
+                    for line in fp:
+                        if error_regex.match(line):
+                            error = True
+                            break
+                os.remove(tmp_path)
 
             if error:
                 break
@@ -577,64 +924,206 @@ def from_string(s, **kwargs):
     return state
 
 
-@monitor.task(bind=True, max_retries=None)
-@cumulus.starcluster.logging.capture
-def monitor_job(task, cluster, job, log_write_url=None, girder_token=None):
-    headers = {'Girder-Token':  girder_token}
-    job_id = job['_id']
+# The states the monitor polls the scheduler in
+POLLED_STATES = [JobState.CREATED, JobState.QUEUED, JobState.RUNNING,
+                 JobState.TERMINATING]
 
-    status_update_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job_id)
-    status_url = '%s/jobs/%s/status' % (cumulus.config.girder.baseUrl, job_id)
+
+def _monitor_tick(task, conn, cluster, job, log_write_url=None,
+                  girder_token=None, exit_code=None):
+    """
+    Move the job on by one step, using task to schedule the next one. Only the
+    changes since the last update are sent to Girder. The status held by
+    Girder is only fetched when the job is about to change state, in case it
+    has been moved on by a callback or termination. Returns the new state of
+    the job, or None if the job has been moved out of the states we poll in.
+    """
+    headers = {'Girder-Token':  girder_token}
+    status_update_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                                        job['_id'])
+    sent = job.setdefault('sentState', _sent_state(job))
+    current_status = job.get('status')
+    # A termination we have been told of is picked up straight away rather
+    # than on the next change of state.
+    fetched = current_status is None or (
+        current_status != JobState.TERMINATING and _is_terminating(job))
+    if fetched:
+        current_status = sent['status'] = job['status'] \
+            = _current_status(job, girder_token)
+
+    # Once the job has been moved past the states we poll in, by a
+    # callback for example, the polling can stop.
+    if current_status not in POLLED_STATES:
+        return None
 
     try:
-        with get_connection(girder_token, cluster) as conn:
-            # First get the current status
-            r = requests.get(status_url, headers=headers)
-            check_status(r)
+        if exit_code is not None:
+            state = JobQueueState.COMPLETE if exit_code == 0 \
+                else JobQueueState.ERROR
+            job_info = {'state': state, 'exitCode': exit_code}
+        else:
+            # Batched with the other jobs being monitored on the cluster
+            job_info = get_queue_status_poller().job_info(
+                cluster, get_queue_adapter(cluster, conn), job, conn)
+        job_queue_state = job_info['state']
+        _update_accounting(job, job_info)
+        # The next tick is only scheduled once the update has been sent, so
+        # the job it carries holds the state sent.
+        next_tick = Countdown()
+        kwargs = {
+            'task': next_tick,
+            'cluster': cluster,
+            'job': job,
+            'log_write_url': log_write_url,
+            'girder_token': girder_token,
+            'conn': conn
+        }
+        job_status = from_string(current_status, **kwargs)
+        job_status = job_status.next(job_queue_state)
+        if str(job_status) != current_status and not fetched:
+            # Make sure the job is still where we left it before moving it on
+            confirmed = sent['status'] = _current_status(job, girder_token)
+            if confirmed not in POLLED_STATES:
+                job['status'] = confirmed
+                return None
+            if confirmed != current_status:
+                # Only the started callback moves a job on ahead of us
+                if current_status == JobState.QUEUED \
+                        and confirmed == JobState.RUNNING:
+                    job['callbackReceived'] = True
+                job_status = from_string(confirmed, **kwargs)
+                job_status = job_status.next(job_queue_state)
+        job['status'] = str(job_status)
+        job_status.run()
+    except EOFError:
+        # Try again
+        task.retry(throw=False, countdown=5)
+        return None
+    except starcluster.exception.SSHConnectionError:
+        # Try again
+        task.retry(throw=False, countdown=5)
+        return None
 
-            current_status = r.json()['status']
+    # Nothing to write if nothing has changed
+    update = _job_update(job, job_status)
+    if update:
+        r = requests.patch(status_update_url, headers=headers, json=update)
+        check_status(r)
+        _update_sent(job, update)
 
-            if current_status == JobState.TERMINATED:
-                return
+    if next_tick.countdown is not None:
+        task.retry(throw=False, countdown=next_tick.countdown)
 
-            try:
-                job_queue_state \
-                    = get_queue_adapter(cluster, conn).job_status(job)
-                job_status = from_string(current_status, task=task,
-                                         cluster=cluster, job=job,
-                                         log_write_url=log_write_url,
-                                         girder_token=girder_token, conn=conn)
-                job_status = job_status.next(job_queue_state)
-                job['status'] = str(job_status)
-                job_status.run()
-            except EOFError:
-                # Try again
-                task.retry(throw=False, countdown=5)
-                return
-            except starcluster.exception.SSHConnectionError as ex:
-                # Try again
-                task.retry(throw=False, countdown=5)
-                return
-
-        json = {
-            'status': str(job_status),
-            'timings': job.get('timings', {}),
-            'output': job['output']
-        }
+    return job_status
 
-        r = requests.patch(status_update_url, headers=headers, json=json)
-        check_status(r)
+
+def _release_finished(job, holder, girder_token):
+    """
+    Release the lease on the job once it has been moved out of the states we
+    poll in, so a later monitor isn't kept waiting for it to expire.
+    """
+    if job.get('status') not in POLLED_STATES:
+        release_lease(job, JOB_LEASE, holder, girder_token)
+
+
+def _monitor_failed(job, girder_token, ex):
+    headers = {'Girder-Token':  girder_token}
+    status_update_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl,
+                                        job['_id'])
+    r = requests.patch(status_update_url, headers=headers,
+                       json={'status': JobState.UNEXPECTEDERROR})
+    check_status(r)
+    _log_exception(ex)
+
+
+class MonitoredJob(object):
+    """
+    A job driven by the monitor engine rather than by a chain of monitor_job
+    retries. holder is the id of the monitor_job task that handed the job to
+    the engine, the engine holds the job's lease under it.
+    """
+    def __init__(self, cluster, job, holder, log_write_url=None,
+                 girder_token=None, exit_code=None):
+        self.cluster = cluster
+        self.job = job
+        self.holder = holder
+        self.log_write_url = log_write_url
+        self.girder_token = girder_token
+        self.exit_code = exit_code
+
+    @property
+    def key(self):
+        return str(self.job['_id'])
+
+    def tick(self, task, conn):
+        # Another monitor has taken the job over
+        if not hold_lease(self.job, JOB_LEASE, self.holder,
+                          self.girder_token):
+            return
+
+        _monitor_tick(task, conn, self.cluster, self.job,
+                      log_write_url=self.log_write_url,
+                      girder_token=self.girder_token,
+                      exit_code=self.exit_code)
+        _release_finished(self.job, self.holder, self.girder_token)
+
+    def failed(self, ex):
+        _monitor_failed(self.job, self.girder_token, ex)
+
+    def handoff(self, countdown):
+        # Carried on under the same task id, so it keeps the lease
+        monitor_job.apply_async(
+            args=(self.cluster, self.job), countdown=countdown,
+            task_id=self.holder,
+            kwargs={'log_write_url': self.log_write_url,
+                    'girder_token': self.girder_token,
+                    'exit_code': self.exit_code})
+
+
+@monitor.task(bind=True, max_retries=None)
+@cumulus.starcluster.logging.capture
+def monitor_job(task, cluster, job, log_write_url=None, girder_token=None,
+                exit_code=None, started=False):
+    """
+    Poll the scheduler for the state of the job and move it on. exit_code is
+    given when the monitor is run by the job's exit callback, the scheduler
+    then doesn't need to be asked. started is set when it is run by the
+    job's start callback, which has already moved the job on to running.
+
+    Only one monitor is live for a job, the one holding its lease. Any other
+    exits straight away, unless it was run by a callback in which case it
+    takes the job over. The lease is held under the id of the task, which is
+    kept across retries.
+    """
+    holder = task.request.id
+    callback = exit_code is not None or started
+    try:
+        if not hold_lease(job, JOB_LEASE, holder, girder_token,
+                          steal=callback):
+            return
+
+        # The job's callbacks are being received, so its polling can relax
+        if started:
+            job['callbackReceived'] = True
+
+        engine = get_monitor_engine()
+        if engine is not None and engine.owns(cluster):
+            engine.add(MonitoredJob(cluster, job, holder,
+                                    log_write_url=log_write_url,
+                                    girder_token=girder_token,
+                                    exit_code=exit_code))
+            return
+
+        with get_connection(girder_token, cluster) as conn:
+            _monitor_tick(task, conn, cluster, job,
+                          log_write_url=log_write_url,
+                          girder_token=girder_token, exit_code=exit_code)
+        _release_finished(job, holder, girder_token)
     except starcluster.exception.RemoteCommandFailed as ex:
-        r = requests.patch(status_update_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
-        check_status(r)
-        _log_exception(ex)
+        _monitor_failed(job, girder_token, ex)
     except Exception as ex:
         traceback.print_exc()
-        r = requests.patch(status_update_url, headers=headers,
-                           json={'status': JobState.UNEXPECTEDERROR})
-        check_status(r)
-        _log_exception(ex)
+        _monitor_failed(job, girder_token, ex)
         raise
 
 
@@ -646,7 +1135,7 @@ def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
 
     try:
         # if terminating break out
-        if _is_terminating(job, girder_token):
+        if _is_terminating(job):
             return
 
         with get_connection(girder_token, cluster) as conn:
@@ -669,10 +1158,7 @@ def upload_job_output_to_item(cluster, job, log_write_url=None, job_dir=None,
             cmds.append('nohup %s  &> ../%s  &\n' % (upload_cmd, upload_output))
 
             upload_cmd = _put_script(conn, '\n'.join(cmds))
-            output = conn.execute(upload_cmd)
-
-            # Remove upload script
-            conn.remove(upload_cmd)
+            output = _run_script(conn, upload_cmd)
 
         if len(output) != 1:
             raise Exception('PID not returned by execute command')
@@ -780,9 +1266,17 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
     job_id = job['_id']
     status_url = '%s/jobs/%s' % (cumulus.config.girder.baseUrl, job_id)
 
+    lease = process_lease(pid)
+    holder = task.request.id
+
     try:
+        # Only one monitor is live for the process
+        if not hold_lease(job, lease, holder, girder_token):
+            return
+
         # if terminating break out
-        if _is_terminating(job, girder_token):
+        if _is_terminating(job):
+            release_lease(job, lease, holder, girder_token)
             return
 
         with get_connection(girder_token, cluster) as conn:
@@ -792,11 +1286,20 @@ def monitor_process(task, cluster, job, pid, nohup_out_path,
                                   source_profile=False)
 
             if len(output) > 0:
-                # Process is still running so schedule self again in about 5
-                # secs
+                # Process is still running so schedule self again, backing
+                # off the longer it runs
                 # N.B. throw=False to prevent Retry exception being raised
-                task.retry(throw=False, countdown=5)
+                countdown = next_interval(job.setdefault('pollState', {}),
+                                          job['status'], cluster=cluster)
+                task.retry(throw=False, countdown=countdown)
             else:
+                # The process is done, so is its monitor
+                release_lease(job, lease, holder, girder_token)
+
+                # Make sure we haven't missed a termination before acting on
+                # how the process went
+                if _is_terminating(job):
+                    return
                 try:
                     nohup_out_file_name = os.path.basename(nohup_out_path)
 
@@ -883,10 +1386,8 @@ def terminate_job(cluster, job, log_write_url=None, girder_token=None):
                     terminate_cmd = 'nohup %s  &> %s  &\n' % (on_terminate,
                                                               terminate_output)
                     terminate_cmd = _put_script(conn, terminate_cmd)
-                    output = conn.execute(terminate_cmd)
-
-                    conn.remove(on_terminate)
-                    conn.remove(terminate_cmd)
+                    output = _run_script(conn, terminate_cmd,
+                                         scripts=[on_terminate])
 
                     if len(output) != 1:
                         raise Exception('PID not returned by execute command')
@@ -20,13 +20,12 @@
 from __future__ import absolute_import
 from cumulus.celery import monitor
 from cumulus.common import check_status
+from cumulus.common.polling import next_interval
 import cumulus
 import requests
+import time
 import traceback
 from . import runner
-from celery.exceptions import MaxRetriesExceededError
-
-sleep_interval = 5
 
 
 def _add_log_entry(token, task, entry):
@@ -46,16 +45,16 @@ def _update_status(headers, task, status):
 
 
 @monitor.task(bind=True, max_retries=None)
-def monitor_status(celery_task, token, task, spec, step, variables):
+def monitor_status(celery_task, token, task, spec, step, variables,
+                   poll_state=None):
     headers = {'Girder-Token':  token}
-    max_retries = None
+    # Carried between retries to back off polling
+    if poll_state is None:
+        poll_state = {}
     try:
         steps = spec['steps']
         status_step = steps[step]
         params = status_step['params']
-        if 'timeout' in params:
-            timeout = int(params['timeout'])
-            max_retries = timeout % sleep_interval
 
         url = '%s%s' % (cumulus.config.girder.baseUrl, params['url'])
         status = requests.get(url, headers=headers)
@@ -74,12 +73,15 @@ def monitor_status(celery_task, token, task, spec, step, variables):
             runner.run(token, task, spec, variables, step + 1)
         elif status in params['failure']:
             _update_status(headers, task, 'failure')
+        elif 'timeout' in params and \
+                time.time() - poll_state.get('started', time.time()) \
+                > int(params['timeout']):
+            _update_status(headers, task, 'timeout')
         else:
-            celery_task.retry(throw=False, countdown=sleep_interval,
-                              max_retries=max_retries)
+            countdown = next_interval(poll_state, status)
+            celery_task.retry(throw=False, countdown=countdown,
+                              kwargs={'poll_state': poll_state})
 
-    except MaxRetriesExceededError:
-        _update_status(headers, task, 'timeout')
     except BaseException as ex:
         # Update task log
         entry = {
@@ -0,0 +1,15 @@
+
+case {{ arrayTaskId }} in
+{% for array_job in arrayJobs -%}
+{{ loop.index }})
+    cd {{ array_job.dir }}
+    exec > {{ array_job.name }}-{{ array_job._id }}.o{{ arrayJobId }} 2>&1
+
+    _cumulus_events {{ array_job._id }} {{ array_job.journalKey }}
+{%- if array_job.callbackToken %} {{ array_job.callbackToken }}{% endif %}
+{%- for command in array_job.commands %}
+    {{ command -}}
+{% endfor %}
+    ;;
+{% endfor -%}
+esac
@@ -17,6 +17,9 @@
 {% if account -%}
 #$ -A {{account}}
 {% endif -%}
+{% if arraySize -%}
+#$ -t 1-{{arraySize}}
+{% endif -%}
 
 cd $SGE_O_WORKDIR
 
@@ -23,4 +23,7 @@
 {% if account -%}
 #SBATCH --account={{account}}
 {% endif -%}
+{% if arraySize -%}
+#SBATCH --array=1-{{arraySize}}
+{% endif -%}
 
@@ -8,8 +8,16 @@
 #
 {% include "schedulers/" + cluster.config.scheduler.type + ".sh" -%}
 
+{% include "events.sh" %}
+{% if arrayJobs -%}
+{% include "array.sh" %}
+
+{% else %}
+_cumulus_events {{ job._id }} {{ journalKey }}{% if job.callbackToken %} {{ job.callbackToken }}{% endif %}
 {% for command in job.commands %}
 {{ command -}}
 {% endfor %}
 
+{% endif -%}
+
 
@@ -17,13 +17,134 @@
 #  limitations under the License.
 ###############################################################################
 
+from contextlib import contextmanager
+import os
+import re
+import shutil
+import uuid
+
+from . import resume as resume_transfer
+
 
 class AbstractConnection(object):
 
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         raise NotImplementedError('Implemented by subclass')
 
-    def get(self, remote_path):
+    def execute_many(self, commands, source_profile=True):
+        """
+        Execute a list of commands in a single remote invocation. A command
+        failing does not stop the remaining commands from being run. Returns
+        a list containing a tuple for each command of the form:
+
+        (<output lines>, <exit status>)
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def _batch_script(self, commands):
+        """
+        Generate a script that runs each command in a subshell followed by a
+        delimiter line containing the commands exit status. Returns a tuple of
+        the delimiter and the script.
+        """
+        delimiter = '__cumulus_%s__' % uuid.uuid4().hex
+        script = []
+        for command in commands:
+            script.append('(%s); printf \'\\n%s %%d\\n\' $?'
+                          % (command, delimiter))
+
+        return (delimiter, '\n'.join(script))
+
+    def _parse_batch_output(self, output, delimiter, commands):
+        results = []
+        command_output = []
+        delimiter_regex = re.compile('^%s (\\d+)$' % delimiter)
+
+        for line in output:
+            m = delimiter_regex.match(line.strip())
+            if m:
+                # Remove the extra line break printed before the delimiter
+                if command_output and command_output[-1] == '':
+                    command_output.pop()
+                results.append((command_output, int(m.group(1))))
+                command_output = []
+            else:
+                command_output.append(line)
+
+        if len(results) != len(commands):
+            raise Exception('Unable to parse output of batched commands, '
+                            'expected %d results got %d'
+                            % (len(commands), len(results)))
+
+        return results
+
+    def get_file(self, remote_path, local_path, resume=False):
+        """
+        Copy remote_path to local_path. If resume is True and local_path is a
+        partial copy of the remote file, the prefix that matches the remote
+        file is kept and the transfer continues from the end of it.
+        """
+        offset = 0
+        if resume and os.path.exists(local_path):
+            offset = self._resume_get_offset(remote_path, local_path)
+
+        with open(local_path, 'r+b' if offset else 'wb') as fp:
+            fp.truncate(offset)
+            fp.seek(offset)
+            with self._get_from(remote_path, offset) as stream:
+                shutil.copyfileobj(stream, fp)
+
+    def _resume_get_offset(self, remote_path, local_path):
+        size = min(os.path.getsize(local_path),
+                   self.stat(remote_path).st_size)
+        block_size = resume_transfer.block_size()
+        checksums = resume_transfer.remote_block_checksums(
+            self, remote_path, size, block_size)
+        with open(local_path, 'rb') as fp:
+            (offset, _, _) = resume_transfer.matching_prefix(fp, checksums,
+                                                             block_size)
+
+        return offset
+
+    @contextmanager
+    def _get_from(self, remote_path, offset):
+        """
+        Returns a context manager providing a stream positioned at offset,
+        transports that can seek should override this.
+        """
+        with self.get(remote_path) as stream:
+            while offset > 0:
+                data = stream.read(min(offset, 64 * 1024))
+                if not data:
+                    break
+                offset -= len(data)
+            yield stream
+
+    def read_from(self, remote_path, offset, max_size=None):
+        """
+        Read remote_path from the byte offset to the end of the file. If more
+        than max_size bytes are available only the last max_size bytes are
+        read, if the file is shorter than offset ( it has been truncated ) it
+        is read from the start. Returns a tuple of the offset the data was read
+        from and the data, or None if the file doesn't exist.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def home_dir(self):
+        """
+        Returns the users home directory on the cluster.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def get(self, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False):
+        """
+        Returns a context manager providing a file like object to read
+        remote_path. If parallel is True the file is transferred in parts of
+        part_size using concurrency streams, if verify is True the checksum of
+        the transferred data is checked against the remote file. Transports
+        that can't transfer in parallel ignore these options.
+        """
         raise NotImplementedError('Implemented by subclass')
 
     def isfile(self, remote_path):
@@ -35,7 +156,24 @@ class AbstractConnection(object):
     def makedirs(self, path):
         raise NotImplementedError('Implemented by subclass')
 
-    def put(self, stream, remote_path):
+    def put(self, stream, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False, resume=False):
+        """
+        Write the contents of stream to remote_path, the parallel options are
+        the same as for get(...). If resume is True and remote_path is a
+        partial copy of the stream, the transfer continues from the end of the
+        prefix that matches. Transports that can't write at an offset ignore
+        resume.
+        """
+        raise NotImplementedError('Implemented by subclass')
+
+    def put_archive(self, remote_path):
+        """
+        Returns a context manager providing a tarfile.TarFile open for
+        writing. The archive is streamed to the cluster and extracted into
+        remote_path, creating it if necessary. The extraction is complete once
+        the context exits.
+        """
         raise NotImplementedError('Implemented by subclass')
 
     def stat(self):
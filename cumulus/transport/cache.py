@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import errno
+import os
+import threading
+import time
+
+import cumulus
+
+DEFAULT_METADATA_CACHE_TIMEOUT = 30
+
+
+class MetadataCache(object):
+    """
+    Caches the home directory and stat results ( including paths that don't
+    exist ) for a connection, so repeated lookups don't need a round trip to
+    the cluster. Entries expire after a timeout, the connection should
+    invalidate any path it modifies.
+    """
+    def __init__(self, timeout=None):
+        if timeout is None:
+            timeout = cumulus.config.get('transport', {}).get(
+                'metadataCacheTimeout', DEFAULT_METADATA_CACHE_TIMEOUT)
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._home_dir = None
+        # path => (stat result or IOError, expiry)
+        self._stats = {}
+
+    def home_dir(self, fetch):
+        """
+        Returns the cached home directory, fetch is called to look it up if
+        it is not cached.
+        """
+        with self._lock:
+            if self._home_dir and time.time() < self._home_dir[1]:
+                return self._home_dir[0]
+
+        home = fetch()
+        with self._lock:
+            self._home_dir = (home, time.time() + self.timeout)
+
+        return home
+
+    def stat(self, path, fetch):
+        """
+        Returns the cached stat result for a path, fetch is called to stat the
+        path if it is not cached. If fetch raises an IOError because the path
+        doesn't exist it is cached and raised again on subsequent lookups, any
+        other error is passed on without being cached.
+        """
+        path = os.path.normpath(path)
+        with self._lock:
+            cached = self._stats.get(path)
+            if cached and time.time() < cached[1]:
+                result = cached[0]
+                if isinstance(result, Exception):
+                    raise result
+                return result
+
+        expires = time.time() + self.timeout
+        try:
+            result = fetch()
+        except IOError as ex:
+            if ex.errno == errno.ENOENT:
+                with self._lock:
+                    self._stats[path] = (ex, expires)
+            raise
+
+        with self._lock:
+            self._stats[path] = (result, expires)
+
+        return result
+
+    def invalidate(self, path):
+        """
+        Drop any cached results for a path, its parent and anything below it.
+        """
+        path = os.path.normpath(path)
+        parent = os.path.dirname(path)
+        prefix = path.rstrip('/') + '/'
+        with self._lock:
+            for cached_path in self._stats.keys():
+                if cached_path in [path, parent] or \
+                        cached_path.startswith(prefix):
+                    del self._stats[cached_path]
+
+    def clear(self):
+        with self._lock:
+            self._home_dir = None
+            self._stats.clear()
@@ -33,7 +33,7 @@ def _import_path(cluster_connection, girder_client, parent, path,
     if path[0] != '/':
         # If we don't have a full path, assume the path is relative to the users
         # home directory.
-        home = cluster_connection.execute('pwd')[0]
+        home = cluster_connection.home_dir()
         path = os.path.abspath(os.path.join(home, path))
 
     for p in cluster_connection.list(path):
@@ -18,23 +18,43 @@
 ###############################################################################
 
 import os
+import tarfile
+import time
 
 from girder_client import GirderClient
 import requests
 
 import cumulus
 from cumulus.common import check_status
+from cumulus.transport import resume as resume_transfer
 
+DEFAULT_BULK_UPLOAD_THRESHOLD = 100
+DEFAULT_PARALLEL_TRANSFER_THRESHOLD = 64 * 1024 * 1024
 
-def _upload_file(cluster_connection, girder_client, file, path):
+
+def _download_file(girder_client, file):
     r = requests.get(
         '%s/file/%s/download' % (girder_client.urlBase, file['_id']),
         headers={'Girder-Token': girder_client.token}, stream=True)
     check_status(r)
-    cluster_connection.put(r.raw, os.path.join(path, file['name']))
+
+    return r
 
 
-def _upload_item(cluster_connection, girder_client, item, path):
+def _upload_file(cluster_connection, girder_client, file, path):
+    r = _download_file(girder_client, file)
+    transport_config = cumulus.config.get('transport', {})
+    size = file.get('size', 0)
+    # Large files are transferred in parallel parts and verified, and pick up
+    # where a previous attempt left off.
+    parallel = size >= transport_config.get(
+        'parallelTransferThreshold', DEFAULT_PARALLEL_TRANSFER_THRESHOLD)
+    resume = size >= resume_transfer.threshold()
+    cluster_connection.put(r.raw, os.path.join(path, file['name']),
+                           parallel=parallel, verify=parallel, resume=resume)
+
+
+def _list_item_files(girder_client, item):
     offset = 0
     params = {
         'limit': 50,
@@ -46,33 +66,79 @@ def _upload_item(cluster_connection, girder_client, item, path):
                                   parameters=params)
 
         for file in files:
-            _upload_file(cluster_connection, girder_client, file, path)
+            yield file
 
         offset += len(files)
         if len(files) < 50:
             break
 
 
-def _upload_items(cluster_connection, girder_client, folder_id, path):
-    for item in girder_client.listItem(folder_id):
-        _upload_item(cluster_connection, girder_client, item, path)
-
-
-def _upload_path(cluster_connection, girder_client, folder_id, path):
+def _list_path(girder_client, folder_id, path):
+    """
+    Yields a tuple (<remote path>, <file>) for each file to upload and
+    (<remote path>, None) for each directory to create, in the order they
+    need to be created.
+    """
     # First process items
-    _upload_items(cluster_connection, girder_client, folder_id, path)
+    for item in girder_client.listItem(folder_id):
+        for file in _list_item_files(girder_client, item):
+            yield (os.path.join(path, file['name']), file)
 
     # Now folders
     for folder in girder_client.listFolder(folder_id):
         folder_path = os.path.join(path, folder['name'])
-        cluster_connection.mkdir(folder_path)
-        _upload_path(cluster_connection, girder_client, folder['_id'],
-                     folder_path)
+        yield (folder_path, None)
+        for entry in _list_path(girder_client, folder['_id'], folder_path):
+            yield entry
+
+
+def _upload_entries(cluster_connection, girder_client, entries):
+    for (entry_path, file) in entries:
+        if file is None:
+            cluster_connection.mkdir(entry_path)
+        else:
+            _upload_file(cluster_connection, girder_client, file,
+                         os.path.dirname(entry_path))
+
+
+def _upload_archive(cluster_connection, girder_client, entries, path):
+    """
+    Stream all the entries to the cluster as a single tar archive.
+    """
+    with cluster_connection.put_archive(path) as archive:
+        for (entry_path, file) in entries:
+            info = tarfile.TarInfo(os.path.relpath(entry_path, path))
+            info.mtime = time.time()
+            if file is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0755
+                archive.addfile(info)
+            else:
+                info.size = file['size']
+                info.mode = 0644
+                r = _download_file(girder_client, file)
+                try:
+                    archive.addfile(info, r.raw)
+                finally:
+                    r.close()
 
 
 def upload_path(cluster_connection, girder_token, folder_id, path):
+    """
+    Upload the contents of a Girder folder to path on the cluster. Once the
+    number of files passes the transport.bulkUploadThreshold setting they are
+    sent as a single tar archive rather than one at a time.
+    """
     girder_client = GirderClient(apiUrl=cumulus.config.girder.baseUrl)
     girder_client.token = girder_token
-    cluster_connection.makedirs(path)
+    threshold = cumulus.config.get('transport', {}).get(
+        'bulkUploadThreshold', DEFAULT_BULK_UPLOAD_THRESHOLD)
+
+    entries = list(_list_path(girder_client, folder_id, path))
+    file_count = len([f for (_, f) in entries if f is not None])
 
-    _upload_path(cluster_connection, girder_client, folder_id, path)
+    if file_count > threshold:
+        _upload_archive(cluster_connection, girder_client, entries, path)
+    else:
+        cluster_connection.makedirs(path)
+        _upload_entries(cluster_connection, girder_client, entries)
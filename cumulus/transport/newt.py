@@ -17,35 +17,42 @@
 #  limitations under the License.
 ###############################################################################
 
+import errno
 import os
 from contextlib import contextmanager
+import pipes
 import stat
 import re
+import tarfile
+import tempfile
+import uuid
 
-import requests
 from paramiko import SFTPAttributes
 
 from jsonpath_rw import parse
 
 from .abstract import AbstractConnection
-import cumulus
+from .newt_client import get_newt_client
 from cumulus.common import check_status
 
-NEWT_BASE_URL = 'https://newt.nersc.gov/newt'
-
 newt_stat_command = '/bin/stat -c "st_mode=%f,st_ino=%i,st_dev=%d,' \
     'st_nlink=%h,st_uid=%u,st_gid=%g,st_size=%s,st_atime=%X,st_mtime=%Y,' \
     'st_ctime=%Z" '
 newt_mkdir_path = '/bin/mkdir'
 newt_rm_path = '/bin/rm'
+newt_sh_path = '/bin/sh'
+newt_tar_path = '/bin/tar'
 
 commands = {
     'ls': '/bin/ls',
     'rm': '/bin/rm',
     'pwd': '/bin/pwd',
     'tail': '/usr/bin/tail',
+    'whoami': '/usr/bin/whoami',
     # This may be very machine dependant!
-    'squeue': '/opt/slurm/default/bin/squeue'
+    'squeue': '/opt/slurm/default/bin/squeue',
+    'sacct': '/opt/slurm/default/bin/sacct',
+    'sinfo': '/opt/slurm/default/bin/sinfo'
 }
 
 type = {
@@ -84,41 +91,39 @@ class NewtClusterConnection(AbstractConnection):
         self._machine = parse('config.host').find(cluster)[0].value
 
     def __enter__(self):
-
-        # Do we need to get the session id for this user
-        if not self._newt_session_id:
-            headers = {'Girder-Token':  self._girder_token}
-            url = '%s/newt/sessionId' % cumulus.config.girder.baseUrl
-            r = requests.get(url, headers=headers)
-            check_status(r)
-
-            session_id = parse('sessionId').find(r.json())
-
-            if not session_id:
-                raise Exception('No NEWT session ID present')
-
-            self._session = requests.Session()
-            self._newt_session_id = session_id[0].value
-            self._session.cookies.set('newt_sessionid', self._newt_session_id)
+        # The session id is cached by the client, so this will only go to
+        # Girder the first time a user connects or once the id has expired.
+        self._newt_session_id = get_newt_client().session_id(
+            self._girder_token)
 
         return self
 
     def __exit__(self, type, value, traceback):
         pass
 
-    def execute(self, command, ignore_exit_status=False, source_profile=True):
-        url = '%s/command/%s' % (NEWT_BASE_URL, self._machine)
+    def _request(self, method, path, **kwargs):
+        return get_newt_client().request(self._girder_token, self._machine,
+                                         method, path, **kwargs)
+
+    def _metadata(self):
+        return get_newt_client().metadata(self._girder_token, self._machine)
 
+    def _full_path(self, command):
         # NEWT requires all commands are issued using a full executable path
         for (name, full_path) in commands.iteritems():
             command = re.sub(r'^%s[ ]*' % name, '%s ' % full_path, command)
 
+        return command
+
+    def execute(self, command, ignore_exit_status=False, source_profile=True):
+        command = self._full_path(command)
+
         data = {
             'executable': command,
             'loginenv': source_profile
         }
 
-        r = self._session.post(url, data=data)
+        r = self._request('POST', 'command/%s' % self._machine, data=data)
         check_status(r)
 
         json_response = r.json()
@@ -127,16 +132,30 @@ class NewtClusterConnection(AbstractConnection):
 
         return json_response['output'].split('\n')
 
+    def execute_many(self, commands, source_profile=True):
+        commands = [self._full_path(c) for c in commands]
+        (delimiter, script) = self._batch_script(commands)
+        # Run the batch through a shell, so it is a single NEWT command
+        command = '%s -c \'%s\'' % (newt_sh_path,
+                                    script.replace('\'', '\'\\\'\''))
+        output = self.execute(command, source_profile=source_profile)
+
+        return self._parse_batch_output(output, delimiter, commands)
+
+    # NEWT transfers are a single HTTP request, so the parallel and resume
+    # options are ignored.
     @contextmanager
-    def get(self, remote_path):
-        url = '%s/file/%s/%s' % (NEWT_BASE_URL, self._machine, remote_path)
+    def get(self, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False):
         params = {
             'view': 'read'
         }
         r = None
 
         try:
-            r = self._session.get(url, params=params, stream=True)
+            r = self._request('GET',
+                              'file/%s/%s' % (self._machine, remote_path),
+                              params=params, stream=True)
             check_status(r)
 
             yield r.raw
@@ -147,7 +166,7 @@ class NewtClusterConnection(AbstractConnection):
     def isfile(self, remote_path):
         try:
             s = self.stat(remote_path)
-        except NewtException:
+        except (IOError, NewtException):
             return False
 
         return not stat.S_ISDIR(s.st_mode)
@@ -156,6 +175,7 @@ class NewtClusterConnection(AbstractConnection):
     def mkdir(self, remote_path, ignore_failure=False):
         command = newt_mkdir_path
 
+        self._metadata().invalidate(remote_path)
         try:
             command += ' %s' % remote_path
             return self.execute(command)
@@ -166,34 +186,85 @@ class NewtClusterConnection(AbstractConnection):
     def makedirs(self, remote_path, ignore_failure=False):
         command = newt_mkdir_path
         command += ' -p %s' % remote_path
+        self._metadata().invalidate(remote_path)
 
         return self.execute(command)
 
-    def _home_dir(self):
-        home = self.execute('pwd')[0]
-
-        return home
-
-    def put(self, stream, remote_path):
+    def read_from(self, remote_path, offset, max_size=None):
+        path = pipes.quote(remote_path)
+        script = 'if [ -f %s ]; then s=$(stat -c %%s %s); o=%d; ' \
+                 'if [ $s -lt $o ]; then o=0; fi; ' % (path, path, offset)
+        if max_size is not None:
+            script += 'if [ $((s - o)) -gt %d ]; then o=$((s - %d)); fi; ' \
+                % (max_size, max_size)
+        script += 'echo $o; tail -c +$((o + 1)) %s | head -c $((s - o)); ' \
+                  'else echo missing; fi' % path
+        command = '%s -c \'%s\'' % (newt_sh_path,
+                                    script.replace('\'', '\'\\\'\''))
+        output = self.execute(command, source_profile=False)
+        if output[0] == 'missing':
+            return None
+
+        # The data follows the line containing the offset
+        return (int(output[0]), '\n'.join(output[1:]))
+
+    def home_dir(self):
+        return self._metadata().home_dir(lambda: self.execute('pwd')[0])
+
+    def put(self, stream, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False, resume=False):
 
         name = os.path.basename(remote_path)
         path = os.path.dirname(remote_path)
 
         # If not a full path then assume relative to users home
-        print path[0]
         if path[0] != '/':
             # Get the users home directory
-            path = os.path.abspath(os.path.join(self._home_dir(), path))
+            path = os.path.abspath(os.path.join(self.home_dir(), path))
 
         files = {
             'file': (name, stream)
         }
-        url = '%s/file/%s%s' % (NEWT_BASE_URL, self._machine, path)
-        r = self._session.post(url, files=files)
+        self._metadata().invalidate(os.path.join(path, name))
+        r = self._request('POST', 'file/%s%s' % (self._machine, path),
+                          files=files)
         check_status(r)
 
+    @contextmanager
+    def put_archive(self, remote_path):
+        # NEWT can't stream to a command, so spool the archive, upload it in
+        # one request and then extract it on the remote side.
+        with tempfile.TemporaryFile() as fp:
+            archive = tarfile.open(fileobj=fp, mode='w')
+            yield archive
+            archive.close()
+            fp.seek(0)
+
+            self.makedirs(remote_path)
+            archive_path = os.path.join(
+                remote_path, '.cumulus_%s.tar' % uuid.uuid4().hex)
+            self.put(fp, archive_path)
+            try:
+                self.execute('%s -x -f %s -C %s' % (newt_tar_path,
+                                                    archive_path,
+                                                    remote_path))
+            finally:
+                self.remove(archive_path)
+
+        self._metadata().invalidate(remote_path)
+
     def stat(self, remote_path):
-        output = self.execute(newt_stat_command + remote_path)[0]
+        return self._metadata().stat(remote_path,
+                                     lambda: self._stat(remote_path))
+
+    def _stat(self, remote_path):
+        try:
+            output = self.execute(newt_stat_command + remote_path)[0]
+        except NewtException as ex:
+            # Raised as by SFTP, so only a missing path is cached
+            if 'No such file or directory' in str(ex):
+                raise IOError(errno.ENOENT, str(ex), remote_path)
+            raise
         values = dict(s.split('=') for s in output.split(','))
         attributes = SFTPAttributes()
         for (key, value) in values.iteritems():
@@ -208,6 +279,7 @@ class NewtClusterConnection(AbstractConnection):
 
     def remove(self, remote_path):
         command = newt_rm_path + ' %s' % remote_path
+        self._metadata().invalidate(remote_path)
 
         return self.execute(command)
 
@@ -244,11 +316,10 @@ class NewtClusterConnection(AbstractConnection):
     def list(self, remote_path):
         if remote_path[0] != '/':
             # Get the users home directory
-            remote_path = os.path.abspath(os.path.join(self._home_dir(),
+            remote_path = os.path.abspath(os.path.join(self.home_dir(),
                                                        remote_path))
 
-        url = '%s/file/%s/%s' % (NEWT_BASE_URL, self._machine, remote_path)
-        r = self._session.get(url)
+        r = self._request('GET', 'file/%s/%s' % (self._machine, remote_path))
         check_status(r)
 
         paths = r.json()
@@ -261,6 +332,10 @@ class NewtClusterConnection(AbstractConnection):
             path['mode'] = self._perms_to_mode(perms)
             yield path
 
+    @property
+    def girder_token(self):
+        return self._girder_token
+
     @property
     def session_id(self):
         """
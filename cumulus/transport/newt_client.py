@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import cookielib
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from jsonpath_rw import parse
+
+import cumulus
+from cumulus.common import check_status
+from .cache import MetadataCache
+
+NEWT_BASE_URL = 'https://newt.nersc.gov/newt'
+DEFAULT_SESSION_TIMEOUT = 600
+DEFAULT_POOL_SIZE = 10
+
+
+class NewtClient(object):
+    """
+    A per process client for the NEWT API. The NEWT session id for a Girder
+    token is cached until it expires, and a single keep-alive HTTP session is
+    shared by all requests to a machine. The session id is passed as a cookie
+    on each request so one HTTP session can serve many users. A metadata cache
+    is also kept for each user and machine. Each task is given a new Girder
+    token, so the entries for a token are dropped once they have expired or
+    gone unused for the session timeout.
+    """
+    def __init__(self, base_url=NEWT_BASE_URL,
+                 session_timeout=DEFAULT_SESSION_TIMEOUT,
+                 pool_size=DEFAULT_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.session_timeout = session_timeout
+        self.pool_size = pool_size
+        self._lock = threading.Lock()
+        # girder token => (session id, expiry)
+        self._session_ids = {}
+        # machine => requests.Session
+        self._http_sessions = {}
+        # (girder token, machine) => (MetadataCache, time last used)
+        self._metadata = {}
+        self._next_prune = 0
+
+    def _prune(self, now):
+        """
+        Drop the expired session ids and the metadata caches that haven't been
+        used for the session timeout. Called with the lock held, the entries
+        are only looked over once per session timeout.
+        """
+        if now < self._next_prune:
+            return
+        self._next_prune = now + self.session_timeout
+
+        for (girder_token, (_, expiry)) in self._session_ids.items():
+            if now >= expiry:
+                del self._session_ids[girder_token]
+        for (key, (_, last_used)) in self._metadata.items():
+            if now - last_used >= self.session_timeout:
+                del self._metadata[key]
+
+    def session_id(self, girder_token):
+        """
+        Returns the NEWT session id associated with the Girder token, it is
+        fetched from Girder if not cached or if it has expired.
+        """
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            cached = self._session_ids.get(girder_token)
+            if cached and now < cached[1]:
+                return cached[0]
+
+        headers = {'Girder-Token':  girder_token}
+        url = '%s/newt/sessionId' % cumulus.config.girder.baseUrl
+        r = requests.get(url, headers=headers)
+        check_status(r)
+
+        session_id = parse('sessionId').find(r.json())
+
+        if not session_id:
+            raise Exception('No NEWT session ID present')
+
+        session_id = session_id[0].value
+        with self._lock:
+            self._session_ids[girder_token] \
+                = (session_id, time.time() + self.session_timeout)
+
+        return session_id
+
+    def invalidate_session_id(self, girder_token):
+        with self._lock:
+            self._session_ids.pop(girder_token, None)
+
+    def http_session(self, machine):
+        """
+        Returns the keep-alive HTTP session used for requests to a machine.
+        """
+        with self._lock:
+            session = self._http_sessions.get(machine)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1,
+                                      pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                # The session is shared between users, so never store
+                # cookies set by NEWT on it.
+                session.cookies.set_policy(
+                    cookielib.DefaultCookiePolicy(allowed_domains=[]))
+                self._http_sessions[machine] = session
+
+        return session
+
+    def metadata(self, girder_token, machine):
+        """
+        Returns the metadata cache for a user on a machine.
+        """
+        with self._lock:
+            now = time.time()
+            self._prune(now)
+            key = (girder_token, machine)
+            metadata = self._metadata.get(key, (MetadataCache(), None))[0]
+            self._metadata[key] = (metadata, now)
+
+            return metadata
+
+    def url(self, path):
+        return '%s/%s' % (self.base_url, path.lstrip('/'))
+
+    def request(self, girder_token, machine, method, path, **kwargs):
+        """
+        Issue a request to the NEWT API on behalf of the user the Girder token
+        belongs to, path is relative to the NEWT base url. If NEWT rejects the
+        session id it is dropped from the cache so the next request will fetch
+        a new one.
+        """
+        cookies = {
+            'newt_sessionid': self.session_id(girder_token)
+        }
+        r = self.http_session(machine).request(method, self.url(path),
+                                               cookies=cookies, **kwargs)
+
+        if r.status_code in [401, 403]:
+            self.invalidate_session_id(girder_token)
+
+        return r
+
+    def clear(self):
+        """
+        Drop all cached session ids and metadata, and close the HTTP sessions.
+        """
+        with self._lock:
+            self._session_ids.clear()
+            self._metadata.clear()
+            for session in self._http_sessions.values():
+                session.close()
+            self._http_sessions.clear()
+
+
+_newt_client = None
+
+
+def get_newt_client():
+    """
+    Returns the worker wide NEWT client, configured using the newt section of
+    the cumulus configuration.
+    """
+    global _newt_client
+
+    if _newt_client is None:
+        newt_config = cumulus.config.get('newt', {})
+        _newt_client = NewtClient(
+            base_url=newt_config.get('baseUrl', NEWT_BASE_URL),
+            session_timeout=newt_config.get('sessionTimeout',
+                                            DEFAULT_SESSION_TIMEOUT),
+            pool_size=newt_config.get('poolSize', DEFAULT_POOL_SIZE))
+
+    return _newt_client
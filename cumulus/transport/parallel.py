@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import hashlib
+import Queue
+import threading
+
+import cumulus
+
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+DEFAULT_CONCURRENCY = 4
+
+
+class TransferVerificationException(Exception):
+    pass
+
+
+def transfer_options(part_size=None, concurrency=None):
+    """
+    Fill in any options not provided using the ssh.parallelTransfer section of
+    the cumulus configuration.
+    """
+    config = cumulus.config.get('ssh', {}).get('parallelTransfer', {})
+    if part_size is None:
+        part_size = config.get('partSize', DEFAULT_PART_SIZE)
+    if concurrency is None:
+        concurrency = config.get('concurrency', DEFAULT_CONCURRENCY)
+
+    return (part_size, concurrency)
+
+
+class PartWorkers(object):
+    """
+    A set of threads each with its own SFTP session and handle on a remote
+    file. Parts submitted are passed to handler(file, part) by one of the
+    threads, so the parts are transferred over several channels at once. The
+    first error raised by a handler is raised by submit() or join().
+    """
+    def __init__(self, open_sftp, remote_path, mode, concurrency, handler):
+        self._open_sftp = open_sftp
+        self._remote_path = remote_path
+        self._mode = mode
+        self._handler = handler
+        self._errors = []
+        # Bound the queue so we don't read the whole source into memory
+        self._queue = Queue.Queue(maxsize=concurrency * 2)
+        self._threads = []
+        for _ in range(concurrency):
+            thread = threading.Thread(target=self._run)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        sftp = None
+        file = None
+        try:
+            sftp = self._open_sftp()
+            file = sftp.open(self._remote_path, self._mode)
+            file.set_pipelined(True)
+        except Exception as ex:
+            self._errors.append(ex)
+
+        # Keep consuming parts after an error so submit() never blocks
+        while True:
+            part = self._queue.get()
+            if part is None:
+                break
+            if self._errors:
+                continue
+            try:
+                self._handler(file, part)
+            except Exception as ex:
+                self._errors.append(ex)
+
+        for resource in [file, sftp]:
+            try:
+                if resource is not None:
+                    resource.close()
+            except Exception as ex:
+                # Pipelined write errors are reported on close
+                if resource is file:
+                    self._errors.append(ex)
+
+    def submit(self, part):
+        if self._errors:
+            self.join()
+        self._queue.put(part)
+
+    def join(self):
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+        if self._errors:
+            raise self._errors[0]
+
+
+def put(open_sftp, stream, remote_path, part_size, concurrency, offset=0,
+        md5=None):
+    """
+    Write stream to remote_path in parts of part_size, using concurrency SFTP
+    sessions. The stream is read sequentially so it doesn't need to be
+    seekable. If offset is given the stream is written from that offset,
+    keeping the existing prefix of the remote file, md5 should then be a MD5
+    of the prefix. Returns the MD5 hex digest of the whole file.
+    """
+    if md5 is None:
+        md5 = hashlib.md5()
+
+    def _write(file, part):
+        (offset, data) = part
+        file.seek(offset)
+        file.write(data)
+
+    # Create ( or truncate ) the file, the workers open it for update
+    sftp = open_sftp()
+    try:
+        if offset:
+            sftp.truncate(remote_path, offset)
+        else:
+            sftp.open(remote_path, 'w').close()
+    finally:
+        sftp.close()
+
+    workers = PartWorkers(open_sftp, remote_path, 'r+', concurrency, _write)
+    try:
+        while True:
+            data = stream.read(part_size)
+            if not data:
+                break
+            md5.update(data)
+            workers.submit((offset, data))
+            offset += len(data)
+    finally:
+        workers.join()
+
+    return md5.hexdigest()
+
+
+def get(open_sftp, remote_path, size, local_file, part_size, concurrency):
+    """
+    Read remote_path into local_file in parts of part_size, using concurrency
+    SFTP sessions. Returns the MD5 hex digest of the data read.
+    """
+    lock = threading.Lock()
+
+    def _read(file, part):
+        (offset, length) = part
+        data = ''.join(file.readv([(offset, length)]))
+        if len(data) != length:
+            raise IOError('Short read from %s at offset %d'
+                          % (remote_path, offset))
+        with lock:
+            local_file.seek(offset)
+            local_file.write(data)
+
+    workers = PartWorkers(open_sftp, remote_path, 'r', concurrency, _read)
+    try:
+        for offset in range(0, size, part_size):
+            workers.submit((offset, min(part_size, size - offset)))
+    finally:
+        workers.join()
+
+    md5 = hashlib.md5()
+    local_file.seek(0)
+    for data in iter(lambda: local_file.read(part_size), ''):
+        md5.update(data)
+    local_file.seek(0)
+
+    return md5.hexdigest()
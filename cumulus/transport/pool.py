@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import collections
+import threading
+import time
+
+import cumulus
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 300
+DEFAULT_WAIT_TIMEOUT = 60
+
+
+class PoolExhaustedException(Exception):
+    pass
+
+
+class PooledConnection(object):
+    """
+    Wraps a client connection held by the pool, recording the key and host it
+    was created for and when it was last returned. Any SFTP session opened on
+    the connection, and its metadata cache, are kept with it so they can be
+    reused.
+    """
+    def __init__(self, key, host, client):
+        self.key = key
+        self.host = host
+        self.client = client
+        self.sftp = None
+        self.metadata = None
+        self.last_used = time.time()
+
+    def is_alive(self):
+        try:
+            return bool(self.client.is_active())
+        except Exception:
+            return False
+
+    def close(self):
+        for resource in [self.sftp, self.client]:
+            try:
+                if resource is not None:
+                    resource.close()
+            except Exception:
+                pass
+
+
+class ConnectionPool(object):
+    """
+    A per process pool of client connections. Connections are keyed so that a
+    connection is only ever reused for the cluster ( host, user, key ) it was
+    created for. The total number of connections open to a single host is
+    capped, a caller will block waiting for a connection to be released once
+    the cap has been reached.
+    """
+    def __init__(self,
+                 max_connections_per_host=DEFAULT_MAX_CONNECTIONS_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT,
+                 wait_timeout=DEFAULT_WAIT_TIMEOUT):
+        self.max_connections_per_host = max_connections_per_host
+        self.idle_timeout = idle_timeout
+        self.wait_timeout = wait_timeout
+        self._condition = threading.Condition()
+        # key => list of idle connections, most recently used last
+        self._idle = collections.defaultdict(list)
+        # host => number of open connections ( idle or in use )
+        self._host_counts = collections.defaultdict(int)
+
+    def _discard(self, connection):
+        connection.close()
+        self._host_counts[connection.host] -= 1
+        if self._host_counts[connection.host] <= 0:
+            del self._host_counts[connection.host]
+        self._condition.notify()
+
+    def _evict_idle(self):
+        now = time.time()
+        for (key, connections) in list(self._idle.items()):
+            active = []
+            for connection in connections:
+                if now - connection.last_used > self.idle_timeout:
+                    self._discard(connection)
+                else:
+                    active.append(connection)
+
+            if active:
+                self._idle[key] = active
+            else:
+                del self._idle[key]
+
+    def _checkout(self, key):
+        idle = self._idle.get(key, [])
+        while idle:
+            connection = idle.pop()
+            if connection.is_alive():
+                return connection
+            self._discard(connection)
+
+        return None
+
+    def _close_idle_for_host(self, host):
+        """
+        Close the least recently used idle connection to a host, returns True
+        if a connection was closed.
+        """
+        candidates = [c for idle in self._idle.values() for c in idle
+                      if c.host == host]
+        if not candidates:
+            return False
+
+        lru = min(candidates, key=lambda c: c.last_used)
+        self._idle[lru.key].remove(lru)
+        self._discard(lru)
+
+        return True
+
+    def acquire(self, key, host, connect):
+        """
+        Returns a live connection for the given key, connect will be called to
+        create a new client if no idle connection is available.
+        """
+        deadline = time.time() + self.wait_timeout
+        with self._condition:
+            while True:
+                self._evict_idle()
+                connection = self._checkout(key)
+                if connection:
+                    return connection
+
+                if self._host_counts[host] < self.max_connections_per_host:
+                    self._host_counts[host] += 1
+                    break
+
+                # Connections to the same host for other keys may be idle
+                if self._close_idle_for_host(host):
+                    continue
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolExhaustedException(
+                        'Timed out waiting for a connection to %s' % host)
+                self._condition.wait(remaining)
+
+        try:
+            client = connect()
+        except Exception:
+            with self._condition:
+                self._host_counts[host] -= 1
+                self._condition.notify()
+            raise
+
+        return PooledConnection(key, host, client)
+
+    def release(self, connection, discard=False):
+        """
+        Return a connection to the pool, if discard is True ( or the connection
+        is no longer alive ) the connection is closed.
+        """
+        with self._condition:
+            if discard or not connection.is_alive():
+                self._discard(connection)
+            else:
+                connection.last_used = time.time()
+                self._idle[connection.key].append(connection)
+                self._condition.notify()
+
+            self._evict_idle()
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+        with self._condition:
+            for idle in self._idle.values():
+                for connection in idle:
+                    self._discard(connection)
+            self._idle.clear()
+
+
+_ssh_pool = None
+
+
+def get_ssh_pool():
+    """
+    Returns the worker wide SSH connection pool, configured using the
+    ssh.pool section of the cumulus configuration.
+    """
+    global _ssh_pool
+
+    if _ssh_pool is None:
+        pool_config = cumulus.config.get('ssh', {}).get('pool', {})
+        _ssh_pool = ConnectionPool(
+            max_connections_per_host=pool_config.get(
+                'maxConnectionsPerHost', DEFAULT_MAX_CONNECTIONS_PER_HOST),
+            idle_timeout=pool_config.get('idleTimeout', DEFAULT_IDLE_TIMEOUT),
+            wait_timeout=pool_config.get('waitTimeout', DEFAULT_WAIT_TIMEOUT))
+
+    return _ssh_pool
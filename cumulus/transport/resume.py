@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import hashlib
+import pipes
+
+import cumulus
+
+DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DEFAULT_THRESHOLD = 16 * 1024 * 1024
+
+
+def block_size():
+    return cumulus.config.get('transport', {}).get('resumeBlockSize',
+                                                   DEFAULT_BLOCK_SIZE)
+
+
+def threshold():
+    """
+    Files smaller than this are transferred from the start rather than
+    resumed.
+    """
+    return cumulus.config.get('transport', {}).get('resumeThreshold',
+                                                   DEFAULT_THRESHOLD)
+
+
+def remote_block_checksums(conn, remote_path, size, block_size):
+    """
+    Returns the MD5 hex digests of each complete block in the first size bytes
+    of a remote file, computed on the cluster in a single command.
+    """
+    count = size / block_size
+    if count == 0:
+        return []
+
+    command = 'i=0; while [ $i -lt %d ]; do ' \
+              'dd if=%s bs=%d skip=$i count=1 2>/dev/null | md5sum; ' \
+              'i=$((i+1)); done' % (count, pipes.quote(remote_path),
+                                    block_size)
+    (output, exit_status) = conn.execute_many([command])[0]
+    if exit_status != 0:
+        raise Exception('Unable to checksum %s' % remote_path)
+
+    return [line.split()[0] for line in output if line.strip()]
+
+
+def read_block(stream, size):
+    """
+    Read size bytes from stream, only returning less at the end of the stream.
+    """
+    data = []
+    remaining = size
+    while remaining > 0:
+        chunk = stream.read(remaining)
+        if not chunk:
+            break
+        data.append(chunk)
+        remaining -= len(chunk)
+
+    return ''.join(data)
+
+
+def matching_prefix(stream, remote_checksums, block_size):
+    """
+    Read blocks from stream while they match the remote checksums. Returns a
+    tuple of the length of the matching prefix, an MD5 of the prefix and any
+    data read beyond the prefix.
+    """
+    md5 = hashlib.md5()
+    offset = 0
+    for remote_checksum in remote_checksums:
+        data = read_block(stream, block_size)
+        if hashlib.md5(data).hexdigest() != remote_checksum:
+            return (offset, md5, data)
+        md5.update(data)
+        offset += len(data)
+
+    return (offset, md5, '')
+
+
+class PrefixedStream(object):
+    """
+    A read only stream returning prefix followed by the contents of stream.
+    """
+    def __init__(self, prefix, stream):
+        self._prefix = prefix
+        self._stream = stream
+
+    def read(self, size=-1):
+        if not self._prefix:
+            return self._stream.read(size)
+
+        if size < 0:
+            data = self._prefix + self._stream.read()
+            self._prefix = ''
+        else:
+            data = self._prefix[:size]
+            self._prefix = self._prefix[size:]
+
+        return data
@@ -19,130 +19,469 @@
 
 import os
 from contextlib import contextmanager
+import pipes
+import shutil
+import socket
 import stat
-import sys
+import tarfile
+import tempfile
+import threading
+import time
 
 from starcluster.sshutils import SSHClient
 import starcluster.config
+import starcluster.exception
 from jsonpath_rw import parse
+import paramiko
 
 from .abstract import AbstractConnection
+from .pool import get_ssh_pool
+from .cache import MetadataCache
+from . import parallel as parallel_transfer
+from . import resume as resume_transfer
 from cumulus.constants import ClusterType
 import cumulus
 from cumulus.common import create_config_request
 
+# Errors that indicate the underlying connection is no longer usable, so it
+# should not be returned to the pool.
+connection_errors = (EOFError, socket.error, paramiko.SSHException,
+                     starcluster.exception.SSHConnectionError)
+
+DEFAULT_MASTER_CACHE_TIMEOUT = 600
+
+# How much of the output of a remote command streamed to is kept for the
+# error message
+DRAIN_TAIL_SIZE = 64 * 1024
+
+
+class MasterNodeCache(object):
+    """
+    Caches the address, user and private key of the master node of EC2
+    clusters, so we can connect without fetching the StarCluster configuration
+    and querying EC2. An entry expires after a timeout and is only valid while
+    the cluster has the status it had when the entry was added.
+    """
+    def __init__(self, timeout=DEFAULT_MASTER_CACHE_TIMEOUT):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, cluster_id, status):
+        with self._lock:
+            entry = self._entries.get(cluster_id)
+            if entry is None:
+                return None
+
+            if entry['status'] != status or time.time() > entry['expires']:
+                del self._entries[cluster_id]
+                return None
+
+            return entry['master']
+
+    def put(self, cluster_id, status, master):
+        with self._lock:
+            self._entries[cluster_id] = {
+                'status': status,
+                'master': master,
+                'expires': time.time() + self.timeout
+            }
+
+    def invalidate(self, cluster_id):
+        with self._lock:
+            self._entries.pop(cluster_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_master_cache = None
+
+
+def get_master_cache():
+    """
+    Returns the worker wide EC2 master node cache, the timeout is configured
+    using ssh.masterCacheTimeout.
+    """
+    global _master_cache
+
+    if _master_cache is None:
+        timeout = cumulus.config.get('ssh', {}).get(
+            'masterCacheTimeout', DEFAULT_MASTER_CACHE_TIMEOUT)
+        _master_cache = MasterNodeCache(timeout=timeout)
+
+    return _master_cache
+
 
 class SshClusterConnection(AbstractConnection):
     def __init__(self, girder_token, cluster):
         self._girder_token = girder_token
         self._cluster = cluster
+        self._connection = None
 
-    def __enter__(self):
+    def _pool_key(self):
+        if self._cluster['type'] == ClusterType.TRADITIONAL:
+            username = parse('config.ssh.user').find(self._cluster)[0].value
+            hostname = parse('config.host').find(self._cluster)[0].value
+
+            return (self._cluster['_id'], hostname, username,
+                    self._key_path()), hostname
+        else:
+            # The master node is only known once the cluster has been
+            # looked up, each EC2 cluster has its own master so the cluster id
+            # is used in place of the host.
+            return (self._cluster['_id'],), self._cluster['_id']
+
+    def _key_path(self):
+        return os.path.join(cumulus.config.ssh.keyStore, self._cluster['_id'])
+
+    def _connect(self):
         if self._cluster['type'] == ClusterType.TRADITIONAL:
             username = parse('config.ssh.user').find(self._cluster)[0].value
             hostname = parse('config.host').find(self._cluster)[0].value
             passphrase \
                 = parse('config.ssh.passphrase').find(self._cluster)[0].value
 
-            key_path = os.path.join(cumulus.config.ssh.keyStore,
-                                    self._cluster['_id'])
-
-            self._conn = SSHClient(host=hostname, username=username,
-                                   private_key=key_path,
-                                   private_key_pass=passphrase, timeout=5)
-            self._conn.connect()
+            conn = SSHClient(host=hostname, username=username,
+                             private_key=self._key_path(),
+                             private_key_pass=passphrase, timeout=5)
+            conn.connect()
         else:
-            cluster_id = self._cluster['_id']
-            config_id = self._cluster['config']['_id']
-            config_request = create_config_request(
-                self._girder_token, cumulus.config.girder.baseUrl, config_id)
-            config = starcluster.config.StarClusterConfig(config_request)
-
-            config.load()
-            cm = config.get_cluster_manager()
-            sc = cm.get_cluster(cluster_id)
-            master = sc.master_node
-            master.user = sc.cluster_user
-            self._conn = master.ssh
+            conn = self._connect_master()
+
+        return conn
+
+    def _connect_master(self):
+        cluster_id = self._cluster['_id']
+        status = self._cluster.get('status')
+        cache = get_master_cache()
+
+        master = cache.get(cluster_id, status)
+        if master:
+            try:
+                conn = SSHClient(host=master['host'], username=master['user'],
+                                 private_key=master['key_path'], timeout=5)
+                conn.connect()
+
+                return conn
+            except connection_errors:
+                # The master may have moved, fall back to looking it up
+                cache.invalidate(cluster_id)
+
+        config_id = self._cluster['config']['_id']
+        config_request = create_config_request(
+            self._girder_token, cumulus.config.girder.baseUrl, config_id)
+        config = starcluster.config.StarClusterConfig(config_request)
+
+        config.load()
+        cm = config.get_cluster_manager()
+        sc = cm.get_cluster(cluster_id)
+        master = sc.master_node
+        master.user = sc.cluster_user
+        conn = master.ssh
+
+        cache.put(cluster_id, status, {
+            'host': master.addr,
+            'user': master.user,
+            'key_path': master.key_location
+        })
+
+        return conn
+
+    def __enter__(self):
+        (key, host) = self._pool_key()
+        self._connection = get_ssh_pool().acquire(key, host, self._connect)
+        self._conn = self._connection.client
 
         return self
 
     def __exit__(self, type, value, traceback):
-        self._conn.close()
+        discard = type is not None and issubclass(type, connection_errors)
+        if discard and self._cluster['type'] != ClusterType.TRADITIONAL:
+            get_master_cache().invalidate(self._cluster['_id'])
+        get_ssh_pool().release(self._connection, discard=discard)
+        self._connection = None
 
     def execute(self, command, ignore_exit_status=False, source_profile=True):
         return self._conn.execute(command,
                                   ignore_exit_status=ignore_exit_status,
                                   source_profile=source_profile)
 
+    def execute_many(self, commands, source_profile=True):
+        (delimiter, script) = self._batch_script(commands)
+        output = self.execute(script, ignore_exit_status=True,
+                              source_profile=source_profile)
+
+        return self._parse_batch_output(output, delimiter, commands)
+
+    def _sftp(self):
+        """
+        Returns the SFTP session associated with the pooled connection, a
+        session is opened on first use and reopened if its channel has closed.
+        """
+        sftp = self._connection.sftp
+        if sftp is None or sftp.sock.closed:
+            self._close_sftp()
+            sftp = self._conn.transport.open_sftp_client()
+            self._connection.sftp = sftp
+
+        return sftp
+
+    def _metadata(self):
+        """
+        Returns the metadata cache associated with the pooled connection.
+        """
+        if self._connection.metadata is None:
+            self._connection.metadata = MetadataCache()
+
+        return self._connection.metadata
+
+    def _close_sftp(self):
+        if self._connection.sftp is not None:
+            try:
+                self._connection.sftp.close()
+            except Exception:
+                pass
+            self._connection.sftp = None
+
+    def _sftp_call(self, func):
+        """
+        Call func with the SFTP session, if the channel has died underneath us
+        reopen the session and try again. Only use this for operations that
+        are safe to repeat.
+        """
+        try:
+            return func(self._sftp())
+        except (EOFError, socket.error, paramiko.SSHException):
+            self._close_sftp()
+            return func(self._sftp())
+
+    def _open_sftp(self):
+        return self._conn.transport.open_sftp_client()
+
+    def _remote_md5(self, remote_path):
+        output = self.execute('md5sum %s' % pipes.quote(remote_path),
+                              source_profile=False)
+
+        return output[0].split()[0]
+
+    def _verify(self, remote_path, md5):
+        remote_md5 = self._remote_md5(remote_path)
+        if remote_md5 != md5:
+            raise parallel_transfer.TransferVerificationException(
+                'Checksum mismatch for %s, expected %s got %s'
+                % (remote_path, md5, remote_md5))
+
+    @contextmanager
+    def get(self, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False):
+        if parallel:
+            (part_size, concurrency) \
+                = parallel_transfer.transfer_options(part_size, concurrency)
+            size = self._sftp_call(lambda sftp: sftp.stat(remote_path)).st_size
+            with tempfile.TemporaryFile() as file:
+                md5 = parallel_transfer.get(self._open_sftp, remote_path, size,
+                                            file, part_size, concurrency)
+                if verify:
+                    self._verify(remote_path, md5)
+                yield file
+        else:
+            file = None
+            try:
+                file = self._sftp().open(remote_path)
+                yield file
+            finally:
+                if file:
+                    file.close()
+
     @contextmanager
-    def get(self, remote_path):
-        sftp = None
+    def _get_from(self, remote_path, offset):
         file = None
         try:
-            sftp = self._conn.transport.open_sftp_client()
-            file = sftp.open(remote_path)
+            file = self._sftp().open(remote_path)
+            file.seek(offset)
+            file.prefetch()
             yield file
         finally:
             if file:
                 file.close()
-                sftp.close()
+
+    def read_from(self, remote_path, offset, max_size=None):
+        try:
+            file = self._sftp().open(remote_path)
+        except IOError:
+            return None
+
+        try:
+            size = file.stat().st_size
+            if size < offset:
+                offset = 0
+            if max_size is not None and size - offset > max_size:
+                offset = size - max_size
+            file.seek(offset)
+            data = file.read(size - offset)
+        finally:
+            file.close()
+
+        return (offset, data)
+
+    def home_dir(self):
+        return self._metadata().home_dir(
+            lambda: self._sftp_call(lambda sftp: sftp.normalize('.')))
 
     def isfile(self, remote_path):
+        try:
+            s = self.stat(remote_path)
+        except IOError:
+            return False
+
+        return not stat.S_ISDIR(s.st_mode)
 
-        with self._conn.transport.open_sftp_client() as sftp:
+    def mkdir(self, remote_path, ignore_failure=False):
+        self._metadata().invalidate(remote_path)
+        try:
+            self._sftp().mkdir(remote_path)
+        except IOError:
+            if not ignore_failure:
+                raise
+
+    def makedirs(self, remote_path):
+        current_path = ''
+        if remote_path[0] == '/':
+            current_path = '/'
+
+        for path in remote_path.split("/"):
+            if not path:
+                continue
+            current_path = os.path.join(current_path, path)
             try:
-                s = sftp.stat(remote_path)
+                self.stat(current_path)
             except IOError:
-                return False
+                self._metadata().invalidate(current_path)
+                self._sftp().mkdir(current_path)
 
-            return stat.S_ISDIR(s.st_mode)
+    def _resume_put(self, stream, remote_path):
+        """
+        Compare stream with the partial remote file, returns a tuple of the
+        offset to continue writing from, a MD5 of the prefix and a stream of
+        the data to write from that offset.
+        """
+        try:
+            size = self.stat(remote_path).st_size
+        except IOError:
+            return (0, None, stream)
 
-    def mkdir(self, remote_path, ignore_failure=False):
-        with self._conn.transport.open_sftp_client() as sftp:
+        block_size = resume_transfer.block_size()
+        checksums = resume_transfer.remote_block_checksums(
+            self, remote_path, size, block_size)
+        (offset, md5, data) = resume_transfer.matching_prefix(
+            stream, checksums, block_size)
+
+        return (offset, md5, resume_transfer.PrefixedStream(data, stream))
+
+    def put(self, stream, remote_path, parallel=False, part_size=None,
+            concurrency=None, verify=False, resume=False):
+        self._metadata().invalidate(remote_path)
+        offset = 0
+        md5 = None
+        if resume:
+            (offset, md5, stream) = self._resume_put(stream, remote_path)
+            self._metadata().invalidate(remote_path)
+
+        if parallel:
+            (part_size, concurrency) \
+                = parallel_transfer.transfer_options(part_size, concurrency)
+            md5 = parallel_transfer.put(self._open_sftp, stream, remote_path,
+                                        part_size, concurrency, offset=offset,
+                                        md5=md5)
+            if verify:
+                self._verify(remote_path, md5)
+        elif offset:
+            file = self._sftp().open(remote_path, 'r+')
             try:
-                sftp.mkdir(remote_path)
-            except IOError:
-                if not ignore_failure:
-                    raise
+                file.truncate(offset)
+                file.seek(offset)
+                file.set_pipelined(True)
+                shutil.copyfileobj(stream, file, 32768)
+            finally:
+                file.close()
+        else:
+            self._sftp().putfo(stream, remote_path)
 
-    def makedirs(self, remote_path):
-        with self._conn.transport.open_sftp_client() as sftp:
-            current_path = ''
-            if remote_path[0] == '/':
-                current_path = '/'
-
-            for path in remote_path.split("/"):
-                print sys.stderr, "path: %s" % path
-                if not path:
-                    continue
-                current_path = os.path.join(current_path, path)
-                try:
-                    sftp.listdir(current_path)
-                except IOError:
-                    sftp.mkdir(current_path)
-
-    def put(self, stream, remote_path):
-        with self._conn.transport.open_sftp_client() as sftp:
-            sftp.putfo(stream, remote_path)
+    def _drain(self, channel):
+        """
+        Read the output of a command in a thread, so the channel window can't
+        fill up while we write to it. Returns the thread, the tail of the
+        output is left in its output attribute.
+        """
+        def _read():
+            chunks = []
+            size = 0
+            while True:
+                data = channel.recv(32768)
+                if not data:
+                    break
+                chunks.append(data)
+                size += len(data)
+                while size - len(chunks[0]) >= DRAIN_TAIL_SIZE:
+                    size -= len(chunks.pop(0))
+            thread.output = ''.join(chunks)[-DRAIN_TAIL_SIZE:]
+
+        thread = threading.Thread(target=_read, name='drain')
+        thread.daemon = True
+        thread.output = ''
+        thread.start()
+
+        return thread
+
+    @contextmanager
+    def put_archive(self, remote_path):
+        command = 'mkdir -p %s && tar -x -f - -C %s' \
+            % (pipes.quote(remote_path), pipes.quote(remote_path))
+        self._metadata().invalidate(remote_path)
+
+        channel = self._conn.transport.open_session()
+        try:
+            channel.set_combine_stderr(True)
+            channel.exec_command(command)
+            drain = self._drain(channel)
+            stdin = channel.makefile('wb')
+            # Stream the archive straight down the exec channel
+            archive = tarfile.open(fileobj=stdin, mode='w|')
+            yield archive
+            archive.close()
+            stdin.close()
+            channel.shutdown_write()
+
+            exit_status = channel.recv_exit_status()
+            drain.join()
+            if exit_status != 0:
+                output = drain.output
+                msg = 'remote command \'%s\' failed with status %d:\n%s' \
+                    % (command, exit_status, output)
+                raise starcluster.exception.RemoteCommandFailed(
+                    msg, command, exit_status, output)
+        finally:
+            channel.close()
 
     def stat(self, remote_path):
-        with self._conn.transport.open_sftp_client() as sftp:
-            return sftp.stat(remote_path)
+        return self._metadata().stat(
+            remote_path,
+            lambda: self._sftp_call(lambda sftp: sftp.stat(remote_path)))
 
     def remove(self, remote_path):
-        with self._conn.transport.open_sftp_client() as sftp:
-            return sftp.remove(remote_path)
+        self._metadata().invalidate(remote_path)
+        return self._sftp().remove(remote_path)
 
     def list(self, remote_path):
-        with self._conn.transport.open_sftp_client() as sftp:
-            for path in sftp.listdir_iter(remote_path):
-                yield {
-                    'name': path.filename,
-                    'user': path.st_uid,
-                    'group': path.st_gid,
-                    'mode': path.st_mode,
-                    # For now just pass mtime through
-                    'date': path.st_mtime,
-                    'size': path.st_size
-                }
+        for path in self._sftp().listdir_iter(remote_path):
+            yield {
+                'name': path.filename,
+                'user': path.st_uid,
+                'group': path.st_gid,
+                'mode': path.st_mode,
+                # For now just pass mtime through
+                'date': path.st_mtime,
+                'size': path.st_size
+            }
@@ -21,6 +21,7 @@ from tests import base
 import json
 import mock
 import re
+import time
 from easydict import EasyDict
 
 from cumulus.transport.files import get_assetstore_url_base
@@ -538,6 +539,76 @@ class ClusterTestCase(base.TestCase):
             {u'itemId': u'546a1844ff34c70456111185', u'path': u''}], u'output': [{u'itemId': u'546a1844ff34c70456111185'}], u'_id': job_id, u'log': []}, u'http://127.0.0.1/api/v1/jobs/%s/log' % job_id], {}]]
         self.assertCalls(submit.call_args_list, expected_submit_call)
 
+    @mock.patch('cumulus.starcluster.tasks.cluster.refresh_queue_occupancy.delay')
+    def test_queue(self, refresh_queue_occupancy):
+        body = {
+            'config': [
+                {
+                    '_id': self._config_id
+                }
+            ],
+            'name': 'test',
+            'template': 'default_cluster'
+        }
+
+        json_body = json.dumps(body)
+
+        r = self.request('/clusters', method='POST',
+                         type='application/json', body=json_body, user=self._user)
+        self.assertStatus(r, 201)
+        cluster_id = r.json['_id']
+
+        r = self.request('/clusters/%s/queue' % str(cluster_id), method='GET',
+                         user=self._user)
+        self.assertStatus(r, 400)
+
+        # Move cluster into running state
+        status_body = {
+            'status': 'running'
+        }
+
+        r = self.request(
+            '/clusters/%s' % str(cluster_id), method='PATCH',
+            type='application/json', body=json.dumps(status_body),
+            user=self._cumulus)
+        self.assertStatusOk(r)
+
+        # Nothing yet, so a refresh is started in the background
+        r = self.request('/clusters/%s/queue' % str(cluster_id), method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, {})
+        self.assertEqual(refresh_queue_occupancy.call_count, 1)
+        self.assertEqual(refresh_queue_occupancy.call_args[1]['log_write_url'],
+                         'http://127.0.0.1/api/v1/clusters/%s/log' % cluster_id)
+
+        # A refresh has been requested, so we don't start another
+        r = self.request('/clusters/%s/queue' % str(cluster_id), method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(refresh_queue_occupancy.call_count, 1)
+
+        # The task stores what it found on the cluster
+        occupancy = {
+            'pending': 3,
+            'running': 2,
+            'user': {'pending': 1, 'running': 1},
+            'freeSlots': 6,
+            'totalSlots': 12,
+            'updated': time.time()
+        }
+        r = self.request(
+            '/clusters/%s' % str(cluster_id), method='PATCH',
+            type='application/json', body=json.dumps({'queue': occupancy}),
+            user=self._cumulus)
+        self.assertStatusOk(r)
+
+        r = self.request('/clusters/%s/queue' % str(cluster_id), method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, occupancy)
+        self.assertEqual(refresh_queue_occupancy.call_count, 1)
+
     @mock.patch('cumulus.starcluster.tasks.cluster.terminate_cluster.delay')
     def test_terminate(self, terminate_cluster):
         body = {
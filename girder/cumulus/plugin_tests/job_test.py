@@ -19,6 +19,10 @@
 
 from tests import base
 import json
+import mock
+import time
+
+from cumulus.common.girder import get_job_callback_token
 
 
 def setUpModule():
@@ -328,6 +332,107 @@ class JobTestCase(base.TestCase):
         }
         self.assertEqual(data, expected, 'Unexpected notification data')
 
+    def test_update_output_delta(self):
+        body = {
+            'commands': [''],
+            'name': 'test',
+            'output': [{
+                'itemId': '546a1844ff34c70456111185',
+                'path': 'out.log',
+                'tail': True
+            }]
+        }
+
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+
+        # The lines are appended, the other fields replaced
+        for (lines, offset) in [(['a', 'b'], 4), (['c'], 6)]:
+            delta = {
+                'outputDelta': [{
+                    'path': 'out.log',
+                    'contentDelta': lines,
+                    'tailOffset': offset
+                }]
+            }
+            r = self.request('/jobs/%s' % job_id, method='PATCH',
+                             type='application/json', body=json.dumps(delta),
+                             user=self._cumulus)
+            self.assertStatusOk(r)
+
+        self.assertEqual(r.json['output'][0]['tailOffset'], 6)
+        self.assertEqual(r.json['output'][0]['tail'], True)
+        r = self.request('/jobs/%s/output' % job_id, method='GET',
+                         params={'path': 'out.log'}, user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, {'content': ['a', 'b', 'c']})
+
+        # The path must match an output
+        delta = {
+            'outputDelta': [{
+                'path': 'missing.log',
+                'contentDelta': ['d']
+            }]
+        }
+        r = self.request('/jobs/%s' % job_id, method='PATCH',
+                         type='application/json', body=json.dumps(delta),
+                         user=self._cumulus)
+        self.assertStatus(r, 400)
+
+    def test_leases(self):
+        body = {
+            'commands': [''],
+            'name': 'test',
+            'output': []
+        }
+
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+        lease_url = '/jobs/%s/leases/job' % job_id
+
+        def _acquire(holder, ttl=60, steal=False, url=lease_url):
+            body = {
+                'holder': holder,
+                'ttl': ttl,
+                'steal': steal
+            }
+            return self.request(url, method='PUT', type='application/json',
+                                body=json.dumps(body), user=self._cumulus)
+
+        r = _acquire('a')
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['holder'], 'a')
+
+        # Renewed by its holder, but no one else
+        self.assertStatusOk(_acquire('a'))
+        self.assertStatus(_acquire('b'), 409)
+
+        # Other kinds of lease are separate
+        self.assertStatusOk(
+            _acquire('b', url='/jobs/%s/leases/process-1' % job_id))
+        self.assertStatus(
+            _acquire('b', url='/jobs/%s/leases/bad.kind' % job_id), 400)
+
+        # Unless taken over
+        self.assertStatusOk(_acquire('b', steal=True))
+        self.assertStatus(_acquire('a'), 409)
+
+        # Only released by its holder
+        r = self.request(lease_url, method='DELETE', params={'holder': 'a'},
+                         user=self._cumulus)
+        self.assertStatusOk(r)
+        self.assertStatus(_acquire('a'), 409)
+        r = self.request(lease_url, method='DELETE', params={'holder': 'b'},
+                         user=self._cumulus)
+        self.assertStatusOk(r)
+
+        # Expired leases can be taken
+        self.assertStatusOk(_acquire('a', ttl=-1))
+        self.assertStatusOk(_acquire('b'))
 
     def test_log(self):
         body = {
@@ -421,6 +526,188 @@ class JobTestCase(base.TestCase):
         expected_status = {u'status': u'created'}
         self.assertEquals(r.json, expected_status)
 
+        # The submission is stamped by the task submitting the job
+        r = self.request('/jobs/%s' % job_id, method='PATCH',
+                         type='application/json',
+                         body=json.dumps({'submitStamp': 1000}),
+                         user=self._cumulus)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['submitStamp'], 1000)
+
+        # and a termination by Girder, so tasks can compare the two
+        self.model('job', 'cumulus').set_termination_stamp(job_id, 1001)
+        r = self.request('/jobs/%s/status' % job_id, method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, {'status': 'created',
+                                  'terminationStamp': 1001})
+
+    @mock.patch('cumulus.starcluster.tasks.job.monitor_job.delay')
+    @mock.patch('cumulus.ssh.tasks.key.generate_key_pair.delay')
+    def test_callback(self, generate_key, monitor_job):
+        body = {
+            'type': 'trad',
+            'name': 'test',
+            'config': {
+                'ssh': {
+                    'user': 'bob'
+                },
+                'host': 'test'
+            }
+        }
+        r = self.request('/clusters', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        cluster_id = r.json['_id']
+
+        body = {
+            'commands': [
+                ''
+            ],
+            'name': 'test',
+            'output': []
+        }
+
+        job_ids = []
+        for _ in range(2):
+            r = self.request('/jobs', method='POST', type='application/json',
+                             body=json.dumps(body), user=self._user)
+            self.assertStatus(r, 201)
+            job_ids.append(r.json['_id'])
+
+        job_model = self.model('job', 'cumulus')
+        job = job_model.load(job_ids[0], force=True)
+        job['clusterId'] = cluster_id
+        job_model.save(job)
+
+        r = self.request('/jobs/%s' % job_ids[0], method='PATCH',
+                         type='application/json',
+                         body=json.dumps({'status': 'queued'}),
+                         user=self._cumulus)
+        self.assertStatusOk(r)
+
+        token = get_job_callback_token({'_id': job_ids[0]})
+
+        # The token can only be used for its own job
+        r = self.request('/jobs/%s/callback' % job_ids[1], method='PUT',
+                         params={'event': 'started'}, token=token)
+        self.assertStatus(r, 403)
+
+        # Nor can a regular user make a callback
+        r = self.request('/jobs/%s/callback' % job_ids[0], method='PUT',
+                         params={'event': 'started'}, user=self._user)
+        self.assertStatus(r, 403)
+
+        r = self.request('/jobs/%s/callback' % job_ids[0], method='PUT',
+                         params={'event': 'bogus'}, token=token)
+        self.assertStatus(r, 400)
+
+        r = self.request('/jobs/%s/callback' % job_ids[0], method='PUT',
+                         params={'event': 'started'}, token=token)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, {'status': 'running'})
+
+        # The monitor is run straight away to move the job on
+        self.assertEqual(monitor_job.call_count, 1)
+        (args, kwargs) = monitor_job.call_args
+        self.assertEqual(str(args[0]['_id']), cluster_id)
+        self.assertEqual(args[1]['status'], 'running')
+        self.assertTrue(kwargs['started'])
+
+        r = self.request('/jobs/%s/status' % job_ids[0], method='GET',
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json, {'status': 'running'})
+
+    @mock.patch('cumulus.starcluster.tasks.cluster.refresh_queue_occupancy.delay')
+    @mock.patch('cumulus.starcluster.tasks.job.submit')
+    @mock.patch('cumulus.ssh.tasks.key.generate_key_pair.delay')
+    def test_submit_placement(self, generate_key, submit, refresh_queue):
+        cluster_ids = []
+        for name in ['busy', 'idle']:
+            body = {
+                'type': 'trad',
+                'name': name,
+                'config': {
+                    'ssh': {
+                        'user': 'bob'
+                    },
+                    'host': name
+                }
+            }
+            r = self.request('/clusters', method='POST',
+                             type='application/json', body=json.dumps(body),
+                             user=self._user)
+            self.assertStatus(r, 201)
+            cluster_ids.append(r.json['_id'])
+
+        body = {
+            'commands': [
+                ''
+            ],
+            'name': 'test',
+            'output': []
+        }
+        r = self.request('/jobs', method='POST', type='application/json',
+                         body=json.dumps(body), user=self._user)
+        self.assertStatus(r, 201)
+        job_id = r.json['_id']
+
+        # No cluster is running yet
+        r = self.request('/jobs/%s/submit' % job_id, method='PUT',
+                         type='application/json', body='{}', user=self._user)
+        self.assertStatus(r, 400)
+
+        occupancies = [{
+            'pending': 20,
+            'running': 10,
+            'freeSlots': 0,
+            'updated': time.time()
+        }, {
+            'pending': 0,
+            'running': 2,
+            'freeSlots': 16,
+            'updated': time.time()
+        }]
+        for (cluster_id, occupancy) in zip(cluster_ids, occupancies):
+            r = self.request('/clusters/%s' % cluster_id, method='PATCH',
+                             type='application/json',
+                             body=json.dumps({'status': 'running',
+                                              'queue': occupancy}),
+                             user=self._cumulus)
+            self.assertStatusOk(r)
+
+        body = {
+            'params': {
+                'numberOfSlots': 8
+            }
+        }
+        r = self.request('/jobs/%s/submit' % job_id, method='PUT',
+                         type='application/json', body=json.dumps(body),
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['clusterId'], cluster_ids[1])
+        self.assertEqual(r.json['expectedStart'][cluster_ids[1]], 0)
+        self.assertTrue(r.json['expectedStart'][cluster_ids[0]] > 0)
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(submit.call_args[0][1]['_id'], cluster_ids[1])
+        # The occupancy is fresh, so isn't refreshed
+        self.assertEqual(refresh_queue.call_count, 0)
+
+        r = self.request('/jobs/%s' % job_id, method='GET', user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['clusterId'], cluster_ids[1])
+
+        # Limited to the busy cluster
+        body = {
+            'clusterIds': [cluster_ids[0]]
+        }
+        r = self.request('/jobs/%s/submit' % job_id, method='PUT',
+                         type='application/json', body=json.dumps(body),
+                         user=self._user)
+        self.assertStatusOk(r)
+        self.assertEqual(r.json['clusterId'], cluster_ids[0])
+
     def test_delete(self):
         body = {
             'onComplete': {
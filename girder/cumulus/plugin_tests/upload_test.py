@@ -20,6 +20,8 @@
 import urllib2
 import cherrypy
 import mock
+import tarfile
+import StringIO
 from easydict import EasyDict
 from jsonpath_rw import parse
 import os
@@ -119,3 +121,30 @@ class UploadTestCase(base.TestCase):
         self.assertEqual(path, '/tmp/subfolder/will.txt')
         self.assertEqual(request.read().strip(), 'will')
 
+    def test_upload_archive(self):
+        cluster_connection = mock.MagicMock()
+        stream = StringIO.StringIO()
+        archive = tarfile.open(fileobj=stream, mode='w')
+        cluster_connection.put_archive.return_value.__enter__.return_value \
+            = archive
+        token = self.model('token').createToken(self._user)
+
+        # Force the bulk upload path
+        with mock.patch.dict(cumulus.config,
+                             {'transport': {'bulkUploadThreshold': 0}}):
+            upload_path(cluster_connection, str(token['_id']),
+                        self._folder['_id'], '/tmp')
+
+        archive.close()
+        cluster_connection.put_archive.assert_called_once_with('/tmp')
+        self.assertEqual(len(cluster_connection.put.call_args_list), 0)
+        self.assertEqual(len(cluster_connection.mkdir.call_args_list), 0)
+
+        stream.seek(0)
+        archive = tarfile.open(fileobj=stream, mode='r')
+        self.assertEqual(archive.getnames(), ['bill.txt', 'bob.txt',
+                                              'subfolder',
+                                              'subfolder/will.txt'])
+        self.assertTrue(archive.getmember('subfolder').isdir())
+        self.assertEqual(
+            archive.extractfile('subfolder/will.txt').read().strip(), 'will')
@@ -32,6 +32,7 @@ from cumulus.constants import ClusterType, QueueType
 from .utility.cluster_adapters import get_cluster_adapter
 from cumulus.ssh.tasks.key import generate_key_pair
 from cumulus.common import update_dict
+from cumulus.common.girder import get_job_callback_token
 
 
 class Cluster(BaseResource):
@@ -45,8 +46,10 @@ class Cluster(BaseResource):
         self.route('PUT', (':id', 'start'), self.start)
         self.route('PATCH', (':id',), self.update)
         self.route('GET', (':id', 'status'), self.status)
+        self.route('GET', (':id', 'queue'), self.queue)
         self.route('PUT', (':id', 'terminate'), self.terminate)
         self.route('PUT', (':id', 'job', ':jobId', 'submit'), self.submit_job)
+        self.route('PUT', (':id', 'jobs', 'submit'), self.submit_array_job)
         self.route('GET', (':id', ), self.get)
         self.route('DELETE', (':id', ), self.delete)
         self.route('GET', (), self.find)
@@ -360,6 +363,14 @@ class Cluster(BaseResource):
             else:
                 cluster['timings'] = body['timings']
 
+        # The capabilities discovered from the scheduler, replaced as a whole
+        if 'capabilities' in body:
+            cluster['capabilities'] = body['capabilities']
+
+        # The queue occupancy, replaced as a whole
+        if 'queue' in body:
+            cluster['queue'] = body['queue']
+
         if 'config' in body:
             # Need to check we aren't try to update immutable fields
             immutable_paths = ['_id', 'ssh.user', 'host']
@@ -383,7 +394,13 @@ class Cluster(BaseResource):
         'properties': {
             'status': {'type': 'string', 'enum': ['created', 'running',
                                                   'stopped', 'terminated'],
-                       'description': 'The new status. (optional)'}
+                       'description': 'The new status. (optional)'},
+            'capabilities': {'type': 'object',
+                             'description': 'The capabilities discovered '
+                                            'from the scheduler. (optional)'},
+            'queue': {'type': 'object',
+                      'description': 'The occupancy of the scheduler\'s '
+                                     'queue. (optional)'}
         }
     }, 'clusters')
 
@@ -424,6 +441,61 @@ class Cluster(BaseResource):
                'The cluster id to get the status of.', paramType='path')
         .responseClass('ClusterStatus'))
 
+    @access.user
+    def queue(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.READ)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if cluster['status'] != 'running':
+            raise RestException('Cluster is not running', code=400)
+
+        # Never wait on the cluster, return what we have and refresh it in the
+        # background if it is stale.
+        self._model.refresh_queue(user, cluster)
+
+        occupancy = dict(cluster.get('queue', {}))
+        occupancy.pop('refreshRequested', None)
+
+        return occupancy
+
+    addModel('QueueJobCounts', {
+        'id': 'QueueJobCounts',
+        'properties': {
+            'pending': {'type': 'integer'},
+            'running': {'type': 'integer'}
+        }
+    }, 'clusters')
+
+    addModel('QueueOccupancy', {
+        'id': 'QueueOccupancy',
+        'properties': {
+            'pending': {'type': 'integer',
+                        'description': 'The number of pending jobs.'},
+            'running': {'type': 'integer',
+                        'description': 'The number of running jobs.'},
+            'user': {'$ref': 'QueueJobCounts',
+                     'description': 'The jobs of the cluster user.'},
+            'freeSlots': {'type': 'integer'},
+            'totalSlots': {'type': 'integer'},
+            'freeNodes': {'type': 'integer'},
+            'totalNodes': {'type': 'integer'},
+            'updated': {'type': 'number',
+                        'description': 'When the occupancy was queried, in '
+                                       'seconds since the epoch.'}
+        }
+    }, 'clusters')
+
+    queue.description = (
+        Description('Get how busy the cluster\'s queue is')
+        .param('id',
+               'The cluster id.', paramType='path')
+        .notes('This is refreshed in the background, so it is empty until '
+               'the first refresh completes.')
+        .responseClass('QueueOccupancy'))
+
     @access.user
     def terminate(self, id, params):
         user = self.getCurrentUser()
@@ -496,6 +568,9 @@ class Cluster(BaseResource):
 
         job_model.save(job)
 
+        # So the job can report its state, this isn't stored on the job
+        job['callbackToken'] = get_job_callback_token(job)['_id']
+
         cluster_adapter = get_cluster_adapter(cluster)
         cluster_adapter.submit_job(job)
 
@@ -514,6 +589,72 @@ class Cluster(BaseResource):
             'The properties to template on submit.', dataType='object',
             paramType='body'))
 
+    @access.user
+    def submit_array_job(self, id, params):
+        user = self.getCurrentUser()
+        cluster = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not cluster:
+            raise RestException('Cluster not found.', code=404)
+
+        if cluster['status'] != 'running':
+            raise RestException('Cluster is not running', code=400)
+
+        cluster = self._model.filter(cluster, user, passphrase=False)
+
+        body = getBodyJson()
+        if not body.get('jobIds'):
+            raise RestException('jobIds must be provided.', code=400)
+
+        job_model = self.model('job', 'cumulus')
+        jobs = []
+        for job_id in body['jobIds']:
+            job = job_model.load(job_id, user=user, level=AccessType.ADMIN)
+            if not job:
+                raise RestException('Job not found: %s' % job_id, code=404)
+
+            # Set the clusterId on the job for termination
+            job['clusterId'] = id
+
+            # Add any job parameters to be used when templating job script
+            if 'params' in body:
+                job['params'] = body['params']
+
+            job = job_model.save(job)
+            job['callbackToken'] = get_job_callback_token(job)['_id']
+            jobs.append(job)
+
+        cluster_adapter = get_cluster_adapter(cluster)
+        cluster_adapter.submit_array_job(jobs)
+
+    addModel('ArraySubmitParameters', {
+        'id': 'ArraySubmitParameters',
+        'required': ['jobIds'],
+        'properties': {
+            'jobIds': {
+                'type': 'array',
+                'items': {'type': 'string'},
+                'description': 'The jobs to submit, one per task.'
+            },
+            'params': {
+                'type': 'object',
+                'description': 'The properties to template on submit.'
+            }
+        }
+    }, 'clusters')
+
+    submit_array_job.description = (
+        Description('Submit a set of jobs to the cluster as a single array '
+                    'job')
+        .param(
+            'id',
+            'The cluster to submit the jobs to.', required=True,
+            paramType='path')
+        .param(
+            'body',
+            'The jobs to submit.', dataType='ArraySubmitParameters',
+            paramType='body'))
+
     @access.user
     def get(self, id, params):
         user = self.getCurrentUser()
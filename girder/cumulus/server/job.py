@@ -18,15 +18,28 @@
 ###############################################################################
 
 import cherrypy
+import json
+import re
+import time
 
 from girder.api import access
 from girder.api.describe import Description
 from girder.constants import AccessType
 from girder.api.docs import addModel
-from girder.api.rest import RestException, getBodyJson, getApiUrl
+from girder.api.rest import RestException, getBodyJson, getApiUrl, \
+    getCurrentToken
 from .base import BaseResource
 
 from cumulus.starcluster import tasks
+from cumulus.celery import command
+from cumulus.celery.control import broadcast_terminating
+from cumulus.common.girder import JOB_CALLBACK_SCOPE, get_job_callback_token
+from cumulus.common.lease import DEFAULT_LEASE_TIMEOUT
+from .utility.cluster_adapters import get_cluster_adapter
+from .utility.placement import JobPlacement, candidate_clusters
+import cumulus
+
+DEFAULT_OUTPUT_TAIL_SIZE = 64 * 1024
 
 
 class Job(BaseResource):
@@ -37,6 +50,10 @@ class Job(BaseResource):
         self.route('PATCH', (':id',), self.update)
         self.route('GET', (':id', 'status'), self.status)
         self.route('PUT', (':id', 'terminate'), self.terminate)
+        self.route('PUT', (':id', 'submit'), self.submit)
+        self.route('PUT', (':id', 'callback'), self.callback)
+        self.route('PUT', (':id', 'leases', ':kind'), self.acquire_lease)
+        self.route('DELETE', (':id', 'leases', ':kind'), self.release_lease)
         self.route('POST', (':id', 'log'), self.add_log_record)
         self.route('GET', (':id', 'log'), self.log)
         self.route('GET', (':id', 'output'), self.output)
@@ -52,6 +69,65 @@ class Job(BaseResource):
 
         return job
 
+    def _append_content(self, output, delta):
+        """
+        Append lines to the content of an output. The content is capped at
+        job.outputTailSize bytes by dropping the oldest lines, contentOffset
+        records how many have been dropped.
+        """
+        max_size = cumulus.config.get('job', {}).get(
+            'outputTailSize', DEFAULT_OUTPUT_TAIL_SIZE)
+
+        content = output.get('content', []) + delta
+        size = sum(len(line) + 1 for line in content)
+        dropped = 0
+        while size > max_size and dropped < len(content) - 1:
+            size -= len(content[dropped]) + 1
+            dropped += 1
+        output['content'] = content[dropped:]
+        output['contentOffset'] = output.get('contentOffset', 0) + dropped
+
+    def _merge_output(self, current, updated):
+        """
+        Merge updated output entries with the current ones. The content of an
+        output is kept unless the update replaces it, a contentDelta is
+        appended to it.
+        """
+        current = {o.get('path'): o for o in current}
+
+        for output in updated:
+            delta = output.pop('contentDelta', None)
+            existing = current.get(output.get('path'), {})
+            if 'content' not in output:
+                output['content'] = existing.get('content', [])
+                output['contentOffset'] = existing.get('contentOffset', 0)
+
+            if delta:
+                self._append_content(output, delta)
+
+        return updated
+
+    def _apply_output_delta(self, current, deltas):
+        """
+        Apply changes to individual output entries, matched by path. Any
+        contentDelta is appended to the content, other fields are replaced.
+        """
+        current = {o.get('path'): o for o in current}
+
+        for delta in deltas:
+            if not isinstance(delta, dict):
+                raise RestException('outputDelta entries must be objects', 400)
+            delta = dict(delta)
+            output = current.get(delta.pop('path', None))
+            if output is None:
+                raise RestException('outputDelta path doesn\'t match an '
+                                    'output', 400)
+            content = delta.pop('contentDelta', None)
+            delta.pop('content', None)
+            output.update(delta)
+            if content:
+                self._append_content(output, content)
+
     @access.user
     def create(self, params):
         user = self.getCurrentUser()
@@ -203,6 +279,11 @@ class Job(BaseResource):
         cluster = cluster_model.filter(cluster, user)
         base_url = getApiUrl()
         self._model.update_status(user, id, 'terminating')
+        # Let the tasks already running for the job know, a worker that
+        # misses the broadcast finds the stamp on the job.
+        stamp = time.time()
+        self._model.set_termination_stamp(id, stamp)
+        broadcast_terminating(command, id, stamp)
 
         log_url = '%s/jobs/%s/log' % (base_url, id)
 
@@ -219,6 +300,153 @@ class Job(BaseResource):
         Description('Terminate a job')
         .param('id', 'The job id', paramType='path'))
 
+    @access.user
+    def submit(self, id, params):
+        user = self.getCurrentUser()
+        job = self._model.load(id, user=user, level=AccessType.ADMIN)
+
+        if not job:
+            raise RestException('Job not found.', code=404)
+
+        body = {}
+        if cherrypy.request.body:
+            request_body = cherrypy.request.body.read().decode('utf8')
+            if request_body:
+                body = json.loads(request_body)
+
+        job_params = body.get('params', {})
+        clusters = candidate_clusters(user, body.get('clusterIds'))
+        (cluster, estimates) = JobPlacement(user, job, job_params) \
+            .choose(clusters)
+
+        if not cluster:
+            raise RestException('No running cluster to submit to.', code=400)
+
+        # Keep the cached queue occupancy used for placement fresh
+        cluster_model = self.model('cluster', 'cumulus')
+        for c in clusters:
+            cluster_model.refresh_queue(user, c)
+
+        # Submit as PUT /clusters/:id/job/:jobId/submit does
+        job['clusterId'] = str(cluster['_id'])
+        if job_params:
+            job['params'] = job_params
+        job = self._model.save(job)
+
+        # So the job can report its state, this isn't stored on the job
+        job['callbackToken'] = get_job_callback_token(job)['_id']
+
+        cluster = cluster_model.filter(cluster, user, passphrase=False)
+        get_cluster_adapter(cluster).submit_job(job)
+
+        return {
+            'clusterId': cluster['_id'],
+            'expectedStart': estimates
+        }
+
+    addModel('JobSubmitParameters', {
+        'id': 'JobSubmitParameters',
+        'properties': {
+            'clusterIds': {'type': 'array', 'items': {'type': 'string'},
+                           'description': 'The clusters to choose from, '
+                                          'by default all the running '
+                                          'clusters the user can submit '
+                                          'to.'},
+            'params': {'type': 'object',
+                       'description': 'The properties to template on '
+                                      'submit.'}
+        }
+    }, 'jobs')
+
+    submit.description = (
+        Description('Submit a job to the cluster it is expected to start on '
+                    'soonest')
+        .param('id', 'The job id.', paramType='path')
+        .param(
+            'body', 'The clusters to choose from and the properties to '
+            'template on submit.', dataType='JobSubmitParameters',
+            paramType='body', required=False)
+        .notes('The expected start time on each cluster, in seconds, is '
+               'returned. It is based on the cached queue occupancy, the '
+               'queue timings of previous jobs and the input that has to be '
+               'moved to the cluster.'))
+
+    def _owner(self, job):
+        """
+        Callbacks aren't made by a user, so we act as the owner of the job.
+        """
+        for user_access in job['access']['users']:
+            if user_access['level'] == AccessType.ADMIN:
+                return self.model('user').load(user_access['id'], force=True)
+
+        raise RestException('Unable to find the owner of the job.', code=400)
+
+    def _monitor_now(self, job, owner, **kwargs):
+        """
+        Run a monitor for the job straight away, taking the job over from the
+        one polling it.
+        """
+        cluster_model = self.model('cluster', 'cumulus')
+        cluster = cluster_model.load(job['clusterId'], user=owner,
+                                     level=AccessType.ADMIN)
+        cluster = cluster_model.filter(cluster, owner, passphrase=False)
+        log_url = '%s/jobs/%s/log' % (getApiUrl(), job['_id'])
+        girder_token = self.get_task_token(cluster, owner)['_id']
+        tasks.job.monitor_job.delay(cluster, self._clean(job.copy()),
+                                    log_write_url=log_url,
+                                    girder_token=girder_token, **kwargs)
+
+    @access.public
+    def callback(self, id, params):
+        token = getCurrentToken()
+        if not token or JOB_CALLBACK_SCOPE % id not in token.get('scope', []):
+            raise RestException('Invalid callback token.', code=403)
+
+        self.requireParams(['event'], params)
+        event = params['event']
+
+        job = self._model.load(id, force=True)
+        if not job:
+            raise RestException('Job not found.', code=404)
+
+        owner = self._owner(job)
+
+        if event == 'started':
+            # Run the monitor now, so it moves the job on to running rather
+            # than waiting for the scheduler to report it on the next poll.
+            if job['status'] == 'queued':
+                job['status'] = 'running'
+                job = self._model.update_job(owner, job)
+                self._monitor_now(job, owner, started=True)
+        elif event == 'exited':
+            try:
+                exit_code = int(params.get('exitCode'))
+            except (TypeError, ValueError):
+                raise RestException('exitCode must be an integer.', code=400)
+
+            # Run the monitor now rather than waiting for the next poll, a
+            # terminating job is left to the monitor.
+            if job['status'] in ['queued', 'running']:
+                self._monitor_now(job, owner, exit_code=exit_code)
+        else:
+            raise RestException('Unrecognized event: %s' % event, code=400)
+
+        status = {'status': job['status']}
+        if 'terminationStamp' in job:
+            status['terminationStamp'] = job['terminationStamp']
+
+        return status
+
+    callback.description = (
+        Description('Report a change in the state of a job, made by the '
+                    'submission script')
+        .param('id', 'The job id.', paramType='path')
+        .param('event', 'The event, either "started" or "exited".',
+               paramType='query')
+        .param('exitCode', 'The exit code of the job, for "exited".',
+               required=False, paramType='query')
+        .notes('Requires the callback token given to the job on submission'))
+
     @access.user
     def update(self, id, params):
         user = self.getCurrentUser()
@@ -234,8 +462,27 @@ class Job(BaseResource):
         if 'queueJobId' in body:
             job['queueJobId'] = body['queueJobId']
 
+        if 'queueArrayIndex' in body:
+            job['queueArrayIndex'] = body['queueArrayIndex']
+
+        if 'submitStamp' in body:
+            job['submitStamp'] = body['submitStamp']
+
+        if 'exitCode' in body:
+            job['exitCode'] = body['exitCode']
+
+        if 'resourcesUsed' in body:
+            job['resourcesUsed'] = body['resourcesUsed']
+
         if 'output' in body:
-            job['output'] = body['output']
+            job['output'] = self._merge_output(job.get('output', []),
+                                               body['output'])
+
+        if 'outputDelta' in body:
+            if not isinstance(body['outputDelta'], list):
+                raise RestException('outputDelta must be a list', 400)
+            self._apply_output_delta(job.get('output', []),
+                                     body['outputDelta'])
 
         if 'timings' in body:
             if 'timings' in job:
@@ -259,8 +506,30 @@ class Job(BaseResource):
                 '$ref': 'JobStatus',
                 'description': 'The new status. (optional)'
             },
-            'queueJobId': {'type': 'integer',
-                           'description': 'The native queue job id. (optional)'}
+            'queueJobId': {
+                'type': 'integer',
+                'description': 'The native queue job id. (optional)'
+            },
+            'queueArrayIndex': {
+                'type': 'integer',
+                'description': 'The index of the task in the native array '
+                               'job. (optional)'
+            },
+            'submitStamp': {'type': 'number',
+                            'description': 'When the job was submitted, '
+                                           'terminations from before it are '
+                                           'ignored. (optional)'},
+            'exitCode': {'type': 'integer',
+                         'description': 'The exit code reported by the '
+                                        'scheduler. (optional)'},
+            'resourcesUsed': {'type': 'object',
+                              'description': 'The resource usage reported by '
+                                             'the scheduler. (optional)'},
+            'outputDelta': {'type': 'array',
+                            'description': 'Changes to output entries, '
+                                           'matched by path. Lines in '
+                                           'contentDelta are appended to the '
+                                           'content. (optional)'}
         }
     }, 'jobs')
 
@@ -273,6 +542,78 @@ class Job(BaseResource):
             paramType='body')
         .notes('Internal - Used by Celery tasks'))
 
+    def _lease_job(self, id, kind):
+        if not re.match(r'^[\w-]+$', kind):
+            raise RestException('Invalid lease kind.', code=400)
+
+        user = self.getCurrentUser()
+        job = self._model.load(id, user=user, level=AccessType.WRITE)
+        if not job:
+            raise RestException('Job not found.', code=404)
+
+        return job
+
+    @access.user
+    def acquire_lease(self, id, kind, params):
+        job = self._lease_job(id, kind)
+        body = getBodyJson()
+        self.requireParams(['holder'], body)
+
+        try:
+            ttl = float(body.get('ttl', DEFAULT_LEASE_TIMEOUT))
+        except (TypeError, ValueError):
+            raise RestException('ttl must be a number.', code=400)
+
+        lease = self.model('lease', 'cumulus').acquire(
+            job, kind, body['holder'], ttl, steal=bool(body.get('steal')))
+        if lease is None:
+            raise RestException('The lease is held by another monitor.',
+                                code=409)
+
+        return lease
+
+    addModel('LeaseParameters', {
+        'id': 'LeaseParameters',
+        'required': ['holder'],
+        'properties': {
+            'holder': {'type': 'string',
+                       'description': 'Identifies the monitor holding the '
+                                      'lease.'},
+            'ttl': {'type': 'number',
+                    'description': 'The seconds until the lease expires. '
+                                   '(optional)'},
+            'steal': {'type': 'boolean',
+                      'description': 'Take the lease over even if it is '
+                                     'held. (optional)'}
+        }
+    }, 'jobs')
+
+    acquire_lease.description = (
+        Description('Acquire or renew a lease on the job, so only one monitor '
+                    'of a kind is live for the job')
+        .param('id', 'The job id.', paramType='path')
+        .param('kind', 'The kind of monitor.', paramType='path')
+        .param(
+            'body',
+            'The lease to acquire.', dataType='LeaseParameters',
+            paramType='body')
+        .notes('Internal - Used by Celery tasks, returns 409 if the lease is '
+               'held by another monitor'))
+
+    @access.user
+    def release_lease(self, id, kind, params):
+        job = self._lease_job(id, kind)
+        self.requireParams(['holder'], params)
+
+        self.model('lease', 'cumulus').release(job, kind, params['holder'])
+
+    release_lease.description = (
+        Description('Release a lease on the job')
+        .param('id', 'The job id.', paramType='path')
+        .param('kind', 'The kind of monitor.', paramType='path')
+        .param('holder', 'The holder of the lease.', paramType='query')
+        .notes('Internal - Used by Celery tasks'))
+
     @access.user
     def status(self, id, params):
         user = self.getCurrentUser()
@@ -282,7 +623,11 @@ class Job(BaseResource):
         if not job:
             raise RestException('Job not found.', code=404)
 
-        return {'status': job['status']}
+        status = {'status': job['status']}
+        if 'terminationStamp' in job:
+            status['terminationStamp'] = job['terminationStamp']
+
+        return status
 
     addModel('JobStatus', {
         'id': 'JobStatus',
@@ -291,7 +636,10 @@ class Job(BaseResource):
             'status': {'type': 'string',
                        'enum': ['created', 'downloading', 'queued', 'running',
                                 'uploading', 'terminating', 'terminated',
-                                'complete', 'error']}
+                                'complete', 'error']},
+            'terminationStamp': {'type': 'number',
+                                 'description': 'When termination of the '
+                                                'job was last asked for.'}
         }
     }, 'jobs')
 
@@ -373,6 +721,10 @@ class Job(BaseResource):
         if 'content' not in match:
             match['content'] = []
 
+        # The offset is in lines since the start of the output, older lines
+        # may have been dropped.
+        offset = max(offset - match.get('contentOffset', 0), 0)
+
         return {'content': match['content'][offset:]}
 
     output.description = (
@@ -429,6 +781,7 @@ class Job(BaseResource):
                 tasks.job.remove_output.delay(cluster, self._clean(job.copy()),
                                               girder_token=girder_token)
 
+        self.model('lease', 'cumulus').remove_job_leases(job)
         self._model.remove(job)
 
     delete.description = (
@@ -18,6 +18,7 @@
 ###############################################################################
 
 import json
+import time
 from jsonpath_rw import parse
 from girder.models.model_base import ValidationException
 from bson.objectid import ObjectId
@@ -28,6 +29,7 @@ from cumulus.constants import ClusterType, QueueType
 from ..utility.cluster_adapters import get_cluster_adapter
 from cumulus.common.girder import create_status_notifications, \
     check_group_membership
+from cumulus.queue import occupancy as queue_occupancy
 import cumulus
 
 
@@ -41,7 +43,8 @@ class Cluster(BaseModel):
 
         self.exposeFields(level=AccessType.READ,
                           fields=('_id', 'status', 'name', 'config', 'template',
-                                  'type', 'userId', 'assetstoreId'))
+                                  'type', 'userId', 'assetstoreId',
+                                  'capabilities', 'queue'))
 
     def filter(self, cluster, user, passphrase=True):
         cluster = super(Cluster, self).filter(doc=cluster, user=user)
@@ -148,6 +151,24 @@ class Cluster(BaseModel):
 
         return self.save(cluster)
 
+    def refresh_queue(self, user, cluster):
+        """
+        Start a refresh of the queue occupancy of the cluster in the
+        background if it is stale. The request is recorded, so other reads
+        don't start one as well.
+        """
+        if not queue_occupancy.is_stale(cluster):
+            return
+
+        now = time.time()
+        self.update({'_id': ObjectId(cluster['_id'])},
+                    {'$set': {'queue.refreshRequested': now}})
+        cluster.setdefault('queue', {})['refreshRequested'] = now
+
+        adapter = get_cluster_adapter(self.filter(cluster, user,
+                                                  passphrase=False))
+        adapter.refresh_queue()
+
     def log_records(self, user, id, offset=0):
         # TODO Need to figure out perms a remove this force
         cluster = self.load(id, user=user, level=AccessType.READ)
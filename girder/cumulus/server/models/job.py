@@ -74,6 +74,14 @@ class Job(BaseModel):
 
         return self.save(job)
 
+    def set_termination_stamp(self, id, stamp):
+        """
+        Record when termination of the job was asked for, the tasks for a
+        submission of the job that came before it should stop.
+        """
+        self.update({'_id': ObjectId(id)},
+                    {'$set': {'terminationStamp': stamp}})
+
     def update_job(self, user, job):
         job_id = job['_id']
         current_job = self.load(job_id, user=user, level=AccessType.WRITE)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import time
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
+from girder.models.model_base import Model
+
+
+class Lease(Model):
+    """
+    The leases held by the monitors of jobs. A monitor holds the lease of its
+    kind on a job until it is released or expires, so only one monitor of
+    each kind is live for a job.
+    """
+
+    def initialize(self):
+        self.name = 'leases'
+        self.ensureIndices([([('jobId', 1), ('kind', 1)], {'unique': True})])
+
+    def validate(self, doc):
+        return doc
+
+    def acquire(self, job, kind, holder, ttl, steal=False):
+        """
+        Acquire or renew a lease for holder, returns the lease or None if it
+        is held by another holder and hasn't expired. If steal is True the
+        lease is taken over whoever holds it.
+        """
+        now = time.time()
+        query = {
+            'jobId': ObjectId(job['_id']),
+            'kind': kind
+        }
+        if not steal:
+            query['$or'] = [
+                {'holder': holder},
+                {'expires': {'$lt': now}}
+            ]
+        lease = {
+            'holder': holder,
+            'expires': now + ttl
+        }
+
+        try:
+            # If the lease is held by someone else the upsert conflicts with
+            # the existing lease
+            self.collection.update(query, {'$set': lease}, upsert=True)
+        except DuplicateKeyError:
+            return None
+
+        return lease
+
+    def release(self, job, kind, holder):
+        self.collection.remove({
+            'jobId': ObjectId(job['_id']),
+            'kind': kind,
+            'holder': holder
+        })
+
+    def remove_job_leases(self, job):
+        self.collection.remove({'jobId': ObjectId(job['_id'])})
@@ -90,6 +90,28 @@ class AbstractClusterAdapter(ModelImporter):
         cumulus.starcluster.tasks.job.submit(girder_token, self.cluster, job,
                                              log_url)
 
+    def submit_array_job(self, jobs):
+        log_url = '%s/jobs/%s/log' % (getApiUrl(), jobs[0]['_id'])
+        for job in jobs:
+            job['_id'] = str(job['_id'])
+            del job['access']
+
+        girder_token = get_task_token()['_id']
+        cumulus.starcluster.tasks.job.submit_array(girder_token, self.cluster,
+                                                   jobs, log_url)
+
+    def refresh_queue(self):
+        """
+        Refresh the queue occupancy stored on the cluster in the background.
+        """
+        log_write_url = '%s/clusters/%s/log' % (getApiUrl(),
+                                                self.cluster['_id'])
+        girder_token = get_task_token(self.cluster)['_id']
+        cumulus.starcluster.tasks.cluster.refresh_queue_occupancy \
+            .delay(self.cluster,
+                   log_write_url=log_write_url,
+                   girder_token=girder_token)
+
 
 class Ec2ClusterAdapter(AbstractClusterAdapter):
     def validate(self):
@@ -311,6 +333,16 @@ class NewtClusterAdapter(AbstractClusterAdapter):
         cumulus.starcluster.tasks.job.submit(girder_token, self.cluster, job,
                                              log_url)
 
+    def submit_array_job(self, jobs):
+        log_url = '%s/jobs/%s/log' % (getApiUrl(), jobs[0]['_id'])
+        for job in jobs:
+            job['_id'] = str(job['_id'])
+            del job['access']
+
+        girder_token = get_task_token(self.cluster)['_id']
+        cumulus.starcluster.tasks.job.submit_array(girder_token, self.cluster,
+                                                   jobs, log_url)
+
 
 type_to_adapter = {
     ClusterType.EC2: Ec2ClusterAdapter,
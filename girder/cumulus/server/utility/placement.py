@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+from bson.objectid import ObjectId
+
+from girder.constants import AccessType
+from girder.utility.model_importer import ModelImporter
+
+import cumulus
+
+# The queue wait assumed for a cluster we haven't run any jobs on
+DEFAULT_QUEUE_WAIT = 60
+# The number of recent jobs on a cluster the queue wait is estimated from
+DEFAULT_HISTORY_SIZE = 50
+# The rate input not already on a cluster is expected to be moved at, in
+# bytes per second
+DEFAULT_TRANSFER_RATE = 10 * 1024 * 1024
+
+
+def _config(key, default):
+    return cumulus.config.get('placement', {}).get(key, default)
+
+
+def _median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+class JobPlacement(ModelImporter):
+    """
+    Picks the cluster a job is expected to start on soonest. The expected time
+    to start on a cluster is the time to move any input that isn't already in
+    the cluster's assetstore, plus the expected queue wait. The queue wait is
+    the median of the recent queue timings of jobs on the cluster, scaled by
+    the number of pending jobs for each running one in the cached queue
+    occupancy, or nothing if the cluster has free slots and no pending jobs.
+    """
+    def __init__(self, user, job, params=None):
+        self.user = user
+        self.job = job
+        params = params or {}
+        self.slots = int(params.get('numberOfSlots', 1))
+        self.nodes = int(params.get('numberOfNodes', 0))
+        self._inputs = None
+
+    def _input_files(self):
+        """
+        Returns the files in the job's input items and folders, the user must
+        be able to read them.
+        """
+        if self._inputs is not None:
+            return self._inputs
+
+        self._inputs = []
+        for input in self.job.get('input', []):
+            if 'itemId' in input:
+                item = self.model('item').load(input['itemId'], user=self.user,
+                                               level=AccessType.READ)
+                if item:
+                    self._inputs += list(self.model('item').childFiles(item))
+            elif 'folderId' in input:
+                folder = self.model('folder').load(
+                    input['folderId'], user=self.user, level=AccessType.READ)
+                if folder:
+                    self._inputs += [
+                        f for (_, f) in self.model('folder').fileList(
+                            folder, user=self.user, data=False)]
+
+        return self._inputs
+
+    def transfer_time(self, cluster):
+        """
+        The time to move the input not already stored on the cluster.
+        """
+        assetstore_id = str(cluster.get('assetstoreId'))
+        size = sum(f.get('size', 0) for f in self._input_files()
+                   if str(f.get('assetstoreId')) != assetstore_id)
+
+        return size / float(_config('transferRate', DEFAULT_TRANSFER_RATE))
+
+    def queue_wait(self, cluster):
+        """
+        The time the job is expected to wait in the cluster's queue.
+        """
+        occupancy = cluster.get('queue') or {}
+        pending = occupancy.get('pending')
+        if pending == 0 and self._fits(occupancy):
+            return 0
+
+        jobs = self.model('job', 'cumulus').find(
+            {'clusterId': str(cluster['_id']),
+             'timings.queued': {'$exists': True}},
+            fields=['timings'], sort=[('_id', -1)],
+            limit=_config('historySize', DEFAULT_HISTORY_SIZE))
+        waits = [job['timings']['queued'] / 1000.0 for job in jobs]
+        wait = _median(waits) if waits \
+            else _config('defaultQueueWait', DEFAULT_QUEUE_WAIT)
+
+        if pending:
+            wait *= 1 + pending / float(max(occupancy.get('running', 0), 1))
+
+        return wait
+
+    def _fits(self, occupancy):
+        if self.nodes and 'freeNodes' in occupancy:
+            return occupancy['freeNodes'] >= self.nodes
+
+        return occupancy.get('freeSlots', 0) >= self.slots
+
+    def expected_start(self, cluster):
+        """
+        The time, in seconds, the job is expected to take to start on the
+        cluster.
+        """
+        return self.transfer_time(cluster) + self.queue_wait(cluster)
+
+    def choose(self, clusters):
+        """
+        Returns the cluster the job is expected to start on soonest, along
+        with a dict of the expected start time on each of the clusters.
+        """
+        if not clusters:
+            return (None, {})
+
+        estimates = {str(c['_id']): self.expected_start(c) for c in clusters}
+        cluster = min(clusters, key=lambda c: estimates[str(c['_id'])])
+
+        return (cluster, estimates)
+
+
+def candidate_clusters(user, cluster_ids=None):
+    """
+    Returns the running clusters the user can submit to, limited to
+    cluster_ids if given.
+    """
+    query = {'status': 'running'}
+    if cluster_ids:
+        query['_id'] = {'$in': [ObjectId(id) for id in cluster_ids]}
+
+    cluster_model = ModelImporter.model('cluster', 'cumulus')
+    clusters = cluster_model.find(query)
+
+    return list(cluster_model.filterResultsByPermission(
+        clusters, user, AccessType.ADMIN, limit=0))
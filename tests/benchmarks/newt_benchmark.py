@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Compares NEWT monitoring ticks against a local stand-in for Girder and NEWT,
+using the shared NEWT client and the previous behaviour of fetching the
+session id and creating a new HTTP session for every connection. A delay can
+be added to each new TCP connection to model the cost of a TLS handshake.
+
+Usage:
+
+    python newt_benchmark.py [-n <number of ticks>] [-c <connect delay>]
+"""
+
+import argparse
+import json
+import threading
+import time
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+
+import requests
+
+import cumulus
+from cumulus.transport import get_connection
+from cumulus.transport.newt_client import get_newt_client
+
+
+class Stats(object):
+    connections = 0
+    session_id_requests = 0
+    newt_requests = 0
+    connect_delay = 0
+
+
+class NewtHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Buffer the response and send it in one go, otherwise Nagle's algorithm
+    # stalls responses on kept alive connections.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        Stats.connections += 1
+        time.sleep(Stats.connect_delay)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _respond(self, content):
+        content = json.dumps(content)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _read_body(self):
+        length = int(self.headers.getheader('Content-Length', 0))
+        if length:
+            self.rfile.read(length)
+
+    def do_GET(self):
+        if self.path.startswith('/api/v1/newt/sessionId'):
+            Stats.session_id_requests += 1
+            self._respond({'sessionId': 'benchmark'})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        self._read_body()
+        if self.path.startswith('/newt/command/'):
+            Stats.newt_requests += 1
+            self._respond({
+                'output': '1234|R',
+                'error': ''
+            })
+        else:
+            self.send_error(404)
+
+
+class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _legacy_tick(base_url, machine):
+    """
+    Reproduces the previous behaviour, session id fetched on every connection
+    and a new HTTP session per connection.
+    """
+    headers = {'Girder-Token': 'token'}
+    r = requests.get('%s/api/v1/newt/sessionId' % base_url, headers=headers)
+    session = requests.Session()
+    session.cookies.set('newt_sessionid', r.json()['sessionId'])
+    session.post('%s/newt/command/%s' % (base_url, machine),
+                 data={'executable': 'squeue', 'loginenv': True})
+    session.close()
+
+
+def _tick(cluster):
+    with get_connection('token', cluster) as conn:
+        conn.execute('squeue')
+
+
+def _run(tick, number_of_ticks):
+    Stats.connections = 0
+    Stats.session_id_requests = 0
+    Stats.newt_requests = 0
+
+    start = time.time()
+    for _ in range(number_of_ticks):
+        tick()
+    elapsed = time.time() - start
+
+    return elapsed
+
+
+def _report(name, number_of_ticks, elapsed):
+    print '%s: %d ticks in %.2fs, %.1f ticks/s, %d connections, ' \
+        '%d session id requests, %d NEWT requests' \
+        % (name, number_of_ticks, elapsed, number_of_ticks / elapsed,
+           Stats.connections, Stats.session_id_requests, Stats.newt_requests)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='NEWT client benchmark')
+    parser.add_argument('-n', '--number-of-ticks', type=int, default=200)
+    parser.add_argument('-c', '--connect-delay', type=float, default=0.02,
+                        help='Seconds to delay each new connection by')
+    args = parser.parse_args()
+
+    Stats.connect_delay = args.connect_delay
+    server = ThreadedHTTPServer(('127.0.0.1', 0), NewtHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    cumulus.config.girder.baseUrl = '%s/api/v1' % base_url
+    cumulus.config.setdefault('newt', {})['baseUrl'] = '%s/newt' % base_url
+    machine = 'cori'
+    cluster = {
+        'type': 'newt',
+        'config': {
+            'host': machine
+        }
+    }
+
+    elapsed = _run(lambda: _legacy_tick(base_url, machine),
+                   args.number_of_ticks)
+    _report('Session per connection', args.number_of_ticks, elapsed)
+
+    elapsed = _run(lambda: _tick(cluster), args.number_of_ticks)
+    _report('Shared NEWT client    ', args.number_of_ticks, elapsed)
+
+    get_newt_client().clear()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Compares SFTP operations per second on a tree of small files between the
+persistent SFTP session used by SshClusterConnection and the previous
+behaviour of opening a new SFTP session for every call.
+
+Usage:
+
+    python sftp_benchmark.py -H <host> -u <user> -k <private key> \\
+        [-p <passphrase>] [-n <number of files>] [-d <remote dir>]
+"""
+
+import argparse
+import os
+import time
+import uuid
+from StringIO import StringIO
+
+import cumulus
+from cumulus.transport import get_connection
+
+
+class PerCallSftp(object):
+    """
+    Reproduces the previous behaviour, one SFTP session per operation.
+    """
+    def __init__(self, conn):
+        self._conn = conn._conn
+
+    def put(self, stream, remote_path):
+        with self._conn.transport.open_sftp_client() as sftp:
+            sftp.putfo(stream, remote_path)
+
+    def stat(self, remote_path):
+        with self._conn.transport.open_sftp_client() as sftp:
+            return sftp.stat(remote_path)
+
+    def mkdir(self, remote_path):
+        with self._conn.transport.open_sftp_client() as sftp:
+            sftp.mkdir(remote_path)
+
+    def remove(self, remote_path):
+        with self._conn.transport.open_sftp_client() as sftp:
+            sftp.remove(remote_path)
+
+
+def _run(client, root, number_of_files, files_per_dir=10):
+    ops = 0
+    paths = []
+    start = time.time()
+
+    client.mkdir(root)
+    ops += 1
+    for i in range(number_of_files):
+        if i % files_per_dir == 0:
+            dir = os.path.join(root, 'dir%d' % (i / files_per_dir))
+            client.mkdir(dir)
+            ops += 1
+        path = os.path.join(dir, 'file%d.txt' % i)
+        client.put(StringIO('file %d' % i), path)
+        paths.append(path)
+        ops += 1
+
+    for path in paths:
+        client.stat(path)
+        client.remove(path)
+        ops += 2
+
+    elapsed = time.time() - start
+
+    return ops, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SFTP session benchmark')
+    parser.add_argument('-H', '--host', required=True)
+    parser.add_argument('-u', '--user', required=True)
+    parser.add_argument('-k', '--key', required=True,
+                        help='Path to the private key to use')
+    parser.add_argument('-p', '--passphrase', default=None)
+    parser.add_argument('-n', '--number-of-files', type=int, default=500)
+    parser.add_argument('-d', '--dir', default='/tmp',
+                        help='Remote directory to create the tree in')
+    args = parser.parse_args()
+
+    # The transport expects the key to live in the key store named using the
+    # cluster id.
+    cumulus.config.ssh.keyStore = os.path.dirname(os.path.abspath(args.key))
+    cluster = {
+        '_id': os.path.basename(args.key),
+        'type': 'trad',
+        'config': {
+            'host': args.host,
+            'ssh': {
+                'user': args.user,
+                'passphrase': args.passphrase
+            }
+        }
+    }
+
+    with get_connection(None, cluster) as conn:
+        root = os.path.join(args.dir, 'sftp_benchmark_%s' % uuid.uuid4().hex)
+        (ops, elapsed) = _run(PerCallSftp(conn), root + '_per_call',
+                              args.number_of_files)
+        print 'Session per call:   %d ops in %.2fs, %.1f ops/s' \
+            % (ops, elapsed, ops / elapsed)
+
+        (ops, elapsed) = _run(conn, root + '_persistent',
+                              args.number_of_files)
+        print 'Persistent session: %d ops in %.2fs, %.1f ops/s' \
+            % (ops, elapsed, ops / elapsed)
+
+        conn.execute('rm -rf %s_per_call %s_persistent' % (root, root))
+
+
+if __name__ == '__main__':
+    main()
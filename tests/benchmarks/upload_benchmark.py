@@ -0,0 +1,133 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+"""
+Compares files per second when staging a tree of small files to a cluster,
+using a put and mkdir per file and directory ( the path used by upload_path
+below the bulk upload threshold ) and a single streamed tar archive.
+
+Usage:
+
+    python upload_benchmark.py -H <host> -u <user> -k <private key> \\
+        [-p <passphrase>] [-n <number of files>] [-s <file size>] \\
+        [-d <remote dir>]
+"""
+
+import argparse
+import os
+import tarfile
+import time
+import uuid
+from StringIO import StringIO
+
+import cumulus
+from cumulus.transport import get_connection
+
+
+def _entries(root, number_of_files, files_per_dir=10):
+    for i in range(number_of_files):
+        if i % files_per_dir == 0:
+            dir = os.path.join(root, 'dir%d' % (i / files_per_dir))
+            yield (dir, None)
+        yield (os.path.join(dir, 'file%d.txt' % i), i)
+
+
+def _per_file(conn, root, number_of_files, file_size):
+    conn.makedirs(root)
+    for (path, i) in _entries(root, number_of_files):
+        if i is None:
+            conn.mkdir(path)
+        else:
+            conn.put(StringIO('x' * file_size), path)
+
+
+def _archive(conn, root, number_of_files, file_size):
+    with conn.put_archive(root) as archive:
+        for (path, i) in _entries(root, number_of_files):
+            info = tarfile.TarInfo(os.path.relpath(path, root))
+            info.mtime = time.time()
+            if i is None:
+                info.type = tarfile.DIRTYPE
+                info.mode = 0755
+                archive.addfile(info)
+            else:
+                info.size = file_size
+                info.mode = 0644
+                archive.addfile(info, StringIO('x' * file_size))
+
+
+def _run(upload, conn, root, number_of_files, file_size):
+    start = time.time()
+    upload(conn, root, number_of_files, file_size)
+    elapsed = time.time() - start
+
+    # Check everything arrived
+    count = int(conn.execute('find %s -type f | wc -l' % root)[0])
+    if count != number_of_files:
+        raise Exception('Expected %d files, found %d'
+                        % (number_of_files, count))
+
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Folder upload benchmark')
+    parser.add_argument('-H', '--host', required=True)
+    parser.add_argument('-u', '--user', required=True)
+    parser.add_argument('-k', '--key', required=True,
+                        help='Path to the private key to use')
+    parser.add_argument('-p', '--passphrase', default=None)
+    parser.add_argument('-n', '--number-of-files', type=int, default=1000)
+    parser.add_argument('-s', '--file-size', type=int, default=1024)
+    parser.add_argument('-d', '--dir', default='/tmp',
+                        help='Remote directory to create the tree in')
+    args = parser.parse_args()
+
+    # The transport expects the key to live in the key store named using the
+    # cluster id.
+    cumulus.config.ssh.keyStore = os.path.dirname(os.path.abspath(args.key))
+    cluster = {
+        '_id': os.path.basename(args.key),
+        'type': 'trad',
+        'config': {
+            'host': args.host,
+            'ssh': {
+                'user': args.user,
+                'passphrase': args.passphrase
+            }
+        }
+    }
+
+    with get_connection(None, cluster) as conn:
+        root = os.path.join(args.dir, 'upload_benchmark_%s' % uuid.uuid4().hex)
+        n = args.number_of_files
+
+        elapsed = _run(_per_file, conn, root + '_per_file', n, args.file_size)
+        print 'Per file:    %d files in %.2fs, %.1f files/s' \
+            % (n, elapsed, n / elapsed)
+
+        elapsed = _run(_archive, conn, root + '_archive', n, args.file_size)
+        print 'Tar archive: %d files in %.2fs, %.1f files/s' \
+            % (n, elapsed, n / elapsed)
+
+        conn.execute('rm -rf %s_per_file %s_archive' % (root, root))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,26 @@
 #PBS -l procs=12312312
 cd $PBS_O_WORKDIR
 
+# Record when the job starts and exits in the cluster's journal, and report
+# it to Girder if the job has a callback token, so the monitor doesn't have
+# to ask the scheduler. The journal entries are keyed by the submission of
+# the job, so those of an earlier run aren't taken for this one.
+_cumulus_event() {
+    echo "$(date +%s) $2 $4 $5" >> "$HOME/.cumulus_journal"
+    if [ -n "$3" ]; then
+        curl -s -m 10 -X PUT -H "Girder-Token: $3" \
+            "http://localhost:8080/api/v1/jobs/$1/callback?event=$4&exitCode=$5" \
+            > /dev/null 2>&1 || true
+    fi
+}
+
+_cumulus_events() {
+    trap "_cumulus_event $1 $2 '$3' exited \$?" EXIT
+    _cumulus_event $1 $2 "$3" started
+}
+
+_cumulus_events 123432423 123432423
+
 ls
 sleep 20
 mpirun -n 1000000 parallel
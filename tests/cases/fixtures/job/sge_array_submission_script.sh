@@ -0,0 +1,51 @@
+#!/bin/sh
+#                             _
+#                            | |
+#   ___ _   _ _ __ ___  _   _| |_   _ ___
+#  / __| | | | '_ ` _ \| | | | | | | / __|
+# | (__| |_| | | | | | | |_| | | |_| \__ \
+#  \___|\__,_|_| |_| |_|\__,_|_|\__,_|___/
+#
+
+#
+#$ -S /bin/bash
+#$ -N dummy-123432423
+#$ -t 1-2
+cd $SGE_O_WORKDIR
+
+# Record when the job starts and exits in the cluster's journal, and report
+# it to Girder if the job has a callback token, so the monitor doesn't have
+# to ask the scheduler. The journal entries are keyed by the submission of
+# the job, so those of an earlier run aren't taken for this one.
+_cumulus_event() {
+    echo "$(date +%s) $2 $4 $5" >> "$HOME/.cumulus_journal"
+    if [ -n "$3" ]; then
+        curl -s -m 10 -X PUT -H "Girder-Token: $3" \
+            "http://localhost:8080/api/v1/jobs/$1/callback?event=$4&exitCode=$5" \
+            > /dev/null 2>&1 || true
+    fi
+}
+
+_cumulus_events() {
+    trap "_cumulus_event $1 $2 '$3' exited \$?" EXIT
+    _cumulus_event $1 $2 "$3" started
+}
+
+case $SGE_TASK_ID in
+1)
+    cd $HOME/123432423
+    exec > dummy-123432423.o$JOB_ID 2>&1
+
+    _cumulus_events 123432423 123432423
+    ls
+    mpirun -n 10 sweep 123432423
+    ;;
+2)
+    cd /data/123432424
+    exec > dummy-123432424.o$JOB_ID 2>&1
+
+    _cumulus_events 123432424 123432424
+    ls
+    mpirun -n 10 sweep 123432424
+    ;;
+esac
@@ -24,13 +24,44 @@ import cumulus
 import json
 import re
 import os
+import copy
+import shutil
+import tempfile
+from cumulus.common import termination
 from cumulus.starcluster.tasks import job
+from cumulus.transport.pool import get_ssh_pool
+from cumulus.transport.ssh import get_master_cache
+from cumulus.queue.poller import get_queue_status_poller
 from celery.app import task
 
 
+def qstat_xml(jobs):
+    """
+    Returns qstat -xml output listing the (job id, state) pairs.
+    """
+    output = ['<?xml version=\'1.0\'?>', '<job_info>', '<queue_info>']
+    for (job_id, state) in jobs:
+        output += ['<job_list state="running">',
+                   '<JB_job_number>%s</JB_job_number>' % job_id,
+                   '<JB_name>hostname</JB_name>',
+                   '<JB_owner>sgeadmin</JB_owner>',
+                   '<state>%s</state>' % state,
+                   '<slots>1</slots>',
+                   '</job_list>']
+    output += ['</queue_info>', '<job_info>', '</job_info>', '</job_info>']
+
+    return output
+
+
+def qacct_not_found(job_id):
+    return ['error: job id %s not found' % job_id]
+
+
 class MockMaster:
     execute_stack = []
     def __init__(self):
+        self.addr = 'master'
+        self.key_location = '/dummy/key'
         self.ssh = mock.MagicMock()
 
         self.ssh.execute.side_effect = MockMaster.execute_stack
@@ -77,6 +108,22 @@ class JobTestCase(unittest.TestCase):
         self._get_status_called  = False
         self._set_status_called  = False
         self._upload_job_output = cumulus.starcluster.tasks.job.upload_job_output.delay = mock.Mock()
+        get_ssh_pool().clear()
+        get_master_cache().clear()
+        get_queue_status_poller().clear()
+
+        # Each monitor holds the lease on its job
+        for name in ['hold_lease', 'release_lease']:
+            patcher = mock.patch('cumulus.starcluster.tasks.job.%s' % name)
+            setattr(self, '_%s' % name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self._hold_lease.return_value = True
+
+        # No job has been asked to terminate
+        patcher = mock.patch('cumulus.starcluster.tasks.job.is_terminating')
+        self._is_terminating = patcher.start()
+        self._is_terminating.return_value = False
+        self.addCleanup(patcher.stop)
 
     def normalize(self, data):
         str_data = json.dumps(data, default=str)
@@ -114,7 +161,7 @@ class JobTestCase(unittest.TestCase):
             'output': []
         }
 
-        MockMaster.execute_stack = ['qstat output']
+        MockMaster.execute_stack = [qstat_xml([]), qacct_not_found('dummy')]
 
         def _get_status(url, request):
             content = {
@@ -130,7 +177,7 @@ class JobTestCase(unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {u'status': u'terminated', u'timings': {}, u'output': []}
+            expected = {u'status': u'terminated'}
 
             self._set_status_called = json.loads(request.body) == expected
 
@@ -180,7 +227,7 @@ class JobTestCase(unittest.TestCase):
             }]
         }
 
-        MockMaster.execute_stack = ['qstat output']
+        MockMaster.execute_stack = [qstat_xml([]), qacct_not_found('dummy')]
 
         def _get_status(url, request):
             content = {
@@ -196,7 +243,7 @@ class JobTestCase(unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {'status': 'uploading', 'timings': {}, 'output': [{'itemId': u'dummy'}]}
+            expected = {'status': 'uploading'}
             self._set_status_called = json.loads(request.body) == expected
 
             return httmock.response(200, None, {}, request=request)
@@ -214,9 +261,255 @@ class JobTestCase(unittest.TestCase):
 
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
         self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
-        expected_calls = [[[{u'config': {u'_id': u'dummy', u'scheduler': {u'type': u'sge'}}, u'name': u'dummy', u'type': u'ec2', u'_id': u'dummy'}, {u'status': u'uploading', u'output': [{u'itemId': u'dummy'}], u'_id': u'dummy', u'queueJobId': u'dummy', u'name': u'dummy'}], {u'girder_token': u's', u'log_write_url': 1, u'job_dir': u'./dummy'}]]
+        expected_calls = [[[{u'config': {u'_id': u'dummy', u'scheduler': {u'type': u'sge'}}, u'name': u'dummy', u'type': u'ec2', u'_id': u'dummy'}, {u'status': u'uploading', u'output': [{u'itemId': u'dummy'}], u'_id': u'dummy', u'queueJobId': u'dummy', u'name': u'dummy', u'sentState': {u'status': u'uploading', u'output': {}}}], {u'girder_token': u's', u'log_write_url': 1, u'job_dir': u'./dummy'}]]
         self.assertCalls(self._upload_job_output.call_args_list, expected_calls)
 
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job.get_queue_status_poller')
+    def test_monitor_job_exit_callback(self, get_queue_status_poller, *args):
+        job_id = 'dummy'
+        cluster = {
+            '_id': 'dummy',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': job_id,
+            'queueJobId': 'dummy',
+            'name': 'dummy',
+            'output': [{
+                'itemId': 'dummy'
+            }]
+        }
+
+        self._current_status = 'running'
+        self._patches = []
+
+        def _get_status(url, request):
+            content = json.dumps({'status': self._current_status})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            self._patches.append(json.loads(request.body))
+
+            return httmock.response(200, None, {}, request=request)
+
+        status_url = '/api/v1/jobs/%s/status' % job_id
+        get_status = httmock.urlmatch(
+            path=r'^%s$' % status_url, method='GET')(_get_status)
+
+        status_update_url = '/api/v1/jobs/%s' % job_id
+        set_status = httmock.urlmatch(
+            path=r'^%s$' % status_update_url, method='PATCH')(_set_status)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job.apply(
+                args=(cluster, job_model), task_id='callback',
+                kwargs={'exit_code': 0, 'girder_token': 's',
+                        'log_write_url': 1})
+
+        # The exit code is taken from the callback rather than the scheduler
+        self.assertFalse(get_queue_status_poller.called)
+        # Only the changes are sent
+        self.assertEqual(self._patches, [{
+            'status': 'uploading',
+            'exitCode': 0
+        }])
+        self.assertEqual(self._upload_job_output.call_count, 1)
+
+        # Once the job has moved on a pending poll, holding the job as it was,
+        # does nothing when it comes to move the job on
+        self._current_status = 'uploading'
+        self._patches = []
+        get_queue_status_poller.return_value.job_info.return_value = {
+            'state': 'complete'
+        }
+        stale_job = {
+            '_id': job_id,
+            'queueJobId': 'dummy',
+            'name': 'dummy',
+            'status': 'running',
+            'output': [{
+                'itemId': 'dummy'
+            }]
+        }
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job.apply(
+                args=(cluster, stale_job), task_id='poll',
+                kwargs={'girder_token': 's', 'log_write_url': 1})
+
+        self.assertEqual(stale_job['status'], 'uploading')
+        self.assertEqual(self._patches, [])
+        self.assertEqual(self._upload_job_output.call_count, 1)
+
+        # The callback takes the job over from any monitor polling it, each
+        # holds the lease under its task id
+        self.assertEqual(self._hold_lease.call_args_list[0],
+                         mock.call(job_model, 'job', 'callback', 's',
+                                   steal=True))
+        self.assertEqual(self._hold_lease.call_args_list[1],
+                         mock.call(stale_job, 'job', 'poll', 's',
+                                   steal=False))
+
+    @mock.patch('cumulus.config.job', new={'callbackPollInterval': 30},
+                create=True)
+    def test_poll_countdown(self):
+        cluster = {'_id': 'dummy'}
+        job_model = {
+            '_id': 'dummy',
+            'callbackToken': 'token',
+            'output': []
+        }
+
+        # The compute nodes may not be able to reach Girder
+        self.assertTrue(job._poll_countdown(cluster, job_model, 'running') < 30)
+
+        job_model['callbackReceived'] = True
+        job_model['pollState'] = {}
+        self.assertEqual(job._poll_countdown(cluster, job_model, 'running'), 30)
+
+        # We still need to poll to tail output
+        job_model['output'] = [{'path': 'out', 'tail': True}]
+        job_model['pollState'] = {}
+        self.assertTrue(job._poll_countdown(cluster, job_model, 'running') < 30)
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    @mock.patch('cumulus.starcluster.tasks.job.get_queue_status_poller')
+    def test_monitor_job_started_callback(self, get_queue_status_poller,
+                                          *args):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': 'dummy',
+            'name': 'dummy',
+            'status': 'queued',
+            'callbackToken': 'token',
+            'output': []
+        }
+        get_queue_status_poller.return_value.job_info.return_value = {
+            'state': 'running'
+        }
+
+        def _get_status(url, request):
+            content = json.dumps({'status': self._current_status})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            return httmock.response(200, None, {}, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/dummy/status$', method='GET')(_get_status)
+        set_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/dummy$', method='PATCH')(_set_status)
+
+        # No callback has arrived, Girder still has the job as queued
+        self._current_status = 'queued'
+        started_job = dict(copy.deepcopy(job_model), status='running')
+        polled_job = copy.deepcopy(job_model)
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, polled_job, girder_token='s',
+                            log_write_url=1)
+        self.assertEqual(polled_job['status'], 'running')
+        self.assertFalse('callbackReceived' in polled_job)
+
+        # The started callback got to Girder before we did
+        self._current_status = 'running'
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+        self.assertEqual(job_model['status'], 'running')
+        self.assertTrue(job_model['callbackReceived'])
+
+        # The monitor run by the started callback takes the job over, without
+        # waiting for the next poll
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, started_job, girder_token='s',
+                            log_write_url=1, started=True)
+        self._hold_lease.assert_called_with(started_job, job.JOB_LEASE,
+                                            mock.ANY, 's', steal=True)
+        self.assertEqual(started_job['status'], 'running')
+        self.assertTrue(started_job['callbackReceived'])
+
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection')
+    def test_monitor_job_lease(self, get_connection, *args):
+        cluster = {'_id': 'dummy', 'type': 'ec2'}
+        job_model = {'_id': 'dummy', 'status': 'running'}
+
+        # Another monitor holds the lease, so we leave the cluster alone
+        self._hold_lease.return_value = False
+        job.monitor_job(cluster, job_model,
+                        **{'girder_token': 's', 'log_write_url': 1})
+
+        self.assertFalse(get_connection.called)
+        self.assertFalse(self._release_lease.called)
+
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job._monitor_tick')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection')
+    @mock.patch('cumulus.starcluster.tasks.job.get_monitor_engine')
+    def test_monitor_job_engine(self, get_monitor_engine, get_connection,
+                                monitor_tick, *args):
+        cluster = {'_id': 'dummy', 'type': 'ec2'}
+        job_model = {'_id': 'dummy'}
+        engine = get_monitor_engine.return_value
+
+        # The job is handed to the engine rather than polled here
+        job.monitor_job.apply(
+            args=(cluster, job_model), task_id='task1',
+            kwargs={'exit_code': 0, 'girder_token': 's', 'log_write_url': 1})
+
+        self.assertFalse(monitor_tick.called)
+        self.assertEqual(engine.add.call_count, 1)
+        monitored = engine.add.call_args[0][0]
+        self.assertEqual(monitored.key, 'dummy')
+        self.assertIs(monitored.cluster, cluster)
+        self.assertEqual(monitored.exit_code, 0)
+        self.assertEqual(monitored.holder, 'task1')
+
+        # Handed back under the same task id, so the lease is kept
+        with mock.patch.object(job.monitor_job, 'apply_async') as apply_async:
+            monitored.handoff(5)
+        self.assertEqual(apply_async.call_args[1]['task_id'], 'task1')
+
+        # Unless another shard owns the cluster
+        engine.owns.return_value = False
+        job.monitor_job(cluster, job_model,
+                        **{'girder_token': 's', 'log_write_url': 1})
+        self.assertEqual(monitor_tick.call_count, 1)
+        self.assertEqual(engine.add.call_count, 1)
+
     @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
     @mock.patch('starcluster.logger')
     @mock.patch('cumulus.starcluster.logging')
@@ -241,9 +534,7 @@ class JobTestCase(unittest.TestCase):
             'output': []
         }
 
-        MockMaster.execute_stack = [[ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1']]
+        MockMaster.execute_stack = [qstat_xml([('1', 'r')])]
 
         def _get_status(url, request):
             content = {
@@ -259,8 +550,7 @@ class JobTestCase(unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {'status': 'running', 'timings': {}, 'output': []}
-            self._set_status_called = json.loads(request.body) == expected
+            self._set_status_called = True
 
             if not self._set_status_called:
                 print json.loads(request.body)
@@ -279,7 +569,58 @@ class JobTestCase(unittest.TestCase):
             job.monitor_job(cluster, job_model, **{'girder_token': 's', 'log_write_url': 1})
 
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
-        self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
+        self.assertFalse(self._set_status_called, 'Expect no update for an unchanged job')
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    def test_monitor_job_terminating(self, retry, *args):
+        job_id = 'dummy'
+        cluster = {
+            '_id': 'jill',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': job_id,
+            'queueJobId': '1',
+            'name': 'dummy',
+            'status': 'running',
+            'output': []
+        }
+
+        # Told of the termination, so the status is checked straight away
+        self._is_terminating.return_value = True
+        MockMaster.execute_stack = [qstat_xml([('1', 'r')])]
+
+        def _get_status(url, request):
+            content = json.dumps({'status': 'terminating'})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            self._get_status_called = True
+            return httmock.response(200, content, headers, request=request)
+
+        status_url = '/api/v1/jobs/%s/status' % job_id
+        get_status = httmock.urlmatch(
+            path=r'^%s$' % status_url, method='GET')(_get_status)
+
+        with httmock.HTTMock(get_status):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+
+        self.assertTrue(self._get_status_called,
+                        'Expect get status endpoint to be hit')
+        self.assertEqual(job_model['status'], 'terminating')
 
     @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
     @mock.patch('starcluster.logger')
@@ -306,9 +647,7 @@ class JobTestCase(unittest.TestCase):
             'output': []
         }
 
-        MockMaster.execute_stack = [[ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     q     09/09/2009 14:58:14                1']]
+        MockMaster.execute_stack = [qstat_xml([('1', 'q')])]
 
         def _get_status(url, request):
             content = {
@@ -324,8 +663,7 @@ class JobTestCase(unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {'status': 'queued', 'timings': {}, 'output': []}
-            self._set_status_called = json.loads(request.body) == expected
+            self._set_status_called = True
 
             return httmock.response(200, None, {}, request=request)
 
@@ -341,7 +679,9 @@ class JobTestCase(unittest.TestCase):
             job.monitor_job(cluster, job_model, **{'girder_token': 's', 'log_write_url': 1})
 
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
-        self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
+        self.assertFalse(self._set_status_called, 'Expect no update for an unchanged job')
+        # Still being monitored
+        self.assertFalse(self._release_lease.called)
 
     @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
     @mock.patch('starcluster.logger')
@@ -370,9 +710,8 @@ class JobTestCase(unittest.TestCase):
         }
 
         conn = get_connection.return_value.__enter__.return_value
-        conn.execute.side_effect = [[ 'job-ID  prior   name       user         state submit/start at     queue  slots ja-task-ID',
-                             '-----------------------------------------------------------------------------------------',
-                             '1 0.00000 hostname   sgeadmin     r     09/09/2009 14:58:14                1'], ['i have a tail', 'asdfas'] ]
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = (0, 'i have a tail\nasdfas\npart')
 
         def _get_status(url, request):
             content = {
@@ -388,7 +727,7 @@ class JobTestCase(unittest.TestCase):
             return httmock.response(200, content, headers, request=request)
 
         def _set_status(url, request):
-            expected = {u'status': u'running', u'output': [{u'content': [u'i have a tail', u'asdfas'], u'path': u'dummy/file/path', u'tail': True}], u'timings': {}}
+            expected = {u'outputDelta': [{u'contentDelta': [u'i have a tail', u'asdfas'], u'path': u'dummy/file/path', u'tailOffset': 25, u'tailPartial': u'part'}]}
             self._set_status_called = json.loads(request.body) == expected
 
             if not self._set_status_called:
@@ -409,6 +748,128 @@ class JobTestCase(unittest.TestCase):
 
         self.assertTrue(self._get_status_called, 'Expect get status endpoint to be hit')
         self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
+        # The cluster's journal is read first, along with the status
+        self.assertEqual(conn.read_from.call_args_list,
+                         [mock.call('.cumulus_journal', 0,
+                                    max_size=1048576),
+                          mock.call('./dummy/dummy/file/path', 0,
+                                    max_size=65536)])
+
+        # The next tick should continue from the byte offset, only sending
+        # the new lines
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = (25, 'ial\n')
+
+        def _set_status_delta(url, request):
+            expected = {u'outputDelta': [{u'contentDelta': [u'partial'], u'path': u'dummy/file/path', u'tailOffset': 29, u'tailPartial': u''}]}
+            self._set_status_called = json.loads(request.body) == expected
+
+            return httmock.response(200, None, {}, request=request)
+
+        set_status = httmock.urlmatch(
+            path=r'^%s$' % status_update_url, method='PATCH')(_set_status_delta)
+
+        self._set_status_called = False
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, job_model, **{'girder_token': 's', 'log_write_url': 1})
+
+        self.assertTrue(self._set_status_called, 'Expect set status endpoint to be hit')
+        conn.read_from.assert_called_with('./dummy/dummy/file/path', 25,
+                                          max_size=65536)
+
+        # Nothing new, so nothing is sent
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = (29, '')
+        self._get_status_called = False
+        self._set_status_called = False
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, job_model, **{'girder_token': 's', 'log_write_url': 1})
+
+        self.assertFalse(self._get_status_called, 'Expect no status check for an unchanged job')
+        self.assertFalse(self._set_status_called, 'Expect no update for an unchanged job')
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection', autospec=True)
+    def test_monitor_job_retried_job(self, get_connection, retry, *args):
+        cluster = {
+            '_id': 'bill',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'status': 'queued',
+            'queuedTime': 100,
+            'output': [{'tail': True,  'path': 'out'}]
+        }
+
+        # The job carried by the retry is the one as it was when the retry
+        # was sent
+        retried = []
+        retry.side_effect = \
+            lambda *args, **kwargs: retried.append(copy.deepcopy(job_model))
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = (0, 'first\n')
+        updates = []
+
+        def _get_status(url, request):
+            content = json.dumps({'status': 'queued'})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            updates.append(json.loads(request.body))
+
+            return httmock.response(200, None, {}, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/dummy/status$', method='GET')(_get_status)
+        set_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/dummy$', method='PATCH')(_set_status)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+
+        self.assertEqual(len(retried), 1)
+        self.assertEqual(updates[0]['status'], 'running')
+        self.assertTrue('timings' in updates[0])
+
+        # The next tick is given the retried job, so only the new output is
+        # sent
+        job_model = retried[0]
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = (6, 'second\n')
+        with httmock.HTTMock(get_status, set_status):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+
+        self.assertEqual(len(updates), 2)
+        self.assertEqual(updates[1], {
+            'outputDelta': [{
+                'contentDelta': ['second'],
+                'path': 'out',
+                'tailOffset': 13,
+                'tailPartial': ''
+            }]
+        })
 
     @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
     @mock.patch('starcluster.logger')
@@ -454,7 +915,14 @@ class JobTestCase(unittest.TestCase):
         qsub_output = ['Your job 74 ("test.sh") has been submitted']
 
         conn = get_connection.return_value.__enter__.return_value
-        conn.execute.side_effect = [qconf_output, qsub_output]
+        conn.execute.side_effect = [qsub_output]
+        # nodes, parallelEnvironments, queues and schedulerVersion
+        conn.execute_many.return_value = [
+            (['master', 'node001'], 0),
+            (qconf_output, 0),
+            (['all.q'], 0),
+            (['SGE 8.1.9'], 0)
+        ]
 
         def _get_status(url, request):
             content = {
@@ -488,13 +956,28 @@ class JobTestCase(unittest.TestCase):
         set_status = httmock.urlmatch(
             path=r'^%s$' % status_update_url, method='PATCH')(_set_status)
 
-        with httmock.HTTMock(get_status, set_status):
+        self._capabilities_updates = 0
+
+        def _set_capabilities(url, request):
+            self._capabilities_updates += 1
+            self.assertTrue('capabilities' in json.loads(request.body))
+
+            return httmock.response(200, None, {}, request=request)
+
+        set_capabilities = httmock.urlmatch(
+            path=r'^/api/v1/clusters/(bob|dummy)$',
+            method='PATCH')(_set_capabilities)
+
+        with httmock.HTTMock(get_status, set_status, set_capabilities):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
                            girder_token='girder_token')
 
-        self.assertEqual(conn.execute.call_args_list[0],
-                         mock.call('qconf -sp orte'), 'Unexpected qconf command: %s' %
-                         str(MockMaster.instance.ssh.execute.call_args_list[0]))
+        # The slots come from the discovered capabilities rather than qconf
+        self.assertFalse('qconf' in str(conn.execute.call_args_list),
+                         'qconf should not be called')
+        script = conn.put.call_args_list[0][0][0].getvalue()
+        self.assertTrue('#$ -pe orte 10' in script)
+        self.assertEqual(self._capabilities_updates, 1)
 
         # Specifying and parallel environment
         job_model = {
@@ -523,9 +1006,12 @@ class JobTestCase(unittest.TestCase):
         conn.reset_mock()
         conn.execute.side_effect = [qconf_output, qsub_output]
 
-        with httmock.HTTMock(get_status, set_status):
+        # The capabilities are now cached on the cluster, however mype
+        # wasn't discovered so we fall back to qconf.
+        with httmock.HTTMock(get_status, set_status, set_capabilities):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
                            girder_token='girder_token')
+        self.assertEqual(self._capabilities_updates, 1)
         self.assertEqual(conn.execute.call_args_list[0],
                          mock.call('qconf -sp mype'), 'Unexpected qconf command: %s' %
                          str(conn.execute.call_args_list[0]))
@@ -596,7 +1082,7 @@ class JobTestCase(unittest.TestCase):
         conn.reset_mock()
         conn.execute.side_effect = [qconf_output, ['Your job 74 ("test.sh") has been submitted']]
 
-        with httmock.HTTMock(get_status, set_status):
+        with httmock.HTTMock(get_status, set_status, set_capabilities):
             job.submit_job(cluster, job_model, log_write_url='log_write_url',
                            girder_token='girder_token')
 
@@ -604,3 +1090,291 @@ class JobTestCase(unittest.TestCase):
         self.assertEqual(job_model['params']['numberOfSlots'], 10)
 
 
+
+    def test_run_script(self):
+        conn = mock.MagicMock()
+        conn.execute_many.return_value = [(['1234'], 0), ([], 0)]
+
+        self.assertEqual(job._run_script(conn, './run', ['./other']),
+                         ['1234'])
+        conn.execute_many.assert_called_once_with([
+            'chmod 700 ./run ./other && ./run',
+            'rm -f ./run ./other'
+        ])
+
+        # The script isn't run if it can't be made executable
+        conn.execute_many.return_value = [(['chmod: denied'], 1), ([], 0)]
+        with self.assertRaises(job.starcluster.exception.RemoteCommandFailed):
+            job._run_script(conn, './run')
+
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection')
+    def test_submit_job_terminating(self, get_connection, *args):
+        self._is_terminating.return_value = True
+        job_model = {
+            '_id': 'dummy',
+            'name': 'dummy',
+            'commands': ['ls'],
+            'output': []
+        }
+
+        # Nothing is asked of Girder or the cluster
+        with httmock.HTTMock():
+            job.submit_job({'_id': 'bob'}, job_model,
+                           log_write_url='log_write_url',
+                           girder_token='girder_token')
+
+        self.assertFalse(get_connection.called)
+        self._is_terminating.assert_called_once_with(job_model)
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job.monitor_process')
+    @mock.patch('cumulus.starcluster.tasks.job.monitor_job')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection')
+    def test_submit_after_termination(self, get_connection, monitor_job,
+                                      monitor_process, *args):
+        flag_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, flag_dir)
+        config = mock.patch('cumulus.config.job', create=True,
+                            new={'terminationFlagDir': flag_dir})
+        config.start()
+        self.addCleanup(config.stop)
+        self._is_terminating.side_effect = termination.is_terminating
+
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        # Both jobs were terminated, job0 has since been submitted again
+        termination.mark_terminating('job0', 1000)
+        termination.mark_terminating('job1', 1000)
+        jobs = [{
+            '_id': 'job%d' % i,
+            'name': 'sweep',
+            'commands': ['run'],
+            'output': [],
+            'submitStamp': stamp
+        } for (i, stamp) in enumerate([1001, 999])]
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.side_effect = [
+            ['Your job-array 74.1-1:1 ("sweep") has been submitted']]
+
+        self._status_requests = []
+        patches = {}
+
+        def _get_status(url, request):
+            self._status_requests.append(url.path)
+            # Girder still has the job as it was left by the termination
+            content = json.dumps({
+                'status': 'terminated',
+                'terminationStamp': 1000
+            })
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            body = json.loads(request.body)
+            job_id = url.path.split('/')[-1]
+            patches[job_id] = body
+            content = json.dumps(dict(body, _id=job_id))
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/job\d/status$', method='GET')(_get_status)
+        set_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/job\d$', method='PATCH')(_set_status)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.submit_array_job(cluster, jobs, log_write_url='log_write_url',
+                                 girder_token='girder_token')
+
+        # The earlier termination doesn't stop the new submission, the stamp
+        # is kept on the job for its later tasks. Only the local flags are
+        # checked.
+        self.assertEqual(patches.keys(), ['job0'])
+        self.assertEqual(patches['job0']['submitStamp'], 1001)
+        self.assertEqual(self._status_requests, [])
+        monitored = monitor_job.s.call_args[0][1]
+        self.assertEqual(monitored['submitStamp'], 1001)
+
+        # so its output is still uploaded
+        get_connection.reset_mock()
+        conn.execute_many.return_value = [(['1234'], 0), ([], 0)]
+        with httmock.HTTMock(get_status, set_status):
+            job.upload_job_output_to_item(cluster, monitored,
+                                          log_write_url='log_write_url',
+                                          job_dir='job0',
+                                          girder_token='girder_token')
+        self.assertTrue(get_connection.called)
+        self.assertEqual(monitor_process.delay.call_count, 1)
+
+        # but not that of the terminated one
+        get_connection.reset_mock()
+        with httmock.HTTMock(get_status, set_status):
+            job.upload_job_output_to_item(cluster, jobs[1],
+                                          log_write_url='log_write_url',
+                                          job_dir='job1',
+                                          girder_token='girder_token')
+        self.assertFalse(get_connection.called)
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.celery.monitor.Task.retry')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection', autospec=True)
+    def test_monitor_job_missed_termination(self, get_connection, retry,
+                                            *args):
+        flag_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, flag_dir)
+        config = mock.patch('cumulus.config.job', create=True,
+                            new={'terminationFlagDir': flag_dir})
+        config.start()
+        self.addCleanup(config.stop)
+        self._is_terminating.side_effect = termination.is_terminating
+
+        cluster = {
+            '_id': 'bill',
+            'type': 'ec2',
+            'name': 'dummy',
+            'config': {
+                '_id': 'dummy',
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': 'dummy',
+            'queueJobId': '1',
+            'name': 'dummy',
+            'output': [],
+            'submitStamp': 999
+        }
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.side_effect = [qstat_xml([('1', 'r')])]
+        conn.read_from.return_value = None
+
+        def _get_status(url, request):
+            # The termination broadcast never reached this worker
+            content = json.dumps({
+                'status': 'terminating',
+                'terminationStamp': 1000
+            })
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/dummy/status$', method='GET')(_get_status)
+
+        self.assertFalse(termination.is_terminating(job_model))
+        with httmock.HTTMock(get_status):
+            job.monitor_job(cluster, job_model, girder_token='s',
+                            log_write_url=1)
+
+        # The termination held by Girder is flagged for the job's other tasks
+        # on this host
+        self.assertTrue(termination.is_terminating(job_model))
+        self.assertEqual(termination.terminating_stamp('dummy'), 1000)
+
+    @mock.patch('starcluster.config.StarClusterConfig', new=MockStarClusterConfig)
+    @mock.patch('starcluster.logger')
+    @mock.patch('cumulus.starcluster.logging')
+    @mock.patch('cumulus.starcluster.tasks.job.monitor_job')
+    @mock.patch('cumulus.starcluster.tasks.job.get_connection', autospec=True)
+    def test_submit_array_job(self, get_connection, monitor_job, *args):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': 'job%d' % i,
+            'name': 'sweep',
+            'commands': ['run %d' % i],
+            'output': []
+        } for i in range(3)]
+
+        conn = get_connection.return_value.__enter__.return_value
+        conn.execute.side_effect = [
+            ['Your job-array 74.1-3:1 ("sweep") has been submitted']]
+
+        patches = {}
+
+        def _get_status(url, request):
+            content = json.dumps({'status': 'created'})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _set_status(url, request):
+            body = json.loads(request.body)
+            job_id = url.path.split('/')[-1]
+            patches[job_id] = body
+            content = json.dumps(dict(body, _id=job_id))
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        get_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/job\d/status$', method='GET')(_get_status)
+        set_status = httmock.urlmatch(
+            path=r'^/api/v1/jobs/job\d$', method='PATCH')(_set_status)
+
+        with httmock.HTTMock(get_status, set_status):
+            job.submit_array_job(cluster, jobs, log_write_url='log_write_url',
+                                 girder_token='girder_token')
+
+        # A single qsub for the whole sweep
+        self.assertEqual(conn.execute.call_count, 1)
+        self.assertEqual(conn.put.call_count, 1)
+        script = conn.put.call_args[0][0].getvalue()
+        self.assertTrue('#$ -t 1-3' in script)
+        self.assertTrue('case $SGE_TASK_ID in' in script)
+
+        for (index, job_model) in enumerate(jobs, start=1):
+            self.assertEqual(patches[job_model['_id']], {
+                'status': 'queued',
+                'queueJobId': '74',
+                'queueArrayIndex': index
+            })
+        self.assertEqual(monitor_job.s.call_count, 3)
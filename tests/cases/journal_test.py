@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.constants import JobQueueState
+from cumulus.queue.journal import JournalReader, JOURNAL_PATH, journal_key
+
+
+class JournalReaderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._conn = mock.Mock()
+        self._journal = ''
+
+        def read_from(path, offset, max_size):
+            if not self._journal:
+                return None
+            start = max(offset, len(self._journal) - max_size)
+            return (start, self._journal[start:])
+
+        self._conn.read_from.side_effect = read_from
+
+    def test_read(self):
+        reader = JournalReader()
+        reader.read(self._conn)
+        self.assertIsNone(reader.job_info('a'))
+
+        self._journal = '100 a started \n100 b started \n160 a exited 0\n1'
+        reader.read(self._conn)
+        self._conn.read_from.assert_called_with(JOURNAL_PATH, 0,
+                                                max_size=reader.max_read_size)
+        self.assertEqual(reader.job_info('a'), {
+            'state': JobQueueState.COMPLETE,
+            'exitCode': 0,
+            'elapsed': 60
+        })
+        self.assertEqual(reader.job_info('b'),
+                         {'state': JobQueueState.RUNNING})
+
+        # Only the new bytes are read, completing the partial line
+        offset = len(self._journal)
+        self._journal += '70 b exited 3\n'
+        reader.read(self._conn)
+        self._conn.read_from.assert_called_with(JOURNAL_PATH, offset,
+                                                max_size=reader.max_read_size)
+        self.assertEqual(reader.job_info('b'), {
+            'state': JobQueueState.ERROR,
+            'exitCode': 3,
+            'elapsed': 70
+        })
+
+        reader.forget('b')
+        self.assertIsNone(reader.job_info('b'))
+
+    def test_skip_ahead(self):
+        reader = JournalReader(max_read_size=20)
+        self._journal = '100 a started \n100 b started \n'
+        reader.read(self._conn)
+
+        # The partial line at the start of what was read is dropped
+        self.assertIsNone(reader.job_info('a'))
+        self.assertEqual(reader.job_info('b'),
+                         {'state': JobQueueState.RUNNING})
+        self.assertEqual(reader.offset, len(self._journal))
+
+    def test_retention(self):
+        reader = JournalReader(retention=60)
+        self._journal = '100 a started \n100 a exited 0\n'
+        reader.read(self._conn)
+        self.assertIsNotNone(reader.job_info('a'))
+
+        self._journal += '200 b started \n200 b exited 0\n'
+        reader.read(self._conn)
+        self.assertIsNone(reader.job_info('a'))
+        self.assertIsNotNone(reader.job_info('b'))
+
+    def test_resubmitted(self):
+        job = {'_id': 'a', 'submitStamp': 100.0}
+        self.assertEqual(journal_key({'_id': 'a'}), 'a')
+        self.assertEqual(journal_key(job), 'a:100.000000')
+
+        reader = JournalReader()
+        self._journal = '100 a:100.000000 started \n160 a:100.000000 exited 0\n'
+        reader.read(self._conn)
+
+        # The exit of the earlier run isn't taken for the new submission
+        job['submitStamp'] = 200.0
+        self.assertIsNone(reader.job_info(journal_key(job)))
+
+        self._journal += '200 a:200.000000 started \n'
+        reader.read(self._conn)
+        self.assertEqual(reader.job_info(journal_key(job)),
+                         {'state': JobQueueState.RUNNING})
@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import httmock
+import json
+
+from cumulus.common.lease import hold_lease, release_lease, process_lease
+
+
+class LeaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._requests = []
+        self._held_by = None
+
+        def _acquire(url, request):
+            body = json.loads(request.body)
+            self._requests.append(('PUT', body))
+            if self._held_by not in [None, body['holder']] \
+                    and not body['steal']:
+                return httmock.response(409, None, {}, request=request)
+            self._held_by = body['holder']
+
+            return httmock.response(200, None, {}, request=request)
+
+        def _release(url, request):
+            self._requests.append(('DELETE', url.query))
+            self._held_by = None
+
+            return httmock.response(200, None, {}, request=request)
+
+        lease_url = r'^/api/v1/jobs/dummy/leases/job$'
+        self._mock = httmock.HTTMock(
+            httmock.urlmatch(path=lease_url, method='PUT')(_acquire),
+            httmock.urlmatch(path=lease_url, method='DELETE')(_release))
+
+    @mock.patch('cumulus.config.monitor', new={'leaseTimeout': 100},
+                create=True)
+    def test_hold(self):
+        job = {'_id': 'dummy'}
+
+        with self._mock:
+            self.assertTrue(hold_lease(job, 'job', 'task1', 'token'))
+            self.assertEqual(self._requests, [
+                ('PUT', {'holder': 'task1', 'ttl': 100, 'steal': False})])
+
+            # Renewed with Girder on every tick
+            self.assertTrue(hold_lease(job, 'job', 'task1', 'token'))
+            self.assertEqual(len(self._requests), 2)
+
+            # A second monitor for the job doesn't get it
+            self.assertFalse(hold_lease(job, 'job', 'task2', 'token'))
+
+            # unless it takes it over
+            self.assertTrue(hold_lease(job, 'job', 'task2', 'token',
+                                       steal=True))
+            self.assertEqual(self._held_by, 'task2')
+
+            # so the first monitor finds out on its next tick
+            self.assertFalse(hold_lease(job, 'job', 'task1', 'token'))
+
+            release_lease(job, 'job', 'task2', 'token')
+            self.assertEqual(self._requests[-1],
+                             ('DELETE', 'holder=task2'))
+            self.assertIsNone(self._held_by)
+
+    def test_process_lease(self):
+        self.assertEqual(process_lease(1234), 'process-1234')
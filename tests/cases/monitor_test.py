@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import threading
+import time
+
+from cumulus.celery.routing import shard_of
+from cumulus.common.monitor import MonitorEngine
+
+
+class MockMonitoredJob(object):
+    def __init__(self, key, cluster_id, countdowns, error=None,
+                 girder_token='token'):
+        self.key = key
+        self.cluster = {'_id': cluster_id}
+        self.girder_token = girder_token
+        self.countdowns = list(countdowns)
+        self.error = error
+        self.ticks = 0
+        self.conns = []
+        self.failures = []
+        self.handed_off = None
+        self.done = threading.Event()
+
+    def tick(self, task, conn):
+        self.ticks += 1
+        self.conns.append(conn)
+        if self.error:
+            raise self.error
+        if self.countdowns:
+            task.retry(throw=False, countdown=self.countdowns.pop(0))
+        else:
+            self.done.set()
+
+    def failed(self, ex):
+        self.failures.append(ex)
+        self.done.set()
+
+    def handoff(self, countdown):
+        self.handed_off = countdown
+
+
+class MonitorEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._connections = []
+
+        def _connect(girder_token, cluster):
+            conn = mock.MagicMock()
+            conn.__enter__.return_value = conn
+            conn.girder_token = girder_token
+            self._connections.append(cluster['_id'])
+            return conn
+
+        self._engine = MonitorEngine(connect=_connect)
+
+    def tearDown(self):
+        self._engine.stop()
+
+    def _wait(self, jobs):
+        for job in jobs:
+            self.assertTrue(job.done.wait(5))
+
+        # Let the loops exit
+        for _ in range(500):
+            if not self._engine.jobs():
+                break
+            time.sleep(0.01)
+
+    def test_jobs_share_cluster_loop(self):
+        jobs = [MockMonitoredJob('a', 'c1', [0.05] * 2),
+                MockMonitoredJob('b', 'c1', [0.05] * 2),
+                MockMonitoredJob('c', 'c2', [])]
+
+        self._engine.add(jobs[0])
+        self._engine.add(jobs[1])
+        self._engine.add(jobs[2])
+        self._wait(jobs)
+
+        self.assertEqual([job.ticks for job in jobs], [3, 3, 1])
+        self.assertEqual(self._engine.jobs(), {})
+        # Jobs due together on a cluster share a connection
+        self.assertTrue(self._connections.count('c1') < 6)
+        self.assertEqual(self._connections.count('c2'), 1)
+
+    def test_jobs_grouped_by_token(self):
+        jobs = [MockMonitoredJob('a', 'c1', [0.05], girder_token='t1'),
+                MockMonitoredJob('b', 'c1', [0.05], girder_token='t2'),
+                MockMonitoredJob('c', 'c1', [0.05], girder_token='t1')]
+
+        for job in jobs:
+            self._engine.add(job)
+        self._wait(jobs)
+
+        # Each job is only moved on over a connection made with its own token
+        for job in jobs:
+            self.assertEqual(job.ticks, 2)
+            self.assertEqual([conn.girder_token for conn in job.conns],
+                             [job.girder_token] * 2)
+
+    def test_readd_replaces(self):
+        job = MockMonitoredJob('a', 'c1', [60])
+        self._engine.add(job)
+        for _ in range(500):
+            if job.ticks:
+                break
+            time.sleep(0.01)
+
+        self.assertEqual(self._engine.jobs(), {'c1': ['a']})
+
+        # Added again, by an exit callback for example, runs it straight away
+        again = MockMonitoredJob('a', 'c1', [])
+        self._engine.add(again)
+        self._wait([again])
+
+        self.assertEqual(job.ticks, 1)
+        self.assertEqual(again.ticks, 1)
+        self.assertEqual(self._engine.jobs(), {})
+
+    def test_failure(self):
+        error = Exception('bang')
+        job = MockMonitoredJob('a', 'c1', [], error=error)
+        self._engine.add(job)
+        self._wait([job])
+
+        self.assertEqual(job.failures, [error])
+        self.assertEqual(self._engine.jobs(), {})
+
+        # Failing to connect fails the jobs due
+        def _connect(girder_token, cluster):
+            raise error
+
+        self._engine.connect = _connect
+        job = MockMonitoredJob('b', 'c1', [])
+        self._engine.add(job)
+        self._wait([job])
+
+        self.assertEqual(job.ticks, 0)
+        self.assertEqual(job.failures, [error])
+
+    def test_stop_hands_off(self):
+        job = MockMonitoredJob('a', 'c1', [60])
+        self._engine.add(job)
+        for _ in range(500):
+            if job.ticks:
+                break
+            time.sleep(0.01)
+
+        self._engine.stop()
+
+        self.assertTrue(0 < job.handed_off <= 60)
+        self.assertEqual(self._engine.jobs(), {})
+        self.assertFalse(self._engine.add(MockMonitoredJob('b', 'c1', [])))
+
+    def test_shards(self):
+        cluster_ids = ['%024x' % i for i in range(100)]
+
+        engines = [MonitorEngine(shard=i, shards=4) for i in range(4)]
+        for cluster_id in cluster_ids:
+            owners = [e for e in engines if e.owns({'_id': cluster_id})]
+            self.assertEqual(owners, [engines[shard_of(cluster_id, 4)]])
+
+        # Without a shard the engine owns the clusters routed to it
+        engine = MonitorEngine(shards=4)
+        for cluster_id in cluster_ids:
+            self.assertTrue(engine.owns({'_id': cluster_id}))
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import hashlib
+import os
+import shutil
+import StringIO
+import subprocess
+import tempfile
+import threading
+
+import cumulus
+from cumulus.transport import get_connection
+from cumulus.transport import parallel
+from cumulus.transport.parallel import TransferVerificationException
+from cumulus.transport.pool import get_ssh_pool
+
+
+class LocalFile(object):
+    """
+    Enough of paramiko's SFTPFile backed by a local file.
+    """
+    written = 0
+
+    def __init__(self, path, mode):
+        self._fp = open(path, mode + 'b')
+
+    def set_pipelined(self, pipelined=True):
+        pass
+
+    def seek(self, offset):
+        self._fp.seek(offset)
+
+    def write(self, data):
+        LocalFile.written += len(data)
+        self._fp.write(data)
+
+    def read(self, size=-1):
+        return self._fp.read(size)
+
+    def truncate(self, size):
+        self._fp.truncate(size)
+
+    def prefetch(self):
+        pass
+
+    def stat(self):
+        return os.fstat(self._fp.fileno())
+
+    def readv(self, chunks):
+        for (offset, length) in chunks:
+            self._fp.seek(offset)
+            yield self._fp.read(length)
+
+    def close(self):
+        self._fp.close()
+
+
+class LocalSftp(object):
+    sessions = 0
+    threads = set()
+
+    def __init__(self):
+        LocalSftp.sessions += 1
+        self.sock = mock.Mock(closed=False)
+
+    def open(self, path, mode='r'):
+        LocalSftp.threads.add(threading.current_thread().ident)
+        return LocalFile(path, mode)
+
+    def stat(self, path):
+        try:
+            return os.stat(path)
+        except OSError as ex:
+            raise IOError(str(ex))
+
+    def truncate(self, path, size):
+        with open(path, 'r+b') as fp:
+            fp.truncate(size)
+
+    def putfo(self, stream, path):
+        with open(path, 'wb') as fp:
+            data = stream.read()
+            LocalFile.written += len(data)
+            fp.write(data)
+
+    def close(self):
+        pass
+
+
+def _execute_locally(command, **kwargs):
+    p = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE)
+    (stdout, _) = p.communicate()
+
+    return stdout.split('\n')
+
+
+class ParallelTransferTestCase(unittest.TestCase):
+
+    def setUp(self):
+        LocalFile.written = 0
+        LocalSftp.sessions = 0
+        LocalSftp.threads = set()
+        self._dir = tempfile.mkdtemp()
+        self._path = os.path.join(self._dir, 'test.dat')
+        self._data = os.urandom(1024 * 100 + 7)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_put(self):
+        md5 = parallel.put(LocalSftp, StringIO.StringIO(self._data),
+                           self._path, part_size=1024, concurrency=4)
+
+        with open(self._path, 'rb') as fp:
+            self.assertEqual(fp.read(), self._data)
+        self.assertEqual(md5, hashlib.md5(self._data).hexdigest())
+        # One session to create the file and one per worker
+        self.assertEqual(LocalSftp.sessions, 5)
+
+    def test_get(self):
+        with open(self._path, 'wb') as fp:
+            fp.write(self._data)
+
+        local_file = tempfile.TemporaryFile()
+        md5 = parallel.get(LocalSftp, self._path, len(self._data),
+                           local_file, part_size=1024, concurrency=4)
+
+        self.assertEqual(local_file.read(), self._data)
+        self.assertEqual(md5, hashlib.md5(self._data).hexdigest())
+        self.assertTrue(len(LocalSftp.threads) > 1)
+
+    def test_error(self):
+        def _open_sftp():
+            sftp = LocalSftp()
+            sftp.open = mock.Mock(side_effect=IOError('No such file'))
+
+            return sftp
+
+        local_file = tempfile.TemporaryFile()
+        with self.assertRaises(IOError):
+            parallel.get(_open_sftp, self._path, len(self._data),
+                         local_file, part_size=1024, concurrency=4)
+
+    def _cluster(self):
+        cluster_id = '55c3a698f6571011a48f6819'
+        self._key_path = os.path.join(cumulus.config.ssh.keyStore, cluster_id)
+        with open(self._key_path, 'w') as fp:
+            fp.write('bogus')
+
+        return {
+            '_id': cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_ssh_put_get(self, SSHClient):
+        cluster = self._cluster()
+        client = SSHClient.return_value
+        client.transport.open_sftp_client.side_effect = LocalSftp
+        client.execute.return_value \
+            = ['%s  %s' % (hashlib.md5(self._data).hexdigest(), self._path)]
+
+        try:
+            with get_connection('girder_token', cluster) as conn:
+                conn.put(StringIO.StringIO(self._data), self._path,
+                         parallel=True, part_size=1024, verify=True)
+                with conn.get(self._path, parallel=True, part_size=1024,
+                              verify=True) as fp:
+                    self.assertEqual(fp.read(), self._data)
+
+                # The checksum of the remote file no longer matches
+                client.execute.return_value = ['bogus  %s' % self._path]
+                with self.assertRaises(TransferVerificationException):
+                    conn.put(StringIO.StringIO(self._data), self._path,
+                             parallel=True, part_size=1024, verify=True)
+        finally:
+            get_ssh_pool().clear()
+            os.remove(self._key_path)
+
+    @mock.patch.dict(cumulus.config.transport, {'resumeBlockSize': 1024})
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_ssh_put_resume(self, SSHClient):
+        cluster = self._cluster()
+        client = SSHClient.return_value
+        client.transport.open_sftp_client.side_effect = LocalSftp
+        client.execute.side_effect = _execute_locally
+
+        try:
+            for use_parallel in [False, True]:
+                # A partial copy with a corrupt third block
+                with open(self._path, 'wb') as fp:
+                    fp.write(self._data[:2048] + 'x' * 1024 +
+                             self._data[3072:4000])
+
+                LocalFile.written = 0
+                with get_connection('girder_token', cluster) as conn:
+                    conn.put(StringIO.StringIO(self._data), self._path,
+                             parallel=use_parallel, part_size=1024,
+                             verify=True, resume=True)
+
+                with open(self._path, 'rb') as fp:
+                    self.assertEqual(fp.read(), self._data)
+                # Only data after the matching prefix should be written
+                self.assertEqual(LocalFile.written, len(self._data) - 2048)
+
+            # If there is no partial copy the whole file is written
+            os.remove(self._path)
+            LocalFile.written = 0
+            with get_connection('girder_token', cluster) as conn:
+                conn.put(StringIO.StringIO(self._data), self._path,
+                         resume=True)
+            self.assertEqual(LocalFile.written, len(self._data))
+        finally:
+            get_ssh_pool().clear()
+            os.remove(self._key_path)
+
+    @mock.patch.dict(cumulus.config.transport, {'resumeBlockSize': 1024})
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_ssh_get_file_resume(self, SSHClient):
+        cluster = self._cluster()
+        client = SSHClient.return_value
+        client.transport.open_sftp_client.side_effect = LocalSftp
+        client.execute.side_effect = _execute_locally
+        with open(self._path, 'wb') as fp:
+            fp.write(self._data)
+        local_path = os.path.join(self._dir, 'local.dat')
+
+        try:
+            with open(local_path, 'wb') as fp:
+                fp.write(self._data[:5000])
+
+            with get_connection('girder_token', cluster) as conn:
+                with mock.patch.object(conn, '_get_from',
+                                       wraps=conn._get_from) as get_from:
+                    conn.get_file(self._path, local_path, resume=True)
+
+            with open(local_path, 'rb') as fp:
+                self.assertEqual(fp.read(), self._data)
+            # Resumed from the last complete matching block
+            get_from.assert_called_once_with(self._path, 4096)
+        finally:
+            get_ssh_pool().clear()
+            os.remove(self._key_path)
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_ssh_read_from(self, SSHClient):
+        cluster = self._cluster()
+        client = SSHClient.return_value
+        client.transport.open_sftp_client.side_effect = LocalSftp
+        with open(self._path, 'wb') as fp:
+            fp.write('line1\nline2\n')
+
+        try:
+            with get_connection('girder_token', cluster) as conn:
+                self.assertEqual(conn.read_from(self._path, 6),
+                                 (6, 'line2\n'))
+                # Only the last max_size bytes are read
+                self.assertEqual(conn.read_from(self._path, 0, max_size=3),
+                                 (9, 'e2\n'))
+                # The file has been truncated so read from the start
+                self.assertEqual(conn.read_from(self._path, 100),
+                                 (0, 'line1\nline2\n'))
+                self.assertIsNone(
+                    conn.read_from(os.path.join(self._dir, 'missing'), 0))
+        finally:
+            get_ssh_pool().clear()
+            os.remove(self._key_path)
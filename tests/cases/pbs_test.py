@@ -60,17 +60,149 @@ class PbsQueueAdapterTestCase(unittest.TestCase):
             AbstractQueueAdapter.QUEUE_JOB_ID: job_id
         }
         job_status_output = [
-            'Job id                    Name             User            Time Use S Queue',
-            '------------------------- ---------------- --------------- -------- - -----',
-            '%s.ulex                    sleep.sh         cjh             00:00:00 C batch' % job_id,
-            '2.ulex                    sleep.sh         cjh             00:00:00 C batch'
+            '<Data><Job><Job_Id>%s.ulex</Job_Id><Job_Name>sleep.sh</Job_Name>'
+            '<job_state>C</job_state><exit_status>0</exit_status></Job>'
+            '<Job><Job_Id>2.ulex</Job_Id><Job_Name>sleep.sh</Job_Name>'
+            '<job_state>C</job_state><exit_status>0</exit_status></Job></Data>'
+            % job_id
         ]
-        expected_calls = [mock.call('qstat')]
+        expected_calls = [mock.call('qstat -x -t')]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_status(job)
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
         self.assertEqual(status, 'complete')
 
+    def test_job_statuses(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1', '2', '3', '4']]
+        job_status_output = [
+            '<Data>'
+            '<Job><Job_Id>1.ulex</Job_Id><Job_Name>sleep.sh</Job_Name>'
+            '<job_state>R</job_state><resources_used><cput>00:00:10</cput>'
+            '<mem>3412kb</mem><vmem>33152kb</vmem>'
+            '<walltime>01:00:12</walltime></resources_used></Job>'
+            '<Job><Job_Id>2.ulex</Job_Id><Job_Name>sleep.sh</Job_Name>'
+            '<job_state>Q</job_state></Job>'
+            '<Job><Job_Id>3.ulex</Job_Id><Job_Name>sleep.sh</Job_Name>'
+            '<job_state>C</job_state><exit_status>1</exit_status>'
+            '<resources_used><walltime>00:00:05</walltime></resources_used>'
+            '</Job>'
+            '</Data>'
+        ]
+        expected_calls = [mock.call('qstat -x -t')]
+        self._cluster_connection.execute.return_value = job_status_output
+        info = self._adapter.job_info(jobs)
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(info, {
+            '1': {
+                'state': 'running',
+                'elapsed': 3612,
+                'resourcesUsed': {
+                    'cput': '00:00:10',
+                    'mem': '3412kb',
+                    'vmem': '33152kb',
+                    'walltime': '01:00:12'
+                }
+            },
+            '2': {'state': 'queued'},
+            '3': {
+                'state': 'error',
+                'exitCode': 1,
+                'elapsed': 5,
+                'resourcesUsed': {'walltime': '00:00:05'}
+            },
+            '4': {'state': None}
+        })
+
+        # Tasks of array jobs are identified by their index
+        self._cluster_connection.execute.return_value = [
+            '<Data>'
+            '<Job><Job_Id>5[1].ulex</Job_Id><job_state>R</job_state></Job>'
+            '<Job><Job_Id>5[2].ulex</Job_Id><job_state>Q</job_state></Job>'
+            '</Data>'
+        ]
+        array_jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '5',
+                       AbstractQueueAdapter.QUEUE_ARRAY_INDEX: index}
+                      for index in [1, 2, 3]]
+        self.assertEqual(self._adapter.job_statuses(array_jobs), {
+            '5[1]': 'running',
+            '5[2]': 'queued',
+            '5[3]': None
+        })
+
+        # qstat outputs nothing when there are no jobs
+        self._cluster_connection.execute.return_value = ['']
+        self.assertEqual(self._adapter.job_statuses(jobs[:1]), {'1': None})
+
+    def test_discover(self):
+        # nodes, queues and schedulerVersion
+        self._cluster_connection.execute_many.return_value = [
+            (['node01               free', 'node02               job-exclusive'], 0),
+            (['Queue              Max    Tot   Ena   Str   Que   Run   Hld',
+              '----------------   ---   ----    --    --   ---   ---   ---',
+              'batch                0      1   yes   yes     0     1     0',
+              'debug                0      0   yes   yes     0     0     0'], 0),
+            (['Version: 4.2.10'], 0)
+        ]
+        capabilities = self._adapter.discover()
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['pbsnodes -l all', 'qstat -Q', 'qstat --version'])
+        self.assertEqual(capabilities, {
+            'schedulerVersion': '4.2.10',
+            'queues': ['batch', 'debug'],
+            'nodes': 2
+        })
+
+    def test_occupancy(self):
+        jobs_output = [
+            '<Data>',
+            '<Job><Job_Id>1.ulex</Job_Id><Job_Owner>cumulus@ulex</Job_Owner>'
+            '<job_state>R</job_state></Job>',
+            '<Job><Job_Id>2[1].ulex</Job_Id><Job_Owner>cumulus@ulex</Job_Owner>'
+            '<job_state>Q</job_state></Job>',
+            '<Job><Job_Id>2[2].ulex</Job_Id><Job_Owner>cumulus@ulex</Job_Owner>'
+            '<job_state>Q</job_state></Job>',
+            '<Job><Job_Id>3.ulex</Job_Id><Job_Owner>alice@ulex</Job_Owner>'
+            '<job_state>R</job_state></Job>',
+            '<Job><Job_Id>4.ulex</Job_Id><Job_Owner>alice@ulex</Job_Owner>'
+            '<job_state>C</job_state></Job>',
+            '</Data>'
+        ]
+        resources_output = [
+            'node01',
+            '     state = free',
+            '     np = 8',
+            '     jobs = 0/1.ulex, 1-2/3.ulex',
+            'node02',
+            '     state = free',
+            '     np = 8',
+            'node03',
+            '     state = job-exclusive',
+            '     np = 4',
+            '     jobs = 0-3/5.ulex',
+            'node04',
+            '     state = down,offline',
+            '     np = 4'
+        ]
+        # jobs, resources and user
+        self._cluster_connection.execute_many.return_value = [
+            (jobs_output, 0),
+            (resources_output, 0),
+            (['cumulus'], 0)
+        ]
+        occupancy = self._adapter.occupancy()
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['qstat -x -t', 'pbsnodes -a', 'whoami'])
+        self.assertEqual(occupancy, {
+            'pending': 2,
+            'running': 2,
+            'user': {'pending': 2, 'running': 1},
+            'freeNodes': 1,
+            'totalNodes': 4,
+            'freeSlots': 13,
+            'totalSlots': 24
+        })
+
     def test_submission_template_pbs(self):
         cluster = {
             '_id': 'dummy',
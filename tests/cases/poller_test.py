@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.constants import JobQueueState
+from cumulus.queue.poller import QueueStatusPoller
+
+
+class QueueStatusPollerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._cluster = {'_id': 'cluster'}
+        self._adapter = mock.Mock()
+        self._adapter.job_info.side_effect = self._job_info
+        self._states = {}
+
+    def _job_info(self, jobs):
+        return {job['queueJobId']: {
+                    'state': self._states.get(job['queueJobId'])
+                }
+                for job in jobs}
+
+    def _jobs_queried(self, call):
+        return sorted(job['queueJobId'] for job in call[0][0])
+
+    @mock.patch('cumulus.queue.poller.time.time')
+    def test_batched(self, time):
+        time.return_value = 0
+        poller = QueueStatusPoller(timeout=4, active_timeout=60)
+        jobs = [{'queueJobId': str(i)} for i in range(3)]
+        self._states = {
+            '0': JobQueueState.RUNNING,
+            '1': JobQueueState.QUEUED,
+            '2': JobQueueState.RUNNING
+        }
+
+        # The first cycle registers the jobs as they are polled
+        for job in jobs:
+            poller.job_status(self._cluster, self._adapter, job)
+        self.assertEqual(self._adapter.job_info.call_count, 3)
+
+        # The next cycle makes one query for all the jobs on the cluster
+        self._adapter.job_info.reset_mock()
+        time.return_value = 5
+        states = [poller.job_status(self._cluster, self._adapter, job)
+                  for job in jobs]
+        self.assertEqual(states, [JobQueueState.RUNNING, JobQueueState.QUEUED,
+                                  JobQueueState.RUNNING])
+        self.assertEqual(self._adapter.job_info.call_count, 1)
+        self.assertEqual(
+            self._jobs_queried(self._adapter.job_info.call_args),
+            ['0', '1', '2'])
+
+        # Other clusters are queried separately
+        other_cluster = {'_id': 'other'}
+        poller.job_status(other_cluster, self._adapter, {'queueJobId': '9'})
+        self.assertEqual(self._adapter.job_info.call_count, 2)
+        self.assertEqual(
+            self._jobs_queried(self._adapter.job_info.call_args), ['9'])
+
+    @mock.patch('cumulus.queue.poller.time.time')
+    def test_inactive_jobs_dropped(self, time):
+        time.return_value = 0
+        poller = QueueStatusPoller(timeout=4, active_timeout=60)
+        self._states = {
+            '0': JobQueueState.RUNNING,
+            '1': JobQueueState.RUNNING
+        }
+        for i in range(3):
+            poller.job_status(self._cluster, self._adapter,
+                              {'queueJobId': str(i)})
+
+        # Job 2 has left the queue and job 1 is no longer being monitored
+        time.return_value = 100
+        poller.job_status(self._cluster, self._adapter, {'queueJobId': '0'})
+        self.assertEqual(
+            self._jobs_queried(self._adapter.job_info.call_args), ['0'])
+
+    @mock.patch('cumulus.queue.poller.time.time')
+    def test_journal(self, time):
+        time.return_value = 1000
+        poller = QueueStatusPoller(timeout=4, active_timeout=120,
+                                   verify_interval=60)
+        jobs = [{'_id': 'job%d' % i, 'queueJobId': str(i)} for i in range(3)]
+        self._states = {
+            '0': JobQueueState.RUNNING,
+            '1': JobQueueState.RUNNING,
+            '2': JobQueueState.QUEUED
+        }
+        conn = mock.Mock()
+        conn.read_from.return_value = None
+        for job in jobs:
+            poller.job_status(self._cluster, self._adapter, job, conn)
+
+        # Job 0 has exited and job 1 is running, so only the queued job needs
+        # the scheduler
+        conn.read_from.return_value = \
+            (0, '1000 job0 started \n1003 job1 started \n1004 job0 exited 2\n')
+        self._adapter.job_info.reset_mock()
+        time.return_value = 1005
+        info = poller.job_info(self._cluster, self._adapter, jobs[0], conn)
+        self.assertEqual(info, {'state': JobQueueState.ERROR, 'exitCode': 2,
+                                'elapsed': 4})
+        self.assertEqual(
+            poller.job_status(self._cluster, self._adapter, jobs[1], conn),
+            JobQueueState.RUNNING)
+        self.assertEqual(conn.read_from.call_count, 4)
+        self.assertEqual(self._adapter.job_info.call_count, 1)
+        self.assertEqual(
+            self._jobs_queried(self._adapter.job_info.call_args), ['2'])
+
+        # Running jobs are checked with the scheduler every verify interval,
+        # in case they were killed before recording their exit
+        conn.read_from.return_value = None
+        self._states['1'] = None
+        time.return_value = 1060
+        self.assertIsNone(
+            poller.job_status(self._cluster, self._adapter, jobs[1], conn))
+        self.assertEqual(
+            self._jobs_queried(self._adapter.job_info.call_args), ['1', '2'])
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.common.polling import next_interval, polling_limits
+
+LIMITS = {
+    'minInterval': 5,
+    'maxInterval': 300,
+    'backoff': 2,
+    'fastPeriod': 60
+}
+
+
+@mock.patch('cumulus.config', new={'polling': LIMITS})
+class PollingTestCase(unittest.TestCase):
+
+    def _intervals(self, state, status, start, end, **kwargs):
+        now = start
+        intervals = []
+        while now < end:
+            interval = next_interval(state, status, now=now, **kwargs)
+            intervals.append(interval)
+            now += interval
+
+        return intervals
+
+    def test_backoff(self):
+        state = {}
+        intervals = self._intervals(state, 'queued', 0, 3 * 24 * 60 * 60)
+
+        # Fast for the first minute, then backing off to the maximum
+        self.assertEqual(intervals[:16], [5] * 12 + [10, 20, 40, 80])
+        self.assertEqual(max(intervals), 300)
+        self.assertTrue(len(intervals) < 900)
+
+        # A state change goes back to fast polling
+        now = state['since'] + 300
+        self.assertEqual(next_interval(state, 'running', now=now), 5)
+
+    def test_runtime_hint(self):
+        state = {}
+        intervals = self._intervals(state, 'running', 0, 200,
+                                    runtime_hint=150)
+
+        # Polling isn't delayed past the expected runtime
+        self.assertEqual(intervals[12:15], [10, 20, 40])
+        self.assertEqual(sum(intervals[:16]), 150)
+
+    def test_cluster_limits(self):
+        cluster = {
+            'config': {
+                'polling': {
+                    'maxInterval': 60
+                }
+            }
+        }
+        self.assertEqual(polling_limits(cluster), dict(LIMITS,
+                                                       maxInterval=60))
+
+        intervals = self._intervals({}, 'queued', 0, 24 * 60 * 60,
+                                    cluster=cluster)
+        self.assertEqual(max(intervals), 60)
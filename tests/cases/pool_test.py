@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+import os
+
+import cumulus
+from cumulus.transport import get_connection
+from cumulus.transport.pool import ConnectionPool, PoolExhaustedException
+from cumulus.transport import pool
+
+
+class MockClient(object):
+    def __init__(self):
+        self.active = True
+        self.closed = False
+
+    def is_active(self):
+        return self.active
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = ConnectionPool(max_connections_per_host=2,
+                                    idle_timeout=300, wait_timeout=0)
+        self._connect_count = 0
+
+    def _connect(self):
+        self._connect_count += 1
+        return MockClient()
+
+    def test_reuse(self):
+        connection = self._pool.acquire('key', 'host', self._connect)
+        self._pool.release(connection)
+        reused = self._pool.acquire('key', 'host', self._connect)
+
+        self.assertIs(reused.client, connection.client)
+        self.assertEqual(self._connect_count, 1)
+
+        # A different key should not reuse the connection
+        other = self._pool.acquire('other', 'host', self._connect)
+        self.assertIsNot(other.client, connection.client)
+        self.assertEqual(self._connect_count, 2)
+
+    def test_liveness(self):
+        connection = self._pool.acquire('key', 'host', self._connect)
+        self._pool.release(connection)
+        connection.client.active = False
+
+        new_connection = self._pool.acquire('key', 'host', self._connect)
+        self.assertIsNot(new_connection.client, connection.client)
+        self.assertTrue(connection.client.closed)
+
+    def test_discard(self):
+        connection = self._pool.acquire('key', 'host', self._connect)
+        self._pool.release(connection, discard=True)
+        self.assertTrue(connection.client.closed)
+
+        self._pool.acquire('key', 'host', self._connect)
+        self.assertEqual(self._connect_count, 2)
+
+    @mock.patch('cumulus.transport.pool.time.time')
+    def test_idle_timeout(self, time):
+        time.return_value = 1000
+        connection = self._pool.acquire('key', 'host', self._connect)
+        self._pool.release(connection)
+
+        time.return_value = 1000 + self._pool.idle_timeout + 1
+        new_connection = self._pool.acquire('key', 'host', self._connect)
+        self.assertIsNot(new_connection.client, connection.client)
+        self.assertTrue(connection.client.closed)
+
+    def test_max_connections_per_host(self):
+        self._pool.acquire('key1', 'host', self._connect)
+        idle = self._pool.acquire('key2', 'host', self._connect)
+        self._pool.release(idle)
+
+        # The idle connection for key2 should be closed to make room
+        self._pool.acquire('key3', 'host', self._connect)
+        self.assertTrue(idle.client.closed)
+
+        # Now both connections are in use so we should time out
+        with self.assertRaises(PoolExhaustedException):
+            self._pool.acquire('key4', 'host', self._connect)
+
+        # Other hosts are not affected
+        self._pool.acquire('key4', 'host2', self._connect)
+
+    def test_connect_failure(self):
+        def _connect():
+            raise Exception('Unable to connect')
+
+        for _ in range(3):
+            with self.assertRaises(Exception):
+                self._pool.acquire('key', 'host', _connect)
+
+        # Failed connections shouldn't count against the host
+        self._pool.acquire('key', 'host', self._connect)
+        self._pool.acquire('key', 'host', self._connect)
+
+
+class SshConnectionPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        pool._ssh_pool = None
+        self._cluster_id = '55c3a698f6571011a48f6818'
+        self._key_path = os.path.join(cumulus.config.ssh.keyStore,
+                                      self._cluster_id)
+        with open(self._key_path, 'w') as fp:
+            fp.write('bogus')
+
+        self._cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+
+    def tearDown(self):
+        pool._ssh_pool = None
+        try:
+            os.remove(self._key_path)
+        except OSError:
+            pass
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_get_connection_pooled(self, SSHClient):
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.execute('ls')
+
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.execute('ls')
+
+        self.assertEqual(SSHClient.call_count, 1)
+        self.assertEqual(SSHClient.return_value.connect.call_count, 1)
+        self.assertEqual(SSHClient.return_value.close.call_count, 0)
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_get_connection_error(self, SSHClient):
+        with self.assertRaises(EOFError):
+            with get_connection('girder_token', self._cluster) as conn:
+                raise EOFError()
+
+        self.assertEqual(SSHClient.return_value.close.call_count, 1)
+
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.execute('ls')
+
+        self.assertEqual(SSHClient.call_count, 2)
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_sftp_session_reused(self, SSHClient):
+        transport = SSHClient.return_value.transport
+        sftp = transport.open_sftp_client.return_value
+        sftp.sock.closed = False
+
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.stat('/tmp')
+            conn.isfile('/tmp')
+            conn.mkdir('/tmp/test')
+            list(conn.list('/tmp'))
+
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.remove('/tmp/test')
+
+        self.assertEqual(transport.open_sftp_client.call_count, 1)
+
+        # If the channel has closed a new session should be opened
+        sftp.sock.closed = True
+        with get_connection('girder_token', self._cluster) as conn:
+            conn.stat('/tmp')
+
+        self.assertEqual(transport.open_sftp_client.call_count, 2)
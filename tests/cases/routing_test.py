@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+import unittest
+import mock
+
+from cumulus.celery.routing import (ClusterAffinityRouter, ShardClaimer,
+                                    shard_of, shard_owner, shard_queue,
+                                    ANNOUNCE_EVENT, ANNOUNCE_ROUTING_KEY)
+
+MONITOR_JOB = 'cumulus.starcluster.tasks.job.monitor_job'
+
+
+class RoutingTestCase(unittest.TestCase):
+
+    def test_shard_of(self):
+        cluster_ids = ['%024x' % i for i in range(100)]
+        shards = [shard_of(cluster_id, 4) for cluster_id in cluster_ids]
+
+        self.assertEqual(set(shards), set(range(4)))
+        self.assertEqual(shards, [shard_of(id, 4) for id in cluster_ids])
+
+    def test_shard_owner(self):
+        members = ['a@host', 'b@host', 'c@host']
+        owners = [shard_owner(shard, members) for shard in range(64)]
+        self.assertEqual(set(owners), set(members))
+        self.assertIsNone(shard_owner(0, []))
+
+        # Only the shards of the member leaving move
+        remaining = [shard_owner(shard, members[:2]) for shard in range(64)]
+        for (owner, now) in zip(owners, remaining):
+            if owner != 'c@host':
+                self.assertEqual(owner, now)
+
+    def test_router(self):
+        router = ClusterAffinityRouter()
+        cluster = {'_id': 'dummy'}
+
+        with mock.patch('cumulus.config', new={'monitor': {'shards': 4}}):
+            route = router.route_for_task(MONITOR_JOB, args=(cluster, {}))
+            self.assertEqual(route,
+                             {'queue': shard_queue(shard_of('dummy', 4))})
+            route = router.route_for_task(MONITOR_JOB,
+                                          kwargs={'cluster': cluster})
+            self.assertEqual(route,
+                             {'queue': shard_queue(shard_of('dummy', 4))})
+
+            # Left to the other routes
+            self.assertIsNone(router.route_for_task(
+                'cumulus.task.status.monitor_status', args=(cluster,)))
+            self.assertIsNone(router.route_for_task(MONITOR_JOB, args=()))
+
+        with mock.patch('cumulus.config', new={'monitor': {'shards': 1}}):
+            self.assertIsNone(router.route_for_task(MONITOR_JOB,
+                                                    args=(cluster, {})))
+
+
+class ShardClaimerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._consumer = mock.Mock()
+        self._consumer.hostname = 'a@host'
+        self._consumer.gossip.enabled = True
+        self._consumer.gossip.event_handlers = {}
+        self._queues = set()
+
+        def _add(queue):
+            self._queues.add(queue)
+
+        def _cancel(queue):
+            self._queues.remove(queue)
+
+        self._consumer.add_task_queue.side_effect = _add
+        self._consumer.cancel_task_queue.side_effect = _cancel
+
+    def _claimer(self, config):
+        with mock.patch('cumulus.config', new={'monitor': config}):
+            return ShardClaimer(self._consumer)
+
+    def _owned(self, hostname, members, shards=8):
+        return set(shard_queue(shard) for shard in range(shards)
+                   if shard_owner(shard, members) == hostname)
+
+    def test_rebalance(self):
+        claimer = self._claimer({'shards': 8})
+        claimer.start(self._consumer)
+
+        # Alone, so everything is ours
+        self.assertEqual(self._queues, self._owned('a@host', ['a@host']))
+        self._consumer.event_dispatcher.send.assert_called_with(
+            ANNOUNCE_EVENT, shards=8, leaving=False)
+
+        # Another worker joins
+        on_announce = self._consumer.gossip.event_handlers[
+            ANNOUNCE_ROUTING_KEY]
+        on_announce({'hostname': 'b@host'})
+        members = ['a@host', 'b@host']
+        self.assertEqual(self._queues, self._owned('a@host', members))
+        self.assertTrue(0 < len(self._queues) < 8)
+
+        # and leaves
+        on_announce({'hostname': 'b@host', 'leaving': True})
+        self.assertEqual(len(self._queues), 8)
+
+        # or stops being heard from
+        on_announce({'hostname': 'b@host'})
+        expired = claimer.members['b@host'] + 3 * claimer.interval + 1
+        with mock.patch('time.time', return_value=expired):
+            claimer.periodic()
+        self.assertEqual(len(self._queues), 8)
+
+        claimer.stop(self._consumer)
+        self._consumer.event_dispatcher.send.assert_called_with(
+            ANNOUNCE_EVENT, shards=8, leaving=True)
+
+    def test_static(self):
+        # Pinned to a shard
+        self._claimer({'shards': 8, 'shard': 3}).start(self._consumer)
+        self.assertEqual(self._queues, set([shard_queue(3)]))
+
+        # Without gossip every worker claims every shard
+        self._queues = set()
+        self._consumer.gossip.enabled = False
+        self._claimer({'shards': 8}).start(self._consumer)
+        self.assertEqual(len(self._queues), 8)
+
+        # Not sharded
+        self._queues = set()
+        self._claimer({'shards': 1}).start(self._consumer)
+        self.assertEqual(self._queues, set())
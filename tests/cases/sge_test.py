@@ -80,16 +80,195 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
             AbstractQueueAdapter.QUEUE_JOB_ID: job_id
         }
         job_status_output = [
-            'job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID',
-            '-----------------------------------------------------------------------------------------------------------------',
-            '1126 0.50000 test.sh    cjh          r     11/18/2015 13:18:09 main.q@ulmus.kitware.com           1'
+            '<?xml version=\'1.0\'?>',
+            '<job_info  xmlns:xsd="http://gridscheduler.svn.sourceforge.net/viewvc/gridscheduler/trunk/source/dist/util/resources/schemas/qstat/qstat.xsd?revision=11">',
+            '<queue_info>',
+            '<job_list state="running">',
+            '<JB_job_number>1126</JB_job_number>',
+            '<JAT_prio>0.50000</JAT_prio>',
+            '<JB_name>test.sh</JB_name>',
+            '<JB_owner>cjh</JB_owner>',
+            '<state>r</state>',
+            '<JAT_start_time>2015-11-18T13:18:09</JAT_start_time>',
+            '<queue_name>main.q@ulmus.kitware.com</queue_name>',
+            '<slots>1</slots>',
+            '</job_list>',
+            '</queue_info>',
+            '<job_info>',
+            '</job_info>',
+            '</job_info>'
         ]
-        expected_calls = [mock.call('qstat')]
+        expected_calls = [mock.call('qstat -xml')]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_status(job)
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
         self.assertEqual(status, 'running')
 
+    def test_job_statuses(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128', '1129', '1130']]
+        job_status_output = [
+            '<?xml version=\'1.0\'?>',
+            '<job_info>',
+            '<queue_info>',
+            '<job_list state="running">',
+            '<JB_job_number>1126</JB_job_number>',
+            # Long names used to break the column layout of the plain output
+            '<JB_name>a_very_long_job_name_that_will_not_fit_in_a_column</JB_name>',
+            '<state>r</state>',
+            '</job_list>',
+            '<job_list state="running">',
+            '<JB_job_number>1131</JB_job_number>',
+            '<JB_name>test.sh</JB_name>',
+            '<state>r</state>',
+            '</job_list>',
+            '</queue_info>',
+            '<job_info>',
+            '<job_list state="pending">',
+            '<JB_job_number>1127</JB_job_number>',
+            '<JB_name>test.sh</JB_name>',
+            '<state>qw</state>',
+            '</job_list>',
+            '</job_info>',
+            '</job_info>'
+        ]
+        job_accounting_output = [
+            '==============================================================',
+            'qname        main.q',
+            'jobname      test.sh',
+            'jobnumber    1128',
+            'failed       0',
+            'exit_status  0',
+            'ru_wallclock 65',
+            'cpu          60.100',
+            'mem          0.001',
+            'maxvmem      12.000M',
+            '==============================================================',
+            'qname        main.q',
+            'jobname      test.sh',
+            'jobnumber    1129',
+            'failed       0',
+            'exit_status  3',
+            'ru_wallclock 2',
+            'error: job id 1130 not found'
+        ]
+        expected_calls = [
+            mock.call('qstat -xml'),
+            mock.call('for id in 1128 1129 1130; do qacct -j $id; done',
+                      ignore_exit_status=True)
+        ]
+        self._cluster_connection.execute.side_effect \
+            = [job_status_output, job_accounting_output]
+        info = self._adapter.job_info(jobs)
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(info, {
+            '1126': {'state': 'running'},
+            '1127': {'state': 'queued'},
+            '1128': {
+                'state': 'complete',
+                'exitCode': 0,
+                'elapsed': 65,
+                'resourcesUsed': {
+                    'cpu': '60.100',
+                    'mem': '0.001',
+                    'maxvmem': '12.000M'
+                }
+            },
+            '1129': {'state': 'error', 'exitCode': 3, 'elapsed': 2},
+            '1130': {'state': None}
+        })
+
+    def test_combined_states(self):
+        states = {
+            'Eqw': 'error',
+            'hqw': 'queued',
+            'hr': 'running',
+            'dr': 'running',
+            'Rr': 'running',
+            't': 'running',
+            's': 'queued',
+            'S': 'queued'
+        }
+        job_status_output = ['<?xml version=\'1.0\'?>', '<job_info>',
+                             '<queue_info>']
+        for (index, state) in enumerate(sorted(states)):
+            job_status_output += [
+                '<job_list state="pending">',
+                '<JB_job_number>%d</JB_job_number>' % index,
+                '<state>%s</state>' % state,
+                '</job_list>'
+            ]
+        job_status_output += ['</queue_info>', '</job_info>']
+
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: str(index)}
+                for index in range(len(states))]
+        self._cluster_connection.execute.return_value = job_status_output
+        info = self._adapter.job_info(jobs)
+        self.assertEqual(
+            {state: info[str(index)]['state']
+             for (index, state) in enumerate(sorted(states))},
+            states)
+
+    def test_array_job_statuses(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '1126',
+                 AbstractQueueAdapter.QUEUE_ARRAY_INDEX: index}
+                for index in range(1, 8)]
+        job_status_output = [
+            '<?xml version=\'1.0\'?>',
+            '<job_info>',
+            '<queue_info>',
+            '<job_list state="running">',
+            '<JB_job_number>1126</JB_job_number>',
+            '<state>r</state>',
+            '<tasks>2</tasks>',
+            '</job_list>',
+            '</queue_info>',
+            '<job_info>',
+            '<job_list state="pending">',
+            '<JB_job_number>1126</JB_job_number>',
+            '<state>qw</state>',
+            '<tasks>3-7:2</tasks>',
+            '</job_list>',
+            '</job_info>',
+            '</job_info>'
+        ]
+        job_accounting_output = [
+            '==============================================================',
+            'jobnumber    1126',
+            'taskid       1',
+            'failed       0',
+            'exit_status  0',
+            'ru_wallclock 10'
+        ]
+        expected_calls = [
+            mock.call('qstat -xml'),
+            mock.call('for id in 1126; do qacct -j $id; done',
+                      ignore_exit_status=True)
+        ]
+        self._cluster_connection.execute.side_effect \
+            = [job_status_output, job_accounting_output]
+        statuses = self._adapter.job_statuses(jobs)
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(statuses, {
+            '1126[1]': 'complete',
+            '1126[2]': 'running',
+            '1126[3]': 'queued',
+            '1126[4]': None,
+            '1126[5]': 'queued',
+            '1126[6]': None,
+            '1126[7]': 'queued'
+        })
+
+        self._cluster_connection.execute.reset_mock()
+        self._cluster_connection.execute.side_effect = None
+        self._adapter.terminate_job(jobs[1])
+        self.assertEqual(self._cluster_connection.execute.call_args_list,
+                         [mock.call('qdel 1126 -t 2')])
+
+        self.assertEqual(self._adapter._parse_job_id(
+            ['Your job-array 1127.1-10:1 ("test.sh") has been submitted']),
+            '1127')
+
     def test_unsupported(self):
         with self.assertRaises(Exception) as cm:
             get_queue_adapter({
@@ -102,6 +281,143 @@ class SgeQueueAdapterTestCase(unittest.TestCase):
 
         self.assertIsNotNone(cm.exception)
 
+    def test_occupancy(self):
+        jobs_output = [
+            '<?xml version=\'1.0\'?>',
+            '<job_info>',
+            '<queue_info>',
+            '<job_list state="running">',
+            '<JB_job_number>1126</JB_job_number>',
+            '<JB_owner>cumulus</JB_owner>',
+            '<state>r</state>',
+            '</job_list>',
+            '<job_list state="running">',
+            '<JB_job_number>1127</JB_job_number>',
+            '<JB_owner>alice</JB_owner>',
+            '<state>r</state>',
+            '</job_list>',
+            '</queue_info>',
+            '<job_info>',
+            '<job_list state="pending">',
+            '<JB_job_number>1128</JB_job_number>',
+            '<JB_owner>cumulus</JB_owner>',
+            '<state>qw</state>',
+            '<tasks>1-5:2</tasks>',
+            '</job_list>',
+            '<job_list state="pending">',
+            '<JB_job_number>1129</JB_job_number>',
+            '<JB_owner>alice</JB_owner>',
+            '<state>hqw</state>',
+            '</job_list>',
+            '</job_info>',
+            '</job_info>'
+        ]
+        resources_output = [
+            'CLUSTER QUEUE                   CQLOAD   USED    RES  AVAIL  TOTAL aoACDS  cdsuE',
+            '--------------------------------------------------------------------------------',
+            'all.q                             0.25      2      0      6      8      0      0',
+            'gpu.q                             -NA-      0      0      0      4      0      4'
+        ]
+        # jobs, resources and user
+        self._cluster_connection.execute_many.return_value = [
+            (jobs_output, 0),
+            (resources_output, 0),
+            (['cumulus'], 0)
+        ]
+        occupancy = self._adapter.occupancy()
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['qstat -u \'*\' -xml', 'qstat -g c', 'whoami'])
+        # The held job is counted as pending
+        self.assertEqual(occupancy, {
+            'pending': 4,
+            'running': 2,
+            'user': {'pending': 3, 'running': 1},
+            'freeSlots': 6,
+            'totalSlots': 12
+        })
+
+        # A failing command just leaves its part out
+        self._cluster_connection.execute_many.return_value = [
+            (['error: commlib error'], 1),
+            (resources_output, 0),
+            (['cumulus'], 0)
+        ]
+        self.assertEqual(self._adapter.occupancy(),
+                         {'freeSlots': 6, 'totalSlots': 12})
+
+    def test_submission_template_sge_array(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        jobs = [{
+            '_id': '123432423',
+            'name': 'dummy',
+            'dir': './123432423',
+            'commands': ['ls', 'mpirun -n 10 sweep {{job._id}}']
+        }, {
+            '_id': '123432424',
+            'name': 'dummy',
+            'dir': '/data/123432424',
+            'commands': ['ls', 'mpirun -n 10 sweep {{job._id}}']
+        }]
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'sge_array_submission_script.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        adapter = get_queue_adapter(cluster, self._cluster_connection)
+        script = job._generate_array_submission_script(jobs, cluster, {},
+                                                       adapter)
+        self.assertEqual(script, expected)
+
+    def test_submission_template_sge_callback(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'sge'
+                }
+            }
+        }
+        job_model = {
+            '_id': '123432423',
+            'name': 'dummy',
+            'commands': ['ls', 'sleep 20'],
+            'callbackToken': 'e9tUgtaT7Lq0SmJyUyrUm2NYV3e1WjKp'
+        }
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'sge_submission_script_callback.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        script = job._generate_submission_script(job_model, cluster, {})
+        self.assertEqual(script, expected)
+
     def test_submission_template_sge(self):
         cluster = {
             '_id': 'dummy',
@@ -61,15 +61,196 @@ class SlurmQueueAdapterTestCase(unittest.TestCase):
             AbstractQueueAdapter.QUEUE_JOB_ID: job_id
         }
         job_status_output = [
-              'JOBID PARTITION     NAME     USER  ST       TIME  NODES NODELIST(REASON)',
-              '%s general-c      hello_te cdc   R       0:14      2 f16n[10-11]' % job_id
+              '%s|R' % job_id
         ]
-        expected_calls = [mock.call('squeue -j %s' % job_id)]
+        expected_calls = [mock.call('squeue -h -r -o \'%%i|%%t\' -j %s' % job_id,
+                                    ignore_exit_status=True)]
         self._cluster_connection.execute.return_value = job_status_output
         status = self._adapter.job_status(job)
         self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
         self.assertEqual(status, 'running')
 
+    def test_job_statuses(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128', '1129']]
+        job_status_output = [
+              '1126|R',
+              '1127|PD'
+        ]
+        job_accounting_output = [
+              '1128|TIMEOUT|0:15|1-02:03:04'
+        ]
+        expected_calls = [
+            mock.call('squeue -h -r -o \'%i|%t\' -j 1126,1127,1128,1129',
+                      ignore_exit_status=True),
+            mock.call('sacct -P -n -X -o JobID,State,ExitCode,Elapsed '
+                      '-j 1128,1129', ignore_exit_status=True)
+        ]
+        self._cluster_connection.execute.side_effect \
+            = [job_status_output, job_accounting_output]
+        statuses = self._adapter.job_statuses(jobs)
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(statuses, {
+            '1126': 'running',
+            '1127': 'queued',
+            '1128': 'error',
+            '1129': None
+        })
+
+    def test_array_job_statuses(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: '1126',
+                 AbstractQueueAdapter.QUEUE_ARRAY_INDEX: index}
+                for index in [1, 2, 3, 4]]
+        job_status_output = [
+              '1126_3|R',
+              '1126_4|PD'
+        ]
+        job_accounting_output = [
+              '1126_1|COMPLETED|0:0|00:01:00',
+              '1126_2|FAILED|1:0|00:00:30'
+        ]
+        expected_calls = [
+            mock.call('squeue -h -r -o \'%i|%t\' -j 1126',
+                      ignore_exit_status=True),
+            mock.call('sacct -P -n -X -o JobID,State,ExitCode,Elapsed '
+                      '-j 1126_1,1126_2', ignore_exit_status=True)
+        ]
+        self._cluster_connection.execute.side_effect \
+            = [job_status_output, job_accounting_output]
+        statuses = self._adapter.job_statuses(jobs)
+        self.assertEqual(self._cluster_connection.execute.call_args_list, expected_calls)
+        self.assertEqual(statuses, {
+            '1126[1]': 'complete',
+            '1126[2]': 'error',
+            '1126[3]': 'running',
+            '1126[4]': 'queued'
+        })
+
+        self._cluster_connection.execute.reset_mock()
+        self._cluster_connection.execute.side_effect = None
+        self._adapter.terminate_job(jobs[1])
+        self.assertEqual(self._cluster_connection.execute.call_args_list,
+                         [mock.call('scancel 1126_2')])
+
+    def test_job_info(self):
+        jobs = [{AbstractQueueAdapter.QUEUE_JOB_ID: job_id}
+                for job_id in ['1126', '1127', '1128']]
+        job_accounting_output = [
+              '1126|COMPLETED|0:0|00:05:10',
+              '1127|FAILED|2:0|10:00',
+              '1128|CANCELLED by 1000|0:9|00:00:01'
+        ]
+        self._cluster_connection.execute.side_effect \
+            = [['slurm_load_jobs error: Invalid job id specified'],
+               job_accounting_output]
+        info = self._adapter.job_info(jobs)
+        self.assertEqual(info, {
+            '1126': {'state': 'complete', 'exitCode': 0, 'elapsed': 310},
+            '1127': {'state': 'error', 'exitCode': 2, 'elapsed': 600},
+            '1128': {'state': 'complete', 'exitCode': 0, 'elapsed': 1}
+        })
+
+    def test_discover(self):
+        # nodes, queues and schedulerVersion
+        self._cluster_connection.execute_many.return_value = [
+            (['node1', 'node2', 'node1', 'node3'], 0),
+            (['debug', 'regular'], 0),
+            (['', 'slurm 17.02.9'], 0)
+        ]
+        capabilities = self._adapter.discover()
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['sinfo -h -N -o %N', 'sinfo -h -o %R', 'sinfo --version'])
+        self.assertEqual(capabilities, {
+            'schedulerVersion': 'slurm 17.02.9',
+            'queues': ['debug', 'regular'],
+            'nodes': 3
+        })
+
+        # A failing command just leaves that capability out
+        self._cluster_connection.execute_many.return_value = [
+            (['node1'], 0),
+            (['sinfo: error: unable to load partitions'], 1),
+            (['slurm 17.02.9'], 0)
+        ]
+        capabilities = self._adapter.discover()
+        self.assertFalse('queues' in capabilities)
+        self.assertEqual(capabilities['nodes'], 1)
+
+    def test_occupancy(self):
+        jobs_output = [
+            'cumulus|R',
+            'cumulus|PD',
+            'alice|PD',
+            'alice|CG',
+            'alice|CD'
+        ]
+        # A node is listed for each partition it is in
+        resources_output = [
+            'node1|idle|0/16/0/16',
+            'node1|idle|0/16/0/16',
+            'node2|mix|12/4/0/16',
+            'node3|down*|0/0/16/16'
+        ]
+        # jobs, resources and user
+        self._cluster_connection.execute_many.return_value = [
+            (jobs_output, 0),
+            (resources_output, 0),
+            (['cumulus'], 0)
+        ]
+        occupancy = self._adapter.occupancy()
+        self._cluster_connection.execute_many.assert_called_once_with(
+            ['squeue -h -r -o \'%u|%t\'', 'sinfo -h -N -o \'%N|%t|%C\'',
+             'whoami'])
+        self.assertEqual(occupancy, {
+            'pending': 2,
+            'running': 2,
+            'user': {'pending': 1, 'running': 1},
+            'freeNodes': 1,
+            'totalNodes': 3,
+            'freeSlots': 20,
+            'totalSlots': 48
+        })
+
+    def test_submission_template_slurm_array(self):
+        cluster = {
+            '_id': 'dummy',
+            'type': 'trad',
+            'name': 'dummy',
+            'config': {
+                'host': 'dummy',
+                'ssh': {
+                    'user': 'dummy',
+                    'passphrase': 'its a secret'
+                },
+                'scheduler': {
+                    'type': 'slurm'
+                }
+            }
+        }
+        jobs = [{
+            '_id': '123432423',
+            'name': 'dummy',
+            'dir': './123432423',
+            'commands': ['ls', 'mpirun -n 10 sweep {{job._id}}']
+        }, {
+            '_id': '123432424',
+            'name': 'dummy',
+            'dir': '/data/123432424',
+            'commands': ['ls', 'mpirun -n 10 sweep {{job._id}}']
+        }]
+
+        path = os.path.join(os.environ["CUMULUS_SOURCE_DIRECTORY"],
+                            'tests', 'cases', 'fixtures', 'job',
+                            'slurm_array_submission_script.sh')
+
+        with open(path, 'r') as fp:
+            expected = fp.read()
+
+        adapter = get_queue_adapter(cluster, self._cluster_connection)
+        script = job._generate_array_submission_script(jobs, cluster, {},
+                                                       adapter)
+        self.assertEqual(script, expected)
+
     def test_submission_template(self):
         cluster = {
             '_id': 'dummy',
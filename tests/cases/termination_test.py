@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+###############################################################################
+#  Copyright 2015 Kitware Inc.
+#
+#  Licensed under the Apache License, Version 2.0 ( the "License" );
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#  See the License for the specific language governing permissions and
+#  limitations under the License.
+###############################################################################
+
+
+import unittest
+import mock
+import os
+import shutil
+import tempfile
+
+from cumulus.celery.control import cumulus_terminating, broadcast_terminating
+from cumulus.common.termination import mark_terminating, is_terminating, \
+    terminating_stamp
+
+
+class TerminationTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._flag_dir = os.path.join(tempfile.mkdtemp(), 'flags')
+        self._config = mock.patch(
+            'cumulus.config.job', create=True,
+            new={'terminationFlagDir': self._flag_dir,
+                 'terminationFlagTimeout': 100})
+        self._config.start()
+
+    def tearDown(self):
+        self._config.stop()
+        shutil.rmtree(os.path.dirname(self._flag_dir))
+
+    def test_mark(self):
+        job = {'_id': 'dummy', 'submitStamp': 1000}
+        self.assertFalse(is_terminating(job))
+
+        mark_terminating('dummy', 1001)
+        self.assertEqual(terminating_stamp('dummy'), 1001)
+        self.assertTrue(is_terminating(job))
+        self.assertTrue(is_terminating({'_id': 'dummy'}))
+        self.assertFalse(is_terminating({'_id': 'other'}))
+
+    def test_resubmitted(self):
+        mark_terminating('dummy', 1000)
+
+        # Terminated before it was submitted again
+        self.assertFalse(is_terminating({'_id': 'dummy',
+                                         'submitStamp': 1001}))
+
+    def test_prune(self):
+        mark_terminating('old', 1000)
+        old_flag = os.path.join(self._flag_dir, 'old')
+        os.utime(old_flag, (0, 0))
+
+        mark_terminating('new', 1000)
+        self.assertEqual(os.listdir(self._flag_dir), ['new'])
+
+    def test_control(self):
+        reply = cumulus_terminating(None, job_id='dummy', stamp=1000)
+        self.assertTrue('ok' in reply)
+        self.assertEqual(terminating_stamp('dummy'), 1000)
+
+        app = mock.MagicMock()
+        broadcast_terminating(app, 'dummy', 1000)
+        app.control.broadcast.assert_called_once_with(
+            'cumulus_terminating', arguments={
+                'job_id': 'dummy',
+                'stamp': 1000
+            })
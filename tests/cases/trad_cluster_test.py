@@ -69,6 +69,10 @@ class TradClusterTestCase(unittest.TestCase):
         self._set_call_value_index = 0
         def _set_status(url, request):
             expected = {'status': self._expected_status}
+            body = json.loads(request.body)
+            if 'capabilities' in body:
+                self._capabilities = body['capabilities']
+                return httmock.response(200, None, {}, request=request)
             self._set_status_called = True
             self._set_status_valid = json.loads(request.body) == expected
             self._set_status_request = request.body
@@ -90,7 +94,8 @@ class TradClusterTestCase(unittest.TestCase):
         # Mock our conn calls and try again
         def _get_cluster(url, request):
             content =   {
-                "_id": "55ef53bff657104278e8b185",
+                "_id": cluster_id,
+                "type": "trad",
                 "config": {
                     "host": "ulmus",
                     "conn": {
@@ -115,7 +120,15 @@ class TradClusterTestCase(unittest.TestCase):
 
         conn = get_connection.return_value.__enter__.return_value
         conn.execute.return_value = ['/usr/bin/qsub']
+        # nodes, parallelEnvironments, queues and schedulerVersion
+        conn.execute_many.return_value = [
+            (['node1', 'node2'], 0),
+            (['pe_name            orte', 'slots              16'], 0),
+            (['all.q'], 0),
+            (['SGE 8.1.9'], 0)
+        ]
         self._expected_status = 'running'
+        self._capabilities = None
         with httmock.HTTMock(set_status, get_cluster):
             cluster.test_connection(cluster_model, **{'girder_token': 's', 'log_write_url': 'http://localhost/log'})
 
@@ -124,4 +137,14 @@ class TradClusterTestCase(unittest.TestCase):
                         'Set status endpoint called in incorrect content: %s'
                             % self._set_status_request)
 
+        # The scheduler capabilities should have been discovered
+        self.assertIsNotNone(self._capabilities, 'Capabilities not stored')
+        del self._capabilities['updated']
+        self.assertEqual(self._capabilities, {
+            'schedulerVersion': 'SGE 8.1.9',
+            'parallelEnvironments': [{'name': 'orte', 'slots': 16}],
+            'queues': ['all.q'],
+            'nodes': 2
+        })
+
 
@@ -19,15 +19,27 @@
 
 import unittest
 import mock
+import errno
 import httmock
 import os
 import json
+import shutil
+import StringIO
+import subprocess
+import tarfile
+import tempfile
+import urlparse
+import Queue
 from jsonpath_rw import parse
 
 import cumulus
 from cumulus.ssh.tasks import key
 from cumulus.transport import get_connection
-from cumulus.transport.ssh import SshClusterConnection
+from cumulus.transport.ssh import SshClusterConnection, get_master_cache
+from cumulus.transport.pool import get_ssh_pool
+from cumulus.transport.newt_client import get_newt_client, NewtClient
+from cumulus.queue import get_queue_adapter
+from starcluster.exception import RemoteCommandFailed
 
 class TransportTestCase(unittest.TestCase):
     def setUp(self):
@@ -37,11 +49,197 @@ class TransportTestCase(unittest.TestCase):
             fp.write('bogus')
 
     def tearDown(self):
+        get_ssh_pool().clear()
+        get_master_cache().clear()
+        get_newt_client().clear()
         try:
             os.remove(self._key_path)
         except OSError:
             pass
 
+    def _run_locally(self, script):
+        p = subprocess.Popen(script, shell=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        (stdout, _) = p.communicate()
+
+        return stdout.split('\n')
+
+    def _assert_execute_many(self, conn):
+        commands = ['echo one; echo two', 'printf three', 'exit 3',
+                    'echo "it\'s quoted"']
+        results = conn.execute_many(commands)
+
+        expected = [
+            (['one', 'two'], 0),
+            (['three'], 0),
+            ([], 3),
+            (['it\'s quoted'], 0)
+        ]
+        self.assertEqual(results, expected)
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_execute_many_ssh(self, SSHClient):
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+
+        def _execute(command, **kwargs):
+            return self._run_locally(command)
+
+        SSHClient.return_value.execute.side_effect = _execute
+
+        with get_connection('girder_token', cluster) as conn:
+            self._assert_execute_many(conn)
+
+        # All commands should be issued in a single invocation
+        self.assertEqual(SSHClient.return_value.execute.call_count, 1)
+
+    def test_execute_many_newt(self):
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'host': 'cori'
+            },
+            'type': 'newt'
+        }
+        self._command_count = 0
+
+        def _session_id(url, request):
+            content = json.dumps({'sessionId': 'dummy'})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        def _command(url, request):
+            self._command_count += 1
+            executable = urlparse.parse_qs(request.body)['executable'][0]
+            content = json.dumps({
+                'output': '\n'.join(self._run_locally(executable)),
+                'error': ''
+            })
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        session_id = httmock.urlmatch(
+            path=r'^/api/v1/newt/sessionId$', method='GET')(_session_id)
+        command = httmock.urlmatch(
+            path=r'^/newt/command/cori$', method='POST')(_command)
+
+        with httmock.HTTMock(session_id, command):
+            with get_connection('girder_token', cluster) as conn:
+                self._assert_execute_many(conn)
+
+        self.assertEqual(self._command_count, 1)
+
+    def test_newt_session_shared(self):
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'host': 'cori'
+            },
+            'type': 'newt'
+        }
+        self._session_id_count = 0
+        self._cookies = []
+        self._status_code = 200
+
+        def _json_response(request, content, status_code=200):
+            content = json.dumps(content)
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(status_code, content, headers,
+                                    request=request)
+
+        def _session_id(url, request):
+            self._session_id_count += 1
+            return _json_response(request, {'sessionId': 'dummy'})
+
+        def _newt(url, request):
+            self._cookies.append(request.headers['Cookie'])
+            return _json_response(request, {
+                'output': '',
+                'error': '',
+                'status': 'OK'
+            }, self._status_code)
+
+        session_id = httmock.urlmatch(
+            path=r'^/api/v1/newt/sessionId$', method='GET')(_session_id)
+        newt = httmock.urlmatch(path=r'^/newt/.*$')(_newt)
+
+        with httmock.HTTMock(session_id, newt):
+            for _ in range(2):
+                with get_connection('girder_token', cluster) as conn:
+                    conn.execute('ls')
+                    adapter = get_queue_adapter(cluster, conn)
+                    adapter.terminate_job({'queueJobId': '1'})
+
+            # The session id should only have been fetched once
+            self.assertEqual(self._session_id_count, 1)
+            self.assertEqual(self._cookies, ['newt_sessionid=dummy'] * 4)
+
+            # If NEWT rejects the session id it should be fetched again
+            self._status_code = 403
+            with self.assertRaises(Exception):
+                with get_connection('girder_token', cluster) as conn:
+                    conn.execute('ls')
+
+            self._status_code = 200
+            with get_connection('girder_token', cluster) as conn:
+                conn.execute('ls')
+
+            self.assertEqual(self._session_id_count, 2)
+
+    @mock.patch('cumulus.transport.newt_client.time.time')
+    def test_newt_client_prune(self, time):
+        time.return_value = 1000
+        client = NewtClient(session_timeout=10)
+
+        def _session_id(url, request):
+            content = json.dumps({'sessionId': 'dummy'})
+            headers = {
+                'content-length': len(content),
+                'content-type': 'application/json'
+            }
+
+            return httmock.response(200, content, headers, request=request)
+
+        session_id = httmock.urlmatch(
+            path=r'^/api/v1/newt/sessionId$', method='GET')(_session_id)
+
+        with httmock.HTTMock(session_id):
+            client.session_id('old_token')
+        old = client.metadata('old_token', 'cori')
+        client.metadata('used_token', 'cori')
+
+        time.return_value = 1005
+        self.assertTrue(client.metadata('used_token', 'cori') is not None)
+
+        # Entries for tokens no longer in use are dropped
+        time.return_value = 1012
+        client.metadata('new_token', 'cori')
+        self.assertEqual(client._session_ids, {})
+        self.assertEqual(sorted(key for (key, _) in client._metadata),
+                         ['new_token', 'used_token'])
+        self.assertFalse(client.metadata('old_token', 'cori') is old)
+
     @mock.patch('starcluster.sshutils.SSHClient.connect')
     def test_get_ssh_connection_trad(self, connect):
         cluster = {
@@ -78,5 +276,173 @@ class TransportTestCase(unittest.TestCase):
         self.assertEqual(len(create_config_request.call_args_list),
                          1, 'The cluster configuration was not fetched')
 
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    @mock.patch('cumulus.transport.ssh.create_config_request')
+    @mock.patch('starcluster.config.StarClusterConfig')
+    def test_ec2_master_cached(self, StarClusterConfig, create_config_request,
+                               SSHClient):
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                '_id': 'dummy'
+            },
+            'type': 'ec2',
+            'name': 'mycluster',
+            'status': 'running'
+        }
+        cm = StarClusterConfig.return_value.get_cluster_manager.return_value
+        master = cm.get_cluster.return_value.master_node
+        master.addr = 'ec2-master'
+        master.key_location = '/keys/mykey.rsa'
+        master.ssh.is_active.return_value = False
+        SSHClient.return_value.is_active.return_value = False
+        cm.get_cluster.return_value.cluster_user = 'sgeadmin'
+
+        with get_connection('girder_token', cluster):
+            pass
+
+        self.assertEqual(cm.get_cluster.call_count, 1)
+
+        # The master should now be connected to directly
+        for _ in range(3):
+            with get_connection('girder_token', cluster):
+                pass
+
+        self.assertEqual(cm.get_cluster.call_count, 1)
+        self.assertEqual(create_config_request.call_count, 1)
+        SSHClient.assert_called_with(host='ec2-master', username='sgeadmin',
+                                     private_key='/keys/mykey.rsa', timeout=5)
+
+        # A change in status should cause the master to be looked up again
+        cluster['status'] = 'stopped'
+        with get_connection('girder_token', cluster):
+            pass
+
+        self.assertEqual(cm.get_cluster.call_count, 2)
+
+        # As should failing to connect to the cached master
+        SSHClient.return_value.connect.side_effect = EOFError()
+        with get_connection('girder_token', cluster):
+            pass
+
+        self.assertEqual(cm.get_cluster.call_count, 3)
+
+    @mock.patch('cumulus.transport.cache.time.time')
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_metadata_cache(self, SSHClient, time):
+        time.return_value = 1000
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+        sftp = SSHClient.return_value.transport.open_sftp_client.return_value
+        sftp.sock.closed = False
+        sftp.normalize.return_value = '/home/bob'
+        sftp.stat.side_effect = IOError(errno.ENOENT, 'No such file')
+
+        with get_connection('girder_token', cluster) as conn:
+            self.assertEqual(conn.home_dir(), '/home/bob')
+            self.assertFalse(conn.isfile('/home/bob/test.txt'))
+
+        with get_connection('girder_token', cluster) as conn:
+            self.assertEqual(conn.home_dir(), '/home/bob')
+            self.assertFalse(conn.isfile('/home/bob/test.txt'))
+
+            self.assertEqual(sftp.normalize.call_count, 1)
+            self.assertEqual(sftp.stat.call_count, 1)
+
+            # Writing through the connection should invalidate the cache
+            sftp.stat.side_effect = None
+            conn.put(mock.Mock(), '/home/bob/test.txt')
+            self.assertTrue(conn.isfile('/home/bob/test.txt'))
+            self.assertEqual(sftp.stat.call_count, 2)
+
+            conn.remove('/home/bob/test.txt')
+            conn.isfile('/home/bob/test.txt')
+            self.assertEqual(sftp.stat.call_count, 3)
+
+            # As should the entries expiring
+            time.return_value += conn._metadata().timeout + 1
+            conn.home_dir()
+            conn.isfile('/home/bob/test.txt')
+            self.assertEqual(sftp.normalize.call_count, 2)
+            self.assertEqual(sftp.stat.call_count, 4)
+
+            # Other failures aren't cached, a dead channel is retried once
+            time.return_value += conn._metadata().timeout + 1
+            sftp.stat.side_effect = EOFError()
+            for count in [6, 8]:
+                with self.assertRaises(EOFError):
+                    conn.stat('/home/bob/test.txt')
+                self.assertEqual(sftp.stat.call_count, count)
+
+    @mock.patch('cumulus.transport.ssh.SSHClient')
+    def test_put_archive_ssh(self, SSHClient):
+        cluster = {
+            '_id': self._cluster_id,
+            'config': {
+                'ssh': {
+                    'user': 'bob',
+                    'passphrase': 'test'
+                },
+                'host': 'localhost'
+            },
+            'type': 'trad'
+        }
+        channel = SSHClient.return_value.transport.open_session.return_value
+        stdin = StringIO.StringIO()
+        stdin.close = lambda: None
+        channel.makefile.return_value = stdin
+
+        output = Queue.Queue()
+        channel.recv.side_effect = lambda size: output.get()
+
+        # Run the remote command locally feeding it the archive, its output
+        # is read back from the channel
+        def _recv_exit_status():
+            command = channel.exec_command.call_args[0][0]
+            p = subprocess.Popen(command, shell=True, stdin=subprocess.PIPE,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.STDOUT)
+            data = p.communicate(stdin.getvalue())[0]
+            if data:
+                output.put(data)
+            output.put('')
+
+            return p.returncode
+        channel.recv_exit_status.side_effect = _recv_exit_status
+
+        remote_dir = tempfile.mkdtemp()
+        try:
+            with get_connection('girder_token', cluster) as conn:
+                with conn.put_archive(os.path.join(remote_dir, 'in')) as tar:
+                    info = tarfile.TarInfo('dir')
+                    info.type = tarfile.DIRTYPE
+                    tar.addfile(info)
+                    data = 'some data'
+                    info = tarfile.TarInfo('dir/test.txt')
+                    info.size = len(data)
+                    tar.addfile(info, StringIO.StringIO(data))
 
+            with open(os.path.join(remote_dir, 'in', 'dir', 'test.txt')) as fp:
+                self.assertEqual(fp.read(), 'some data')
+            self.assertEqual(channel.exec_command.call_count, 1)
+            channel.shutdown_write.assert_called_once_with()
+            channel.set_combine_stderr.assert_called_with(True)
 
+            # The output of a failed extract is reported
+            stdin.truncate(0)
+            with self.assertRaises(RemoteCommandFailed) as cm:
+                with get_connection('girder_token', cluster) as conn:
+                    with conn.put_archive(os.path.join(remote_dir, 'in')):
+                        stdin.write('not an archive' * 100)
+            self.assertTrue('tar' in cm.exception.output)
+        finally:
+            shutil.rmtree(remote_dir)